@@ -0,0 +1,199 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+import mbr
+from block_device import open_device, set_io_options, parse_size
+from fat32 import FAT32
+from ntfs import NTFS
+from catalog import SCAN_MODES
+from parallel import iter_shards, default_workers
+from batch_recovery import recover_batch
+
+VOLUME_KEYS = ("image", "volume_offset", "format", "index")  # Added to every result line, removed before recovery
+
+def find_volumes(path, offsets=None):
+    """FAT32/NTFS volumes of a disk or image: [(first_offset, format)].
+    Partitions come from the MBR, an image without one is taken as a single volume."""
+    if offsets is None:
+        offsets = [partition["first_offset"] for partition in mbr.list_partitions(path)]
+        if not offsets:
+            offsets = [0]
+
+    open_device(path)  # Raises OSError when the image cannot be read at all, e.g. zstd without zstandard
+    volumes = []
+    for offset in offsets:
+        try:
+            format_type = mbr.boot_sector_format(open_device(path).read(offset, 512))
+        except OSError:
+            continue
+        if format_type is not None:
+            volumes.append((offset, format_type))
+    return volumes
+
+def open_volume(path, offset, format_type):
+    if format_type == "FAT32":
+        return FAT32(disk=path, first_offset=offset)
+    return NTFS(disk=path, first_offset=offset)
+
+def item_filter(name=None, extensions=None, min_size=None, max_size=None):
+    """Predicate over result items built from the command-line filters."""
+    pattern = re.compile(name, re.IGNORECASE) if name else None
+    suffixes = tuple(f".{extension.lower().lstrip('.')}" for extension in extensions) if extensions else None
+
+    def wanted(item):
+        filename = item.get("name") or ""
+        size = item.get("file_size") or 0
+        if pattern is not None and not pattern.search(filename):
+            return False
+        if suffixes is not None and not filename.lower().endswith(suffixes):
+            return False
+        if min_size is not None and size < min_size:
+            return False
+        if max_size is not None and size > max_size:
+            return False
+        return True
+    return wanted
+
+def volume_name(path, offset):
+    """Name of a volume's results and recovered files: images of the same name in different folders
+    get different names through a short hash of their full path."""
+    digest = hashlib.sha1(os.path.abspath(path).encode("utf-8", "surrogateescape")).hexdigest()[:8]
+    return safe_name(f"{os.path.basename(path.rstrip(os.sep)) or 'disk'}-{digest}@{offset}")
+
+def result_path(output, path, offset):
+    """JSON-lines file of one volume's results."""
+    return os.path.join(output, f"{volume_name(path, offset)}.jsonl")
+
+def scan_volume(mode, filters, limit, output, path, offset, format_type):
+    """Process-pool worker: scan one volume, write its results as JSON lines and return its stats."""
+    started = time.perf_counter()
+    stats = {"image": path, "volume_offset": offset, "format": format_type, "mode": mode}
+    try:
+        instance = open_volume(path, offset, format_type)
+        wanted = item_filter(**filters)
+        bytes_before = instance.device.bytes_read
+        count = 0
+        results = result_path(output, path, offset)
+        with open(results, "w", encoding="utf-8") as lines:
+            for index, item in enumerate(instance.iter_deleted(mode)):
+                if not wanted(item):
+                    continue
+                lines.write(json.dumps(dict(item, image=path, volume_offset=offset, format=format_type, index=index),
+                                       ensure_ascii=False) + "\n")
+                count += 1
+                if limit is not None and count >= limit:
+                    break
+        seconds = time.perf_counter() - started
+        bytes_read = instance.device.bytes_read - bytes_before
+        stats.update({
+            "results": results,
+            "items": count,
+            "seconds": round(seconds, 3),
+            "bytes_read": bytes_read,
+            "mb_per_second": round(bytes_read / 1024 / 1024 / seconds, 1) if seconds > 0 else None,
+            "error": None,
+        })
+    except Exception as e:
+        stats.update({"items": 0, "seconds": round(time.perf_counter() - started, 3), "error": str(e)})
+    return stats
+
+def scan_command(args):
+    os.makedirs(args.output, exist_ok=True)
+    volumes = []
+    for path in args.images:
+        try:
+            found = find_volumes(path, args.offset)
+        except OSError as e:
+            print(json.dumps({"image": path, "error": str(e)}), flush=True)
+            continue
+        if not found:
+            print(json.dumps({"image": path, "error": "No FAT32 or NTFS volume found."}), flush=True)
+        volumes.extend((path, offset, format_type) for offset, format_type in found)
+
+    filters = {"name": args.name, "extensions": args.ext, "min_size": args.min_size, "max_size": args.max_size}
+    with open(os.path.join(args.output, "stats.jsonl"), "a", encoding="utf-8") as stats_file:
+        # One volume per worker process, results in the order the volumes were given
+        for _, stats in iter_shards(scan_volume, (args.mode, filters, args.limit, args.output), volumes, args.jobs):
+            line = json.dumps(stats, ensure_ascii=False)
+            stats_file.write(line + "\n")
+            stats_file.flush()
+            print(line, flush=True)
+
+def safe_name(name):
+    """A file name that can be created on Windows and Linux."""
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", name or "unnamed").strip(" .")
+    return name or "unnamed"
+
+def recover_command(args):
+    """Recover the items listed in a selection file: result lines of a scan, e.g. filtered with grep."""
+    groups = {}
+    with open(args.selection, encoding="utf-8") as selection:
+        for line in selection:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            key = (entry["image"], entry["volume_offset"], entry["format"])
+            groups.setdefault(key, []).append(entry)
+
+    failed = 0
+    for (path, offset, format_type), entries in groups.items():
+        folder = os.path.join(args.output, volume_name(path, offset))
+        try:
+            os.makedirs(folder, exist_ok=True)
+            instance = open_volume(path, offset, format_type)
+        except Exception as e:
+            # Like scan_volume: one line for the volume, the other volumes are still recovered
+            failed += len(entries)
+            print(json.dumps({"image": path, "volume_offset": offset, "items": len(entries), "error": str(e)},
+                             ensure_ascii=False), flush=True)
+            continue
+        jobs = []
+        for entry in entries:
+            item = {key: value for key, value in entry.items() if key not in VOLUME_KEYS}
+            jobs.append((item, os.path.join(folder, f"{entry['index']}_{safe_name(item.get('name'))}")))
+
+        for entry, result in zip(entries, recover_batch(instance, jobs)):  # Results come back in job order
+            failed += result["error"] is not None
+            if entry.get("reallocated_runs"):
+                result = dict(result, reallocated_runs=entry["reallocated_runs"])  # Parts that are not the original content
+            print(json.dumps(dict(result, index=entry["index"], image=path, volume_offset=offset), ensure_ascii=False), flush=True)
+    return 1 if failed else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan disk images or devices for deleted files without prompts.")
+    parser.add_argument("--direct", action="store_true", help="Read with O_DIRECT, past the page cache of this machine")
+    parser.add_argument("--min-io", type=parse_size, help="Smallest read issued, e.g. 1M for the erase block of an SD card")
+    parser.add_argument("--retry-bad", action="store_true", help="Read again the bad sectors saved by earlier runs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="Scan volumes and write their results as JSON lines")
+    scan.add_argument("images", nargs="+", help="Image files or devices")
+    scan.add_argument("--mode", choices=SCAN_MODES, default="quick")
+    scan.add_argument("--output", default="results", help="Folder for <image>-<hash>@<offset>.jsonl and stats.jsonl")
+    scan.add_argument("--jobs", type=int, default=default_workers(), help="Volumes scanned at the same time")
+    scan.add_argument("--offset", type=int, action="append", help="Volume offset in bytes (repeatable), instead of reading the MBR")
+    scan.add_argument("--name", help="Keep names matching this regular expression")
+    scan.add_argument("--ext", action="append", help="Keep names with this extension (repeatable)")
+    scan.add_argument("--min-size", type=int, help="Keep files of at least this many bytes")
+    scan.add_argument("--max-size", type=int, help="Keep files of at most this many bytes")
+    scan.add_argument("--limit", type=int, help="Stop a volume after this many results")
+
+    recover = commands.add_parser("recover", help="Recover the result lines listed in a selection file")
+    recover.add_argument("selection", help="JSON-lines file of scan results to recover")
+    recover.add_argument("--output", default="recovered", help="Destination folder, one subfolder per volume")
+
+    args = parser.parse_args(argv)
+    set_io_options(args.direct, args.min_io, args.retry_bad)
+    if args.command == "scan":
+        scan_command(args)
+        return 0
+    return recover_command(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import os
+import queue
+import threading
+import time
+
+from block_device import COPY_BUFFER_SIZE, MappedImage, copy_range, write_all, unreadable_bytes
+from progress import ScanProgress, cancelled
+
+PIPELINE_DEPTH = 16  # Chunks read ahead of the writer, at most PIPELINE_DEPTH * buffer_size bytes in flight
+
+def disk_location(segments):
+    """Offset of the first disk range of a file, for ordering reads. Files with no disk range go first."""
+    return next((value for kind, value, _ in segments if kind == "disk"), -1)
+
+def plan_batch(instance, jobs):
+    """Segments of every (item, path) job, sorted by disk location.
+    Returns (planned, failed): planned holds (job index, item, path, segments),
+    failed holds the results of jobs whose layout could not be read."""
+    planned = []
+    failed = []
+    for index, (item, path) in enumerate(jobs):
+        try:
+            planned.append((index, item, path, instance.file_segments(item)))
+        except Exception as e:
+            failed.append({"index": index, "name": item.get("name"), "path": path, "bytes": 0, "unreadable": 0, "error": str(e)})
+    planned.sort(key=lambda job: disk_location(job[3]))
+    return planned, failed
+
+def read_chunks(device, segments, buffer_size):
+    """Chunks of one file in write order: ("data", bytes), ("zero", length) or, for disk ranges of
+    an image file, ("copy", (offset, length)) left to the writer to copy in the kernel."""
+    for kind, value, length in segments:
+        if kind == "data":
+            yield "data", value[:length]
+        elif kind == "zero":
+            yield "zero", length
+        elif isinstance(device, MappedImage):
+            yield "copy", (value, length)
+        else:
+            position = value
+            end = value + length
+            while position < end:
+                chunk = device.read_bulk(position, min(buffer_size, end - position))
+                if not chunk:
+                    raise OSError(f"Short read at offset {position}.")
+                yield "data", chunk
+                position += len(chunk)
+
+def copy_chunk(device, output, offset, length, buffer_size):
+    """Copy a disk range of an image file to output, through user space for what the kernel did not copy."""
+    position = offset + copy_range(device.handle, output, offset, length)
+    end = offset + length
+    while position < end:
+        chunk = device.read_bulk(position, min(buffer_size, end - position))
+        if not chunk:
+            raise OSError(f"Short read at offset {position}.")
+        write_all(output, chunk)
+        position += len(chunk)
+
+def recover_batch(instance, jobs, progress=None, cancel=None, buffer_size=COPY_BUFFER_SIZE, depth=PIPELINE_DEPTH):
+    """Recover many files: jobs is a list of (item, destination path).
+    Files are read in disk order by a reader thread while the calling thread writes them, through a
+    queue of at most depth chunks. Disk ranges of an image file skip the queue's buffers: the writer
+    copies them with copy_range, as write_segments does. progress(done bytes, total bytes, bytes_per_second) reports the batch.
+    A file that fails is reported and the batch goes on, a file that fails half-way is left partly written.
+    Returns one result per job, in job order:
+    {"index", "name", "path", "bytes", "unreadable", "error"} with error None on success;
+    unreadable counts the bytes of bad sectors written as zeros."""
+    stats = instance.stats
+    with stats.phase("recovery plan"):
+        planned, failed = plan_batch(instance, jobs)
+    total = sum(length for _, _, _, segments in planned for _, _, length in segments)
+    meter = ScanProgress(progress, total, 1)
+    chunks = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()  # Set by the writer when it gives up, so the reader does not block forever
+
+    def put(message):
+        while not stop.is_set():
+            try:
+                chunks.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def reader():
+        for index, _, _, segments in planned:
+            if cancelled(cancel) or not put(("start", index, None)):
+                break
+            try:
+                for kind, value in read_chunks(instance.device, segments, buffer_size):
+                    if not put((kind, index, value)):
+                        return
+            except Exception as e:
+                put(("error", index, e))  # The writer drops this file, the next one follows
+                continue
+            put(("end", index, unreadable_bytes(instance.device, segments)))
+        put(("done", None, None))
+
+    results = {result["index"]: result for result in failed}
+    thread = threading.Thread(target=reader, name="batch-recovery-reader", daemon=True)
+    started = time.perf_counter()
+    thread.start()
+
+    paths = {index: (item, path) for index, item, path, _ in planned}
+    sizes = {index: sum(length for _, _, length in segments) for index, _, _, segments in planned}
+    output = None
+    current = None
+    processed = 0  # Bytes of the current file taken from the queue, written or not
+    try:
+        while True:
+            kind, index, value = chunks.get()
+            if kind == "done":
+                break
+
+            if kind == "start":
+                item, path = paths[index]
+                current = {"index": index, "name": item.get("name"), "path": path, "bytes": 0, "unreadable": 0, "error": None}
+                results[index] = current
+                processed = 0
+                try:
+                    output = open(path, "wb", buffering=0)
+                except OSError as e:
+                    current["error"] = str(e)
+                    output = None
+                continue
+
+            if current is None or current["index"] != index:
+                continue
+            if kind == "error":
+                current["error"] = str(value)
+            elif kind in ("data", "zero", "copy"):
+                length = len(value) if kind == "data" else value[1] if kind == "copy" else value
+                processed += length
+                meter.advance(length)
+                if current["error"] is None:
+                    try:
+                        if kind == "data":
+                            write_all(output, value)
+                        elif kind == "copy":
+                            copy_chunk(instance.device, output, *value, buffer_size)
+                        else:
+                            output.seek(value, os.SEEK_CUR)  # Hole, read back as zeros
+                        current["bytes"] += length
+                    except OSError as e:
+                        current["error"] = str(e)
+
+            if kind == "end":
+                current["unreadable"] = value
+            if kind in ("end", "error"):
+                meter.total -= sizes[index] - processed  # A failed read leaves the rest of the file out of the batch
+            if kind in ("end", "error") and output is not None:
+                try:
+                    if current["error"] is None:
+                        output.truncate()  # Holes at the end still count in the file size
+                    output.close()
+                except OSError as e:
+                    current["error"] = current["error"] or str(e)
+                output = None
+    finally:
+        stop.set()
+        thread.join()
+        if output is not None:
+            output.close()
+        meter.finish()
+        stats.add_time("recovery", time.perf_counter() - started)
+        stats.count("bytes recovered", meter.done)
+        stats.count("unreadable bytes", sum(result.get("unreadable", 0) for result in results.values()))
+
+    for index, (item, path) in paths.items():
+        results.setdefault(index, {"index": index, "name": item.get("name"), "path": path, "bytes": 0, "unreadable": 0, "error": "Cancelled"})
+    return [results[index] for index in sorted(results)]
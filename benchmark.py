@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import random
+import struct
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from block_device import close_devices, set_io_options, parse_size
+from fat32 import FAT32
+from ntfs import NTFS
+from image_builder import build_fat32_image, build_ntfs_image
+from instrumentation import io_counters
+import fat32
+
+MIB = 1024 * 1024
+
+def write_boot_sector(path, volume_size, cluster_size=4096, sector_size=512):
+    """Write a bare FAT32 boot sector, enough for FAT32() to read the volume geometry."""
+    boot = bytearray(sector_size)
+    struct.pack_into("<HBHB", boot, 0x0B, sector_size, cluster_size // sector_size, 32, 2)
+    struct.pack_into("<I", boot, 0x20, volume_size // sector_size)
+    struct.pack_into("<I", boot, 0x24, 8)
+    struct.pack_into("<I", boot, 0x2C, 2)
+    boot[0x52:0x5A] = b"FAT32   "
+    boot[510:512] = b"\x55\xaa"
+    with open(path, "wb") as image:
+        image.write(boot)
+
+def synthetic_directory_data(size, deleted_ratio=0.01, seed=0):
+    """Cluster data that looks like a deep scan sees it: mostly file content, a few deleted entries."""
+    rng = random.Random(seed)
+    data = bytearray(rng.randbytes(size))
+    slots = range(0, size // 32 - 1, 2)  # Even slots, so an LFN part and its entry never overlap
+    for slot in rng.sample(slots, int(len(slots) * deleted_ratio)):
+        offset = slot * 32
+        name = f"FILE{slot:07d}.TXT".encode("utf-16le")
+        lfn = bytearray(32)
+        lfn[0] = 0xE5
+        lfn[1:11] = name[:10]
+        lfn[11] = 0x0F  # LFN part
+        lfn[14:26] = name[10:22]
+        entry = bytearray(b"\xe5ILE0001TXT\x20" + bytes(20))
+        struct.pack_into("<HI", entry, 26, 3 + slot % 1000, rng.randint(0, 1 << 20))
+        data[offset : offset + 64] = lfn + entry
+    return bytes(data)
+
+def time_decoder(decoder, data, total_clusters, chunk):
+    carry = []
+    found = []
+    start = time.perf_counter()
+    for offset in range(0, len(data), chunk):
+        items, carry = decoder(memoryview(data)[offset : offset + chunk], carry, total_clusters)
+        found.extend(items)
+    return time.perf_counter() - start, found
+
+def bench_entry_decoding(size=64 * MIB, cluster_size=4096):
+    """Compare the per-entry loop with the NumPy decoder used by FAT32.scan_all."""
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "boot.img")
+        write_boot_sector(path, volume_size=size, cluster_size=cluster_size)
+        volume = FAT32(disk=path, first_offset=0)
+        try:
+            run_decoders(volume, size, cluster_size)
+        finally:
+            close_devices()  # Release the image before its folder is removed
+
+def run_decoders(volume, size, cluster_size):
+    total_clusters = volume.volume_size // volume.cluster_size
+    data = synthetic_directory_data(size)
+    chunk = max(1, fat32.SCAN_BATCH_SIZE // cluster_size) * cluster_size
+
+    loop_time, loop_items = time_decoder(volume.decode_entries_loop, data, total_clusters, chunk)
+    print(f"loop:       {loop_time:8.3f} s  {size / MIB / loop_time:9.1f} MB/s  {len(loop_items)} entries")
+
+    if fat32.np is None:
+        print("vectorized: skipped, NumPy is not installed")
+        return
+
+    vector_time, vector_items = time_decoder(volume.decode_entries_vectorized, data, total_clusters, chunk)
+    print(f"vectorized: {vector_time:8.3f} s  {size / MIB / vector_time:9.1f} MB/s  {len(vector_items)} entries")
+    print(f"speedup:    {loop_time / vector_time:8.1f}x, identical results: {loop_items == vector_items}")
+
+def max_rss():
+    """Peak resident set size in bytes, None when the platform does not say."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+def measure(name, run, device, memory=False):
+    """Time run() -> (items, bytes processed or None for the bytes read) and collect I/O counters around it.
+    With memory=True, run it a second time under tracemalloc for the peak allocation.
+    Device counters and memory cover this process only, not the workers of a parallel scan."""
+    io_before = io_counters()
+    reads, bytes_read = device.reads, device.bytes_read
+    start = time.perf_counter()
+    items, size = run()
+    seconds = time.perf_counter() - start
+    io_after = io_counters()
+    if size is None:
+        size = device.bytes_read - bytes_read
+
+    result = {
+        "benchmark": name,
+        "seconds": round(seconds, 4),
+        "items": items,
+        "mb_per_second": round(size / MIB / seconds, 1) if seconds > 0 else None,
+        "device_reads": device.reads - reads,
+        "device_bytes": device.bytes_read - bytes_read,
+        "read_syscalls": io_after.get("syscr", 0) - io_before.get("syscr", 0),
+        "write_syscalls": io_after.get("syscw", 0) - io_before.get("syscw", 0),
+        "max_rss": max_rss(),
+    }
+    if memory:
+        tracemalloc.start()
+        run()
+        result["peak_allocated"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+def scan_run(volume, mode, workers):
+    def run():
+        return len(list(volume.iter_deleted(mode, workers=workers))), None
+    return run
+
+def recover_run(volume, items, folder):
+    """Recover every item into folder. A failing item is counted, it does not stop the run."""
+    def run():
+        recovered = failed = size = 0
+        for index, item in enumerate(items):
+            target = os.path.join(folder, f"{index}.bin")
+            try:
+                volume.recover_data(target, item)
+                size += os.path.getsize(target)
+                recovered += 1
+            except Exception:
+                failed += 1
+            finally:
+                if os.path.exists(target):
+                    os.remove(target)
+        return {"recovered": recovered, "failed": failed}, size
+    return run
+
+def bench_volumes(folder, size=256 * MIB, files=2000, workers=1, memory=False):
+    """Build a FAT32 and an NTFS image and time scanning and recovering them. Yields result dicts."""
+    fat_path = os.path.join(folder, "fat32.img")
+    ntfs_path = os.path.join(folder, "ntfs.img")
+    output = os.path.join(folder, "recovered")
+    os.makedirs(output, exist_ok=True)
+
+    build_fat32_image(fat_path, size=size, files=files)
+    build_ntfs_image(ntfs_path, size=size, files=files, mft_fragments=4)
+
+    volume = FAT32(disk=fat_path, first_offset=MIB)
+    yield measure("fat32 quick scan", scan_run(volume, "quick", workers), volume.device, memory)
+    yield measure("fat32 full scan", scan_run(volume, "full", workers), volume.device, memory)
+    yield measure("fat32 exhaustive scan", scan_run(volume, "exhaustive", workers), volume.device, memory)
+    items = list(volume.iter_deleted("quick"))
+    yield measure("fat32 recover", recover_run(volume, items, output), volume.device, memory)
+
+    volume = NTFS(disk=ntfs_path, first_offset=MIB)
+    yield measure("ntfs quick scan", scan_run(volume, "quick", workers), volume.device, memory)
+    items = list(volume.iter_deleted("quick"))
+    yield measure("ntfs recover", recover_run(volume, items, output), volume.device, memory)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scanning and recovery on synthetic disk images.")
+    parser.add_argument("--size", type=int, default=256, help="Volume size in MiB")
+    parser.add_argument("--files", type=int, default=2000, help="Files per image")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for deep scans")
+    parser.add_argument("--memory", action="store_true", help="Also measure peak allocations (runs each benchmark twice)")
+    parser.add_argument("--decoders", action="store_true", help="Only compare the FAT32 entry decoders")
+    parser.add_argument("--folder", help="Keep the images in this folder instead of a temporary one")
+    parser.add_argument("--direct", action="store_true", help="Read the images with O_DIRECT, past the page cache")
+    parser.add_argument("--min-io", type=parse_size, help="Smallest read issued, e.g. 1M")
+    args = parser.parse_args()
+    set_io_options(args.direct, args.min_io)
+
+    if args.decoders:
+        bench_entry_decoding(args.size * MIB)
+        return
+
+    with tempfile.TemporaryDirectory() as temporary:
+        folder = args.folder or temporary
+        os.makedirs(folder, exist_ok=True)
+        try:
+            for result in bench_volumes(folder, args.size * MIB, args.files, args.workers, args.memory):
+                print(json.dumps(result), flush=True)
+        finally:
+            close_devices()  # Release the images before their folder is removed
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,632 @@
+import bisect
+import errno
+import json
+import mmap
+import os
+import queue
+import stat
+import threading
+from collections import OrderedDict, deque
+
+DEFAULT_PAGE_SIZE = 64 * 1024          # Bytes per cached page (multiple of any sector size)
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024  # Memory cap for cached pages of one device
+COPY_BUFFER_SIZE = 1024 * 1024         # Bytes read and written at a time when recovering a file
+PREFETCH_DEPTH = 2                     # Blocks waiting for a sequential scan, with one more being read (triple buffering)
+SIZE_SUFFIXES = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+BAD_RANGES_FILE = os.path.join(os.path.expanduser("~"), ".disk_recovery", "bad_ranges.json")
+MAX_FAILED_READS = 64                  # Failed reads in one rescue pass before the rest of the request is left untried
+RESCUE_PASSES = 4                      # Passes over the untried ranges of one request, each with MAX_FAILED_READS
+MEDIA_ERRNOS = {errno.EIO, errno.ENXIO}  # Errors of a damaged medium, as opposed to a bad call
+MEDIA_WINERRORS = {23, 27, 1117}       # Windows: CRC error, sector not found, I/O device error
+
+class BlockDevice:
+    """A disk or image file kept open once and read through an LRU cache of aligned pages.
+    Every read starts and ends on a page edge; pages are a multiple of the sector size and at
+    least min_io_size bytes. With direct, reads use O_DIRECT into page-aligned buffers and skip
+    the host's page cache (falls back to normal reads where the platform or file system refuses).
+    Unreadable sectors read as zeros and are kept in a BadRangeMap (see rescue_read); retry_bad
+    ignores the ranges saved by earlier runs."""
+
+    def __init__(self, path, page_size=DEFAULT_PAGE_SIZE, cache_size=DEFAULT_CACHE_SIZE, min_io_size=0, direct=False,
+                 bad_ranges_file=BAD_RANGES_FILE, retry_bad=False):
+        if page_size <= 0 or page_size % 512:
+            raise ValueError("Page size must be a positive multiple of 512 bytes.")
+
+        geometry = block_geometry(path)
+        self.path = path
+        self.sector_size = max(geometry[:2]) if geometry else 512  # Alignment of every read
+        self.cache_size = cache_size
+        self.set_page_size(max(page_size, min_io_size, geometry[2] if geometry else 0))
+        self.pages = OrderedDict()  # page index -> bytes, oldest first
+        self.hits = 0
+        self.misses = 0
+        self.reads = 0       # Reads issued to the handle
+        self.bytes_read = 0
+        self.seeks = 0       # Reads that did not start where the previous one ended
+        self.seek_distance = 0
+        self.next_offset = 0
+        self.lock = threading.Lock()
+        self.direct = False
+        if direct and hasattr(os, "O_DIRECT"):
+            try:
+                self.handle = os.fdopen(os.open(path, os.O_RDONLY | os.O_DIRECT), "rb", buffering=0)
+                self.direct = True
+                self.align(mmap.PAGESIZE)  # O_DIRECT on an image file needs the host's block alignment
+            except OSError:
+                pass  # The file system does not take O_DIRECT (tmpfs, some network shares)
+        if not self.direct:
+            self.handle = open(path, "rb", buffering=0)
+        self.bytes_unreadable = 0  # Bytes returned as zeros because their sectors could not be read
+        self.bad_ranges = BadRangeMap(device_key(path, self.handle), bad_ranges_file, load=not retry_bad)
+        self.untried = BadRangeMap(None, None, load=False)  # Skipped after too many failures, read as zeros until retried
+
+    def set_page_size(self, page_size):
+        """Round page_size up to a whole number of sectors; cached pages are dropped."""
+        self.page_size = -(-page_size // self.sector_size) * self.sector_size
+        self.max_pages = max(1, self.cache_size // self.page_size)
+        self.pages = OrderedDict()
+
+    def align(self, sector_size):
+        """Align every read to sector_size too, e.g. the sector size a volume's boot sector gives."""
+        if sector_size <= 0 or sector_size & (sector_size - 1):
+            return  # Not a power of two, a damaged boot sector
+        with self.lock:
+            if sector_size > self.sector_size:
+                self.sector_size = sector_size
+            if self.page_size % self.sector_size:
+                self.set_page_size(self.page_size)
+
+    def close(self):
+        with self.lock:
+            self.pages.clear()
+            self.handle.close()
+
+    def read_raw(self, offset, size):
+        """Read an aligned range. Offset and size must already be sector aligned.
+        Ranges with bad sectors go through rescue_read and come back with those sectors zeroed."""
+        if self.bad_ranges.overlapping(offset, offset + size) or self.untried.overlapping(offset, offset + size):
+            return self.rescue_read(offset, size)
+        try:
+            return self.read_handle(offset, size)
+        except OSError as e:
+            if not media_error(e):
+                raise
+            return self.rescue_read(offset, size)
+
+    def read_handle(self, offset, size):
+        """One read straight from the handle."""
+        if offset != self.next_offset:
+            self.seeks += 1
+            self.seek_distance += abs(offset - self.next_offset)
+        self.reads += 1
+        self.next_offset = offset  # A failed read leaves the head about here
+        if self.direct:
+            data = self.read_direct(offset, size)
+        else:
+            self.handle.seek(offset)
+            data = self.handle.read(size)
+            data = data if data is not None else b""
+        self.bytes_read += len(data)
+        self.next_offset = offset + len(data)
+        return data
+
+    def rescue_read(self, offset, size):
+        """Read a range around bad sectors, like ddrescue: known bad ranges are not read again,
+        a read that fails is split in halves down to single sectors, and only single sectors that
+        still fail join the bad map. After MAX_FAILED_READS failures the rest of the pass is left
+        untried, and a trimming pass reads it again, up to RESCUE_PASSES passes, so a dead area costs
+        a bounded number of timeouts. What is still untried then is kept in memory only (self.untried)
+        and retried by the next read of it. Bad and untried bytes read as zeros."""
+        result = bytearray(size)
+        end = offset + size
+        device_end = end
+        # Untried pieces are read again from where an earlier call left them, not from the whole range
+        cuts = sorted({edge for low, high in self.untried.overlapping(offset, end) for edge in (low, high)})
+        self.untried.discard(offset, end)
+
+        # Stretches between the known bad ranges, cut at the untried edges, last one first so they are popped in disk order
+        stretches = []
+        position = offset
+        for bad_start, bad_end in self.bad_ranges.overlapping(offset, end):
+            if position < bad_start:
+                stretches.append((position, bad_start))
+            position = bad_end
+        if position < end:
+            stretches.append((position, end))
+        pending = []
+        for low, high in stretches:
+            edges = [low] + [cut for cut in cuts if low < cut < high] + [high]
+            pending.extend((start, stop - start) for start, stop in zip(edges, edges[1:]))
+        pending.reverse()
+
+        failures = 0
+        passes = 1
+        untried = []
+        added = False
+        while pending or untried:
+            if not pending:
+                if passes >= RESCUE_PASSES:
+                    break
+                passes += 1  # Trimming pass over what the last one skipped
+                failures = 0
+                pending = untried[::-1]
+                untried = []
+                continue
+            start, length = pending.pop()
+            if start >= device_end:
+                continue
+            if failures >= MAX_FAILED_READS:
+                untried.append((start, length))
+                continue
+            try:
+                chunk = self.read_handle(start, length)
+            except OSError as e:
+                if not media_error(e):
+                    raise
+                failures += 1
+                if length <= self.sector_size:
+                    self.bad_ranges.add(start, start + length)
+                    added = True
+                else:
+                    half = max(self.sector_size, length // 2 // self.sector_size * self.sector_size)
+                    pending.append((start + half, length - half))
+                    pending.append((start, half))
+                continue
+            result[start - offset : start - offset + len(chunk)] = chunk
+            if len(chunk) < length:
+                device_end = start + len(chunk)  # End of the device
+
+        for start, length in untried:
+            if start < device_end:
+                self.untried.add(start, min(start + length, device_end), touching=False)
+        if added:
+            self.bad_ranges.save()
+        self.bytes_unreadable += sum(high - low for ranges in (self.bad_ranges, self.untried)
+                                     for low, high in ranges.overlapping(offset, device_end))
+        return memoryview(result)[:device_end - offset]
+
+    def read_direct(self, offset, size):
+        """O_DIRECT read into a fresh page-aligned buffer (an anonymous mapping), returned as a view."""
+        buffer = mmap.mmap(-1, size)
+        try:
+            count = os.preadv(self.handle.fileno(), [buffer], offset)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            # Alignment the device will not take: go on without O_DIRECT
+            self.handle.close()
+            self.handle = open(self.path, "rb", buffering=0)
+            self.direct = False
+            self.handle.seek(offset)
+            return self.handle.read(size) or b""
+        return memoryview(buffer)[:count]
+
+    def read_page(self, index):
+        page = self.pages.get(index)
+        if page is not None:
+            self.pages.move_to_end(index)
+            self.hits += 1
+            return page
+
+        self.misses += 1
+        page = self.read_raw(index * self.page_size, self.page_size)
+        if self.untried.overlapping(index * self.page_size, (index + 1) * self.page_size):
+            return page  # Not cached, so the next read tries the skipped sectors again
+        self.pages[index] = page
+        if len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)  # Drop least recently used page
+        return page
+
+    def read(self, offset, size):
+        """Read size bytes from offset. The result is shorter only at the end of the device."""
+        if size <= 0:
+            return b""
+
+        first_page = offset // self.page_size
+        last_page = (offset + size - 1) // self.page_size
+
+        with self.lock:
+            # Bulk reads bypass the cache so one big read does not evict every hot page
+            if last_page - first_page + 1 > self.max_pages // 2:
+                start = first_page * self.page_size
+                data = self.read_raw(start, (last_page + 1) * self.page_size - start)
+                return memoryview(data)[offset - start : offset - start + size]
+
+            if first_page == last_page:
+                start = offset - first_page * self.page_size
+                return memoryview(self.read_page(first_page))[start : start + size]
+
+            data = b"".join(self.read_page(index) for index in range(first_page, last_page + 1))
+            start = offset - first_page * self.page_size
+            return memoryview(data)[start : start + size]
+
+    def read_bulk(self, offset, size):
+        """One read that bypasses the page cache, for large sequential copies.
+        Ranges within two pages (large pages set by min_io_size) go through the cache instead."""
+        if size <= 0:
+            return b""
+        start = offset // self.page_size * self.page_size
+        end = -(-(offset + size) // self.page_size) * self.page_size
+        if end - start <= 2 * self.page_size:
+            return self.read(offset, size)
+        with self.lock:
+            data = self.read_raw(start, end - start)
+        return memoryview(data)[offset - start : offset - start + size]
+
+    def read_ahead(self, blocks, depth=PREFETCH_DEPTH):
+        """Yield the data of each block (a list of (offset, size) ranges) in order, None for a block
+        that could not be read, while a background thread reads the next ones (see threaded_read_ahead)."""
+        return threaded_read_ahead(self, blocks, depth)
+
+class MappedImage:
+    """A disk-image file mapped into memory. Reads are zero-copy memoryview slices of the mapping."""
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = open(path, "rb")
+        self.map = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        self.size = len(self.map)
+        self.reads = 0       # Reads served from the mapping (page faults are the kernel's business)
+        self.bytes_read = 0
+        self.seeks = 0       # Reads that did not start where the previous one ended
+        self.seek_distance = 0
+        self.next_offset = 0
+
+    def close(self):
+        try:
+            self.view.release()
+            self.map.close()
+        except BufferError:
+            pass  # Slices handed out earlier are still alive, the mapping goes away with them
+        self.handle.close()
+
+    def read(self, offset, size):
+        """Read size bytes from offset. The result is shorter only at the end of the image."""
+        if size <= 0 or offset >= self.size:
+            return self.view[0:0]
+        data = self.view[offset : offset + size]
+        if offset != self.next_offset:
+            self.seeks += 1
+            self.seek_distance += abs(offset - self.next_offset)
+        self.reads += 1
+        self.bytes_read += len(data)
+        self.next_offset = offset + len(data)
+        return data
+
+    def read_bulk(self, offset, size):
+        return self.read(offset, size)
+
+    def align(self, sector_size):
+        pass  # Reads of a mapping are page faults, already aligned by the kernel
+
+    def read_ahead(self, blocks, depth=PREFETCH_DEPTH):
+        """Same as BlockDevice.read_ahead. Reads of a mapping are page faults of the consumer, so instead
+        of a thread the kernel is asked (madvise) to page in the next depth blocks in the background."""
+        blocks = iter(blocks)
+        window = deque()
+
+        def advance():
+            ranges = next(blocks, None)
+            if ranges is not None:
+                window.append(ranges)
+                for offset, size in ranges:
+                    self.advise(offset, size)
+
+        for _ in range(max(0, depth) + 1):
+            advance()
+        while window:
+            ranges = window.popleft()
+            advance()
+            yield read_blocks(self, ranges)
+
+    def advise(self, offset, size):
+        """Hint that a range will be read soon. Does nothing where madvise is missing."""
+        if not hasattr(mmap, "MADV_WILLNEED") or size <= 0 or offset >= self.size:
+            return
+        start = offset - offset % mmap.PAGESIZE  # madvise needs a page-aligned start
+        try:
+            self.map.madvise(mmap.MADV_WILLNEED, start, min(self.size, offset + size) - start)
+        except (OSError, ValueError):
+            pass
+
+def read_blocks(device, ranges):
+    """Data of one block made of (offset, size) ranges, joined when there are several."""
+    parts = [device.read_bulk(offset, size) for offset, size in ranges]
+    if len(parts) == 1:
+        return parts[0]
+    return b"".join(parts)
+
+def threaded_read_ahead(device, blocks, depth=PREFETCH_DEPTH):
+    """Yield the data of each block (a list of (offset, size) ranges) of a device in order, None for a
+    block that could not be read. A background thread reads the next blocks while the current one is
+    parsed; it waits once depth blocks are queued, so a slow consumer holds the reads back."""
+    if depth <= 0:
+        for ranges in blocks:
+            try:
+                yield read_blocks(device, ranges)
+            except OSError:
+                yield None
+        return
+
+    results = queue.Queue(maxsize=depth)
+    stop = threading.Event()  # Set when the consumer is done, so the reader does not block forever
+
+    def put(message):
+        while not stop.is_set():
+            try:
+                results.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def reader():
+        try:
+            for ranges in blocks:
+                try:
+                    data = read_blocks(device, ranges)
+                except OSError:
+                    data = None
+                if not put(("data", data)):
+                    return
+        except Exception as e:
+            put(("error", e))  # Raised again in the consumer
+            return
+        put(("done", None))
+
+    thread = threading.Thread(target=reader, name="read-ahead", daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, value = results.get()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        stop.set()
+        thread.join()
+
+class BadRangeMap:
+    """Unreadable byte ranges [start, end) of one device, sorted and merged. Saved in a JSON file
+    shared by every device (by device_key) so later scans and recoveries skip them at once.
+    Without a file the map lives in memory only."""
+
+    def __init__(self, key, path=BAD_RANGES_FILE, load=True):
+        self.key = key
+        self.path = path
+        self.starts = []  # Range starts, sorted
+        self.ends = []    # End of the range at the same index
+        if load:
+            for start, end in self.saved().get(key, []):
+                self.add(start, end)
+
+    def saved(self):
+        if self.path is None:
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as saved:
+                return json.load(saved)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """Write this device's ranges, keeping the other devices of the file."""
+        if self.path is None:
+            return
+        try:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            saved = self.saved()
+            saved[self.key] = self.ranges()
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "w", encoding="utf-8") as output:
+                json.dump(saved, output)
+            os.replace(temporary, self.path)  # Readers never see half a file
+        except OSError:
+            pass  # The map still works for this run
+
+    def add(self, start, end, touching=True):
+        """Mark [start, end) bad, merged with the ranges it overlaps and, with touching, those it touches."""
+        if touching:
+            first = bisect.bisect_left(self.ends, start)   # First range ending at or after start
+            last = bisect.bisect_right(self.starts, end)   # Ranges from here on start after end
+        else:
+            first = bisect.bisect_right(self.ends, start)
+            last = bisect.bisect_left(self.starts, end)
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+
+    def overlapping(self, start, end):
+        """Bad ranges within [start, end), clipped to it."""
+        first = bisect.bisect_right(self.ends, start)
+        ranges = []
+        for index in range(first, len(self.starts)):
+            if self.starts[index] >= end:
+                break
+            ranges.append((max(start, self.starts[index]), min(end, self.ends[index])))
+        return ranges
+
+    def discard(self, start, end):
+        """Unmark [start, end), cutting the ranges that reach past it."""
+        first = bisect.bisect_right(self.ends, start)
+        last = bisect.bisect_left(self.starts, end)
+        if first >= last:
+            return
+        kept = []
+        if self.starts[first] < start:
+            kept.append((self.starts[first], start))
+        if self.ends[last - 1] > end:
+            kept.append((end, self.ends[last - 1]))
+        self.starts[first:last] = [low for low, _ in kept]
+        self.ends[first:last] = [high for _, high in kept]
+
+    def ranges(self):
+        return [[start, end] for start, end in zip(self.starts, self.ends)]
+
+    def clear(self):
+        self.starts = []
+        self.ends = []
+        self.save()
+
+def media_error(error):
+    """True for read errors that come from the medium (bad sectors) rather than from the call."""
+    return error.errno in MEDIA_ERRNOS or getattr(error, "winerror", None) in MEDIA_WINERRORS
+
+def device_key(path, handle):
+    """Key of a device in the bad-range file: absolute path and size in bytes."""
+    try:
+        size = os.lseek(handle.fileno(), 0, os.SEEK_END)
+    except OSError:
+        size = 0
+    return f"{os.path.abspath(path)}|{size}"
+
+def unreadable_bytes(device, segments):
+    """Bytes of a file's ("disk", offset, length) segments that lie in known bad or untried ranges (read as zeros)."""
+    maps = [ranges for ranges in (getattr(device, "bad_ranges", None), getattr(device, "untried", None)) if ranges is not None]
+    return sum(high - low for kind, value, length in segments if kind == "disk"
+               for ranges in maps for low, high in ranges.overlapping(value, value + length))
+
+# One open device per path for the whole session
+devices = {}
+devices_lock = threading.Lock()
+
+def block_geometry(path):
+    """(logical sector size, physical sector size, minimum I/O size) of a Linux block device, from sysfs.
+    None for image files and on other platforms."""
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISBLK(info.st_mode) or not hasattr(os, "major"):
+        return None
+
+    folder = f"/sys/dev/block/{os.major(info.st_rdev)}:{os.minor(info.st_rdev)}"
+    queue_folder = os.path.join(folder, "queue")
+    if not os.path.isdir(queue_folder):
+        queue_folder = os.path.join(folder, "..", "queue")  # A partition shares the queue of its disk
+    values = []
+    for name in ("logical_block_size", "physical_block_size", "minimum_io_size"):
+        try:
+            with open(os.path.join(queue_folder, name)) as value:
+                values.append(int(value.read()))
+        except (OSError, ValueError):
+            return None
+    return tuple(values)
+
+def parse_size(text):
+    """Bytes from "1048576", "64K", "1M" or "1G"."""
+    text = text.strip().upper().rstrip("B") or "0"
+    if text[-1] in SIZE_SUFFIXES:
+        return int(text[:-1]) * SIZE_SUFFIXES[text[-1]]
+    return int(text)
+
+def io_settings():
+    """Reader options from the environment: DISK_RECOVERY_DIRECT_IO=1 reads with O_DIRECT,
+    DISK_RECOVERY_MIN_IO=1M makes every read at least that big (e.g. an SD card's erase block),
+    DISK_RECOVERY_RETRY_BAD=1 reads the bad ranges saved by earlier runs again."""
+    settings = {}
+    if os.environ.get("DISK_RECOVERY_DIRECT_IO", "").lower() in ("1", "yes", "true", "on"):
+        settings["direct"] = True
+    if os.environ.get("DISK_RECOVERY_MIN_IO"):
+        settings["min_io_size"] = parse_size(os.environ["DISK_RECOVERY_MIN_IO"])
+    if os.environ.get("DISK_RECOVERY_RETRY_BAD", "").lower() in ("1", "yes", "true", "on"):
+        settings["retry_bad"] = True
+    return settings
+
+def set_io_options(direct=False, min_io_size=None, retry_bad=False):
+    """Set the reader options of io_settings() for this process and the worker processes it starts."""
+    if direct:
+        os.environ["DISK_RECOVERY_DIRECT_IO"] = "1"
+    if min_io_size:
+        os.environ["DISK_RECOVERY_MIN_IO"] = str(min_io_size)
+    if retry_bad:
+        os.environ["DISK_RECOVERY_RETRY_BAD"] = "1"
+
+def open_device(path, mmap_images=True, **options):
+    """Return the shared reader of a disk or image, opening it on first use.
+    gzip and zstd images are read through a CompressedImage, other non-empty image files are
+    memory-mapped, disks go through a BlockDevice page cache.
+    Options default to io_settings(); with direct I/O images are not mapped either."""
+    from compressed_image import CompressedImage, compression_format  # It builds on this module
+
+    with devices_lock:
+        device = devices.get(path)
+        if device is None:
+            options = dict(io_settings(), **options)
+            if options.get("direct"):
+                mmap_images = False  # A mapping goes through the page cache
+            if os.path.isfile(path) and compression_format(path):
+                device = CompressedImage(path)
+            elif mmap_images and os.path.isfile(path) and os.path.getsize(path) > 0:
+                device = MappedImage(path)
+            else:
+                device = BlockDevice(path, **options)
+            devices[path] = device
+        return device
+
+def close_devices():
+    """Close every shared device handle."""
+    with devices_lock:
+        for device in devices.values():
+            device.close()
+        devices.clear()
+
+def write_all(output, data):
+    """Write to an unbuffered file, which may accept only part of the data per call."""
+    view = memoryview(data)
+    while view:
+        view = view[output.write(view):]
+
+def copy_range(source, output, offset, length):
+    """Copy length bytes of an image file from offset in the kernel (copy_file_range, else sendfile).
+    Returns the bytes copied, 0 when neither call works for these files."""
+    copied = 0
+    for call in ("copy_file_range", "sendfile"):
+        if not hasattr(os, call):
+            continue
+        try:
+            while copied < length:
+                if call == "copy_file_range":
+                    done = os.copy_file_range(source.fileno(), output.fileno(), length - copied, offset + copied)
+                else:
+                    done = os.sendfile(output.fileno(), source.fileno(), offset + copied, length - copied)
+                if done == 0:
+                    break  # End of the image
+                copied += done
+            return copied
+        except OSError:
+            if copied:
+                return copied  # The rest goes through user space
+    return copied
+
+def write_segments(device, path, segments, buffer_size=COPY_BUFFER_SIZE):
+    """Write a recovered file from its segments, at most buffer_size bytes in memory at a time:
+    ("disk", offset, length) copied from the device, ("zero", None, length) for holes that are
+    never read, ("data", bytes, length) for content already in memory. Returns the bytes written.
+    Disk ranges of an image file are copied by the kernel when the platform allows it."""
+    with open(path, "wb", buffering=0) as output:
+        for kind, value, length in segments:
+            if kind == "data":
+                write_all(output, value[:length])
+            elif kind == "zero":
+                output.seek(length, os.SEEK_CUR)  # Leaves a hole, read back as zeros
+            else:
+                position = value
+                end = value + length
+                if isinstance(device, MappedImage):
+                    position += copy_range(device.handle, output, position, end - position)
+                while position < end:
+                    chunk = device.read_bulk(position, min(buffer_size, end - position))
+                    if not chunk:
+                        raise OSError(f"Short read at offset {position}.")
+                    write_all(output, chunk)
+                    position += len(chunk)
+        output.truncate()  # Holes at the end still count in the file size
+        return output.tell()
@@ -0,0 +1,200 @@
+import re
+
+try:
+    import numpy as np
+except ImportError:  # Optional, candidates are then checked cluster by cluster
+    np = None
+
+from progress import ScanProgress, stream_results, cancelled
+
+CARVE_BLOCK_SIZE = 8 * 1024 * 1024  # Bytes of the partition read and matched together
+FOOTER_OVERLAP = 32                 # Bytes of the previous block searched again, for footers cut by a block edge
+MIB = 1024 * 1024
+
+# File types found by their header at the start of a cluster. magic is a fixed part of the header
+# at magic_offset, used to skip clusters cheaply. The end of a file comes from its footer
+# (first match after the header) or from sizes stored in the header.
+SIGNATURES = [
+    {"type": "jpg", "magic": b"\xFF\xD8\xFF", "magic_offset": 0, "header": rb"\xFF\xD8\xFF[\xC0-\xFE]",
+     "footer": rb"\xFF\xD9", "max_size": 50 * MIB},
+    {"type": "png", "magic": b"\x89PNG", "magic_offset": 0, "header": rb"\x89PNG\r\n\x1A\n",
+     "footer": rb"IEND\xAE\x42\x60\x82", "max_size": 100 * MIB},
+    {"type": "gif", "magic": b"GIF8", "magic_offset": 0, "header": rb"GIF8[79]a",
+     "footer": rb"\x00\x3B", "max_size": 50 * MIB},
+    {"type": "pdf", "magic": b"%PDF", "magic_offset": 0, "header": rb"%PDF-\d\.\d",
+     "footer": rb"%%EOF(?:\r\n|\n|\r)?", "max_size": 500 * MIB},
+    {"type": "zip", "magic": b"PK\x03\x04", "magic_offset": 0, "header": rb"PK\x03\x04[\x0A-\x3F]\x00",  # Also DOCX/XLSX/PPTX, JAR, EPUB
+     "footer": rb"PK\x05\x06", "max_size": 4096 * MIB},
+    {"type": "rar", "magic": b"Rar!", "magic_offset": 0, "header": rb"Rar!\x1A\x07\x01?\x00",
+     "footer": rb"\xC4\x3D\x7B\x00\x40\x07\x00|\x1D\x77\x56\x51\x03\x05\x04\x00", "max_size": 4096 * MIB},
+    {"type": "7z", "magic": b"7z\xBC\xAF", "magic_offset": 0, "header": rb"7z\xBC\xAF\x27\x1C",
+     "footer": None, "max_size": 4096 * MIB},
+    {"type": "bmp", "magic": b"BM", "magic_offset": 0, "header": rb"BM....\x00\x00\x00\x00",
+     "footer": None, "max_size": 500 * MIB},
+    {"type": "mp4", "magic": b"ftyp", "magic_offset": 4, "header": rb"....ftyp(?:isom|iso[2-6]|mp4[12]|avc1|M4[AV] |qt  |3gp[4-6])",
+     "footer": None, "max_size": 16384 * MIB},
+]
+
+MP4_BOXES = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"uuid", b"meta", b"pnot", b"udta", b"moof", b"mfra", b"sidx", b"styp"}
+
+# All headers in one pattern: a single match per candidate cluster tells which type starts there
+HEADER_PATTERN = re.compile(b"|".join(b"(?P<signature%d>%s)" % (index, signature["header"])
+                                      for index, signature in enumerate(SIGNATURES)), re.DOTALL)
+SIGNATURE_BY_GROUP = {f"signature{index}": signature for index, signature in enumerate(SIGNATURES)}
+FOOTER_PATTERNS = {signature["type"]: re.compile(signature["footer"]) for signature in SIGNATURES if signature["footer"]}
+
+def prefilter_tables():
+    """Byte values that can start a header, at offset 0 and at offset 4 (headers that begin with a size field)."""
+    first = bytearray(256)
+    fifth = bytearray(256)
+    for signature in SIGNATURES:
+        table = fifth if signature["magic_offset"] == 4 else first
+        table[signature["magic"][0]] = 1
+    return first, fifth
+
+PREFILTER_FIRST, PREFILTER_FIFTH = prefilter_tables()
+if np is not None:
+    FIRST_MASK = np.frombuffer(PREFILTER_FIRST, dtype=np.uint8).astype(bool)
+    FIFTH_MASK = np.frombuffer(PREFILTER_FIFTH, dtype=np.uint8).astype(bool)
+
+def candidate_starts(block, cluster_size):
+    """Offsets of the clusters in block whose first bytes may start a header."""
+    if np is not None:
+        data = np.frombuffer(block, dtype=np.uint8)
+        wanted = FIRST_MASK[data[0::cluster_size]]
+        wanted[: len(data[4::cluster_size])] |= FIFTH_MASK[data[4::cluster_size]]
+        return (np.flatnonzero(wanted) * cluster_size).tolist()
+    return [offset for offset in range(0, len(block), cluster_size)
+            if PREFILTER_FIRST[block[offset]] or (offset + 4 < len(block) and PREFILTER_FIFTH[block[offset + 4]])]
+
+def header_size(device, offset, signature, limit):
+    """Size of a file stored in its own header, None when the header does not say or is implausible."""
+    kind = signature["type"]
+    if kind == "bmp":
+        size = int.from_bytes(device.read(offset + 2, 4), "little")
+        return size if 26 <= size <= limit else None
+
+    if kind == "7z":
+        header = device.read(offset + 12, 16)
+        size = 32 + int.from_bytes(header[0:8], "little") + int.from_bytes(header[8:16], "little")
+        return size if size <= limit else None
+
+    if kind == "mp4":
+        # Walk the top-level boxes, the file ends where they stop
+        position = offset
+        while position - offset < limit:
+            box = device.read(position, 16)
+            if len(box) < 8 or bytes(box[4:8]) not in MP4_BOXES:
+                break
+            size = int.from_bytes(box[0:4], "big")
+            if size == 1 and len(box) == 16:
+                size = int.from_bytes(box[8:16], "big")  # 64-bit box size
+            if size < 8:
+                break  # Size 0 (box runs to the end of the file) or damaged
+            position += size
+        size = position - offset
+        return size if size > 8 and size <= limit else None
+    return None
+
+def footer_end(device, match, signature):
+    """End offset of a file whose footer matched at match (offsets relative to the device)."""
+    if signature["type"] == "zip":
+        # End of central directory: 22 bytes plus the archive comment
+        record = device.read(match, 22)
+        return match + 22 + int.from_bytes(record[20:22], "little")
+    return None
+
+def carve(instance, progress=None, cancel=None, limit=None, start=None, checkpoint=None, block_size=CARVE_BLOCK_SIZE):
+    """Find files by signature in the data area of a FAT32 or NTFS instance (see iter_carve).
+    progress reports clusters read, the scan can resume at cluster start."""
+    area_offset, first_cluster, cluster_count = instance.data_area()
+    start = first_cluster if start is None else max(start, first_cluster)
+    meter = ScanProgress(progress, max(0, first_cluster + cluster_count - start), instance.cluster_size)
+    found = iter_carve(instance.device, area_offset, instance.cluster_size, first_cluster, cluster_count,
+                       meter, cancel, start, checkpoint, block_size)
+    return stream_results(found, meter, limit)
+
+def iter_carve(device, area_offset, cluster_size, first_cluster, cluster_count, meter, cancel=None,
+               start=None, checkpoint=None, block_size=CARVE_BLOCK_SIZE):
+    """Stream the clusters once in large aligned blocks and yield the files that start at a cluster
+    with a known header, as items {"name", "file_size", "first_cluster", "data_offset"}.
+    A file whose footer is not found within the type's max_size is dropped.
+    checkpoint(cluster) is called at block edges where no file is waiting for its footer."""
+    batch = max(1, block_size // cluster_size)  # Clusters per block
+    stop = first_cluster + cluster_count
+    cluster = first_cluster if start is None else start
+    pending = []  # Files whose footer has not been seen yet: (start offset, first cluster, signature)
+
+    def item(offset, number, signature, size):
+        return {
+            "name": f"carved_{number}.{signature['type']}",
+            "file_size": size,
+            "first_cluster": number,
+            "data_offset": offset,
+        }
+
+    def blocks(begin):
+        for number in range(begin, stop, batch):
+            overlap = FOOTER_OVERLAP if number > first_cluster else 0
+            block_offset = area_offset + (number - first_cluster) * cluster_size
+            yield [(block_offset - overlap, min(batch, stop - number) * cluster_size + overlap)]
+
+    # The next blocks are read in the background while this one is matched
+    reads = device.read_ahead(blocks(cluster))
+    try:
+        for data in reads:
+            if cancelled(cancel):
+                return
+            count = min(batch, stop - cluster)
+            block_offset = area_offset + (cluster - first_cluster) * cluster_size
+            overlap = FOOTER_OVERLAP if cluster > first_cluster else 0
+            if data is None:
+                raise OSError(f"Cannot read the block at offset {block_offset}.")
+            block = data[overlap:]
+            if not block:
+                break
+            found = []
+
+            headers = []
+            for offset in candidate_starts(block, cluster_size):
+                match = HEADER_PATTERN.match(block, offset)
+                if match is not None:
+                    headers.append((offset, SIGNATURE_BY_GROUP[match.lastgroup]))
+
+            for offset, signature in headers:
+                number = cluster + offset // cluster_size
+                start_offset = block_offset + offset
+                if signature["footer"] is None:
+                    size = header_size(device, start_offset, signature, signature["max_size"])
+                    if size is not None:
+                        found.append(item(start_offset, number, signature, size))
+                else:
+                    pending.append((start_offset, number, signature))
+
+            # Footers close the files opened in earlier blocks or in this one
+            if pending:
+                footers = {}
+                for kind in {signature["type"] for _, _, signature in pending}:
+                    # Matches that end inside the overlap were already seen with the previous block
+                    footers[kind] = [(block_offset - overlap + match.start(), block_offset - overlap + match.end())
+                                     for match in FOOTER_PATTERNS[kind].finditer(data)
+                                     if match.end() > overlap]
+                still_pending = []
+                for start_offset, number, signature in pending:
+                    end = next((footer for footer in footers[signature["type"]] if footer[0] > start_offset), None)
+                    if end is not None:
+                        file_end = footer_end(device, end[0], signature) or end[1]
+                        if file_end - start_offset <= signature["max_size"]:
+                            found.append(item(start_offset, number, signature, file_end - start_offset))
+                    elif block_offset + len(block) - start_offset < signature["max_size"]:
+                        still_pending.append((start_offset, number, signature))
+                pending = still_pending
+
+            found.sort(key=lambda result: result["data_offset"])
+            meter.advance(count)
+            yield from found
+            cluster += count
+            if checkpoint is not None and not pending:
+                checkpoint(cluster)
+    finally:
+        reads.close()  # Stops the read-ahead when the scan ends early
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_CATALOG = os.path.join(os.path.expanduser("~"), ".disk_recovery", "catalog.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    volume   TEXT NOT NULL,
+    mode     TEXT NOT NULL,
+    position INTEGER,           -- Next cluster / MFT record to scan, NULL when the scan cannot resume
+    complete INTEGER NOT NULL,
+    updated  REAL NOT NULL,
+    PRIMARY KEY (volume, mode)
+);
+CREATE TABLE IF NOT EXISTS results (
+    volume TEXT NOT NULL,
+    mode   TEXT NOT NULL,
+    seq    INTEGER NOT NULL,     -- Order in which the scan found the item
+    item   TEXT NOT NULL,        -- JSON of the item dict
+    PRIMARY KEY (volume, mode, seq)
+);
+"""
+
+class ScanCatalog:
+    """Scan results and progress kept in SQLite, keyed by volume identity.
+    A finished scan of an unchanged volume is answered from the catalog without touching the disk,
+    an interrupted deep scan resumes from its last checkpoint."""
+
+    def __init__(self, path=DEFAULT_CATALOG):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def volume_key(self, instance):
+        """Disk, partition offset and a hash of the volume's boot-sector fields."""
+        signature = hashlib.sha1(bytes(instance.volume_signature())).hexdigest()
+        return f"{instance.disk}|{instance.begin}|{signature}"
+
+    def status(self, instance, mode):
+        """"complete", "partial" (resumable) or None when the scan has to start from scratch."""
+        row = self.db.execute("SELECT position, complete FROM scans WHERE volume = ? AND mode = ?",
+                              (self.volume_key(instance), scan_mode(mode))).fetchone()
+        if row is None:
+            return None
+        if row[1]:
+            return "complete"
+        return "partial" if row[0] is not None else None
+
+    def forget(self, instance, mode=None):
+        """Drop saved results of a volume (one mode or all of them)."""
+        volume = self.volume_key(instance)
+        modes = [scan_mode(mode)] if mode else SCAN_MODES
+        with self.db:
+            for name in modes:
+                self.db.execute("DELETE FROM scans WHERE volume = ? AND mode = ?", (volume, name))
+                self.db.execute("DELETE FROM results WHERE volume = ? AND mode = ?", (volume, name))
+
+    def saved_items(self, volume, mode):
+        rows = self.db.execute("SELECT item FROM results WHERE volume = ? AND mode = ? ORDER BY seq",
+                               (volume, mode))
+        for (item,) in rows:
+            yield json.loads(item)
+
+    def scan(self, instance, mode="quick", progress=None, cancel=None, workers=None, refresh=False):
+        """Like instance.iter_deleted(mode), but answered from and saved to the catalog."""
+        mode = scan_mode(mode)
+        volume = self.volume_key(instance)
+        if refresh:
+            self.forget(instance, mode)
+
+        row = self.db.execute("SELECT position, complete FROM scans WHERE volume = ? AND mode = ?",
+                              (volume, mode)).fetchone()
+        if row is not None and row[1]:
+            yield from self.saved_items(volume, mode)  # Unchanged volume, nothing to read
+            return
+
+        start = None
+        if row is not None and row[0] is not None:
+            start = row[0]
+            yield from self.saved_items(volume, mode)  # Found before the interruption
+        else:
+            with self.db:
+                self.db.execute("DELETE FROM results WHERE volume = ? AND mode = ?", (volume, mode))
+
+        seq = self.db.execute("SELECT COUNT(*) FROM results WHERE volume = ? AND mode = ?",
+                              (volume, mode)).fetchone()[0]
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO scans VALUES (?, ?, ?, 0, ?)", (volume, mode, start, time.time()))
+
+        pending = []  # Found since the last checkpoint
+
+        def save(position, complete=False):
+            nonlocal seq
+            with self.db:
+                self.db.executemany("INSERT INTO results VALUES (?, ?, ?, ?)",
+                                    [(volume, mode, seq + index, json.dumps(item)) for index, item in enumerate(pending)])
+                self.db.execute("UPDATE scans SET position = ?, complete = ?, updated = ? WHERE volume = ? AND mode = ?",
+                                (position, int(complete), time.time(), volume, mode))
+            seq += len(pending)
+            pending.clear()
+
+        position = start
+        def checkpoint(next_position):
+            nonlocal position
+            position = next_position
+            save(position)
+
+        found = instance.iter_deleted(mode, progress=progress, cancel=cancel, workers=workers,
+                                      start=start, checkpoint=checkpoint)
+        try:
+            for item in found:
+                pending.append(item)
+                yield item
+        finally:
+            found.close()
+
+        if cancel is None or not cancel.is_set():
+            save(position, complete=True)
+
+SCAN_MODES = ("quick", "full", "exhaustive", "carve")
+
+def scan_mode(mode):
+    return mode if mode in SCAN_MODES else "full"
@@ -1,148 +1,328 @@
-import mbr
-from fat32 import FAT32
-from ntfs import NTFS
-from offset_reader import read_offset_in_hex, read_offset_in_dec, read_offset_in_string, print_hex
-from converter import byte_converter
-import datetime
-
-def partition_selection():
-    # Ask user to input a valid drive letter
-    while True:
-        print("------------------------------------------------")
-        # List to hold all valid partitions
-        supported_partitions = {}
-
-        # Retrieve partition info for the given disk
-        drive_info = mbr.get_drive_info()
-        
-        # If there are partitions, add them to the list
-        for letter, info in drive_info.items():
-            format_type = mbr.partition_format(info['disk'], info['first_offset'])
-
-            if format_type is None:
-                continue
-
-            info['format'] = format_type
-
-            if letter not in supported_partitions:
-                supported_partitions[letter] = info
-
-        # Print the available partitions with letter drives and volume names
-        print("NTFS or FAT32 partitions found:\n")
-        for letter, info in supported_partitions.items():
-            print(f"Drive {letter},  volume_name: ({info['volume_name'] if len(info['volume_name']) else "NO NAME"}), disk: {info['disk']}, partition: {info['partition']}, format: {info['format']}")   
-
-        print("\nType the letter with a colon (C:, D:, ...) to continue.") # Have to type exactly "C:" for instance
-        print("Type BACK to exit.")
-        print("Command: ", end="")
-        choice = input().strip().upper()  # Get the user's input and convert it to uppercase
-
-        if choice == "":
-            continue
-
-        if choice == "BACK": # Terminate
-            print("Thank you, bye bye")
-            exit(0)
-
-        # Check if the input is a valid drive letter
-        selected_partition = None
-        for letter in supported_partitions.keys():
-            if letter == choice:
-                selected_partition = supported_partitions[letter]
-                break
-        
-        if selected_partition:
-            print(f"You have selected drive {selected_partition['letter']} ({selected_partition['volume_name'] if selected_partition['volume_name'] else "NO NAME"})")
-            print(f"Physical Drive: {selected_partition['disk']}")
-            print(f"Partition: {selected_partition['partition']}")
-            return selected_partition  # Exit the loop if the selection is valid
-        else:
-            print("Invalid selection. Please choose a valid drive letter (C:, D:, ...).")
-
-def deleted_files(instance, mode = "quick"):
-    print("Loading deleted files...")
-    del_items = instance.scan_quick() if mode == "quick" else instance.scan_all()
-    print("------------------------------------------------")
-    print("Found:\n")
-
-    for index, item in enumerate(del_items):
-        print(f"Index {index}: Filename: {item["name"]}, size: {byte_converter(item["file_size"])}")
-
-    print("\nNote: Due to data structure, some filename prefixes might be lost a few characters")
-    return del_items
-
-def partition_process():
-    print("------------------------------------------------")
-    print("     Nguyen Dinh Nhan's Disk Recovery Tool")
-    disk = partition_selection()
-    #print_hex(read_offset_in_hex(disk['disk'], disk['first_offset'], 512)) # Print master boot sector
-
-    if disk['format'] == "FAT32":
-        instance = FAT32(disk = disk['disk'], first_offset = disk['first_offset'])
-    else:
-        instance = NTFS(disk = disk['disk'], first_offset = disk['first_offset'])
-
-    del_items = deleted_files(instance) # Scan RDET first by default
-
-    while True:
-        print("------------------------------------------------")
-        print("Choose any files to recover by typing their file indexes (eg. 4 17)")
-        print("Type QUICK to scan quickly.")
-        print("Type FULL to scan deeply.")
-        print("Type BACK to return to partition choices.")
-        print("Command: ", end="")
-        choice = input().strip().upper()  # Get the user's input and convert it to uppercase
-
-        if choice == "":
-            continue
-
-        if choice == "BACK":
-            return partition_process()
-        
-        if choice == "QUICK":
-            del_items = deleted_files(instance)
-            continue
-        
-        if choice == "FULL":
-            del_items = deleted_files(instance, "full")
-            continue
-
-        file_index_str = choice.split()
-        file_index = []
-
-        # Check conditions
-        try:
-            for index in file_index_str:
-                value = int(index)
-                file_index.append(value)
-                if 0 <= value < len(del_items):
-                    continue
-                else:
-                    1 / 0 # Raise any errors to exit  
-                
-        except:
-            print("Invalid selection. Please make sure all selections are valid and within allowed range.")
-            continue
-
-        print("Note: We recommend not to choose the recovery partition to prevent data loss.")
-        print("Destination (where you want to save, eg. C:\Program Files): ", end="")
-        dest = input().strip().upper()  # Get the user's input and convert it to uppercase
-
-        try:
-            complete = 0
-            print("Recovering...\nCompleted 0%")
-            for index, item in enumerate(del_items):
-                if index in file_index:
-                    current_datetime = datetime.datetime.now()
-                    formatted_datetime = current_datetime.strftime("%d-%m-%Y_%H-%M-%S")
-                    print(f"\nCreating {dest}\\{formatted_datetime}_{item["name"]} | recover from {item["name"]}, index #{index}")
-
-                    instance.recover_data(f"{dest}\\{formatted_datetime}_{item["name"]}", item)
-
-                    complete += 1
-                    print(f"Completed {complete / len(file_index) * 100:.1f}%")
-        except Exception as e:
-            print("Something went wrong... Please try again")
-            print(f"Error: {e}")
-        print("\nDone\nComing back...")
-
+import mbr
+from fat32 import FAT32
+from ntfs import NTFS
+from offset_reader import read_offset_in_hex, read_offset_in_dec, read_offset_in_string, print_hex
+from converter import byte_converter
+from parallel import default_workers
+from catalog import ScanCatalog
+from batch_recovery import recover_batch
+from instrumentation import StatsReporter
+from imaging import image_volume
+from result_store import ResultStore, ResultView, PAGE_SIZE
+from block_device import parse_size
+import datetime
+import os
+
+SCAN_COMMANDS = {"QUICK": "quick", "FULL": "full", "FULL ALL": "exhaustive", "CARVE": "carve"}
+
+def partition_selection(disks = None):
+    # Ask user to input a valid drive letter
+    refresh = False
+    while True:
+        print("------------------------------------------------")
+        # NTFS and FAT32 partitions, read from the partition tables once per session
+        supported_partitions = mbr.get_drive_info(disks, refresh)
+        refresh = False
+
+        # Print the available partitions with letter drives and volume names
+        print("NTFS or FAT32 partitions found:\n")
+        for letter, info in supported_partitions.items():
+            print(f"Drive {letter},  volume_name: ({info['volume_name'] if len(info['volume_name']) else "NO NAME"}), disk: {info['disk']}, partition: {info['partition']}, format: {info['format']}")   
+
+        print("\nType the letter with a colon (C:, D:, ...) or the name shown to continue.") # Have to type exactly "C:" for instance
+        print("Type REFRESH to read the partition tables again.")
+        print("Type BACK to exit.")
+        print("Command: ", end="")
+        choice = input().strip()
+
+        if choice == "":
+            continue
+
+        if choice.upper() == "REFRESH":
+            refresh = True
+            continue
+
+        if choice.upper() == "BACK": # Terminate
+            print("Thank you, bye bye")
+            exit(0)
+
+        # Check if the input is a valid drive letter
+        selected_partition = None
+        for letter in supported_partitions.keys():
+            if letter.upper() == choice.upper():
+                selected_partition = supported_partitions[letter]
+                break
+        
+        if selected_partition:
+            print(f"You have selected drive {selected_partition['letter']} ({selected_partition['volume_name'] if selected_partition['volume_name'] else "NO NAME"})")
+            print(f"Physical Drive: {selected_partition['disk']}")
+            print(f"Partition: {selected_partition['partition']}")
+            return selected_partition  # Exit the loop if the selection is valid
+        else:
+            print("Invalid selection. Please choose a valid drive letter (C:, D:, ...).")
+
+def print_progress(done, total, bytes_per_second):
+    if total:
+        print(f"... scanned {done}/{total} ({done / total * 100:.1f}%), {byte_converter(bytes_per_second)}/s")
+    else:
+        print(f"... scanned {done}, {byte_converter(bytes_per_second)}/s")
+
+def print_recovery_progress(done, total, bytes_per_second):
+    eta = (total - done) / bytes_per_second if bytes_per_second else 0
+    percent = done / total * 100 if total else 100.0
+    print(f"... {byte_converter(done)} of {byte_converter(total)} ({percent:.1f}%), {byte_converter(bytes_per_second)}/s, ETA {eta:.0f} s")
+
+def deleted_files(instance, mode = "quick", catalog = None, refresh = False, stats_interval = 0):
+    print("Loading deleted files... (press Ctrl+C to stop the scan and keep what was found)")
+    status = None
+    if catalog is not None and not refresh:
+        status = catalog.status(instance, mode)
+        if status == "complete":
+            print("This volume has not changed since the last scan, showing saved results.")
+        elif status == "partial":
+            print("Resuming the interrupted scan from its last checkpoint.")
+    if status != "complete" and mode in ("full", "exhaustive") and hasattr(instance, "deep_scan_plan"):
+        # Only when the disk is scanned, saved results are shown without loading the FAT or walking directories
+        plan = instance.deep_scan_plan(mode == "exhaustive")
+        print(f"Reading {plan['clusters']} of {plan['total']} clusters, skipping {plan['skip_ratio'] * 100:.1f}% held by live files.")
+    print("------------------------------------------------")
+    print("Found:\n")
+
+    workers = None if mode in ("quick", "carve") else default_workers()
+    store = ResultStore() # Columns instead of a dict per file, a deep scan can find millions
+    if catalog is not None:
+        found = catalog.scan(instance, mode, progress=print_progress, workers=workers, refresh=refresh)
+    else:
+        found = instance.iter_deleted(mode, progress=print_progress, workers=workers)
+
+    # List the first page while the scan is still running, then only count
+    try:
+        with StatsReporter(instance.stats, stats_interval):
+            for item in found:
+                if len(store) < PAGE_SIZE:
+                    print_item(len(store), item)
+                elif len(store) == PAGE_SIZE:
+                    print("... more files found, type LIST or NEXT after the scan to see them")
+                store.append(item)
+    except KeyboardInterrupt:
+        print("\nScan stopped.")
+    finally:
+        found.close()
+
+    print(f"\nFound {len(store)} files.")
+    print("Note: Due to data structure, some filename prefixes might be lost a few characters")
+    return ResultView(store)
+
+def format_runs(runs):
+    """(vcn, count) pairs as "3-5, 9", cluster numbers counted from the start of the file."""
+    return ", ".join(f"{vcn}-{vcn + count - 1}" if count > 1 else f"{vcn}" for vcn, count in runs)
+
+def print_item(index, item):
+    reused = f", {item['reallocated']} cluster(s) reused by other files" if item.get("reallocated") else ""
+    print(f"Index {index}: Filename: {item.get('path', item['name'])}, size: {byte_converter(item['file_size'])}{reused}")
+
+def list_page(view, page = None):
+    for index, item in view.page_items(page):
+        print_item(index, item)
+    filters = ", ".join(f"{key} {value}" for key, value in view.filters.items())
+    print(f"Page {view.page + 1} of {view.pages()}, {len(view)} of {len(view.store)} files"
+          + (f" (filter: {filters})" if filters else "") + f", sorted by {view.order[0]}{' descending' if view.order[1] else ''}.")
+
+def view_command(view, choice):
+    """Paging, sorting and filtering commands of the result list. Returns False when choice is not one of them."""
+    words = choice.split()
+    if choice in ("LIST", "NEXT", "PREV") or (words[0] == "LIST" and len(words) == 2 and words[1].isdigit()):
+        if choice == "NEXT":
+            page = view.page + 1
+        elif choice == "PREV":
+            page = view.page - 1
+        else:
+            page = int(words[1]) - 1 if len(words) == 2 else view.page
+        list_page(view, page)
+        return True
+
+    if words[0] == "SORT" and len(words) in (2, 3):
+        try:
+            view.sort(words[1].lower(), words[2:] == ["DESC"])
+        except ValueError as e:
+            print(e)
+            return True
+        list_page(view)
+        return True
+
+    if words[0] != "FILTER":
+        return False
+    field = words[1] if len(words) > 1 else ""
+    value = choice.split(None, 2)[2] if len(words) > 2 else None
+    try:
+        if field == "CLEAR":
+            view.clear_filters()
+        elif field == "NAME":
+            view.set_filter("name", value)
+        elif field == "PATH":
+            view.set_filter("path", value.replace("\\", "/") if value else None) # Paths of the results use /
+        elif field == "EXT":
+            view.set_filter("extensions", value.replace(",", " ").split() if value else None)
+        elif field == "SIZE":
+            low, _, high = (value or "").partition("-")
+            sizes = {"min_size": parse_size(low) if low.strip() else None, "max_size": parse_size(high) if high.strip() else None}
+            view.filters = {key: value for key, value in dict(view.filters, **sizes).items() if value is not None}
+            view.refresh()
+        else:
+            print("Filter by NAME, EXT, SIZE or PATH, or type FILTER CLEAR.")
+            return True
+    except ValueError:
+        print("Invalid size, use eg. FILTER SIZE 100K-20M.")
+        return True
+    list_page(view)
+    return True
+
+def open_partition(disk):
+    if disk['format'] == "FAT32":
+        return FAT32(disk = disk['disk'], first_offset = disk['first_offset'])
+    return NTFS(disk = disk['disk'], first_offset = disk['first_offset'])
+
+def image_partition(disk, instance, free_only = False, stats_interval = 0):
+    """Copy the selected partition to a local sparse image file.
+    Returns the partition entry of the image, None when nothing was made."""
+    print("Image file (eg. D:\\usb.img): ", end="")
+    path = input().strip().strip('"')
+    if path == "":
+        return None
+    if os.path.abspath(path) == os.path.abspath(disk['disk']):
+        print("The image cannot be written over the disk it is copied from.")
+        return None
+
+    what = "metadata and free clusters of " if free_only else ""
+    print(f"Copying {what}{disk['letter']} ({byte_converter(disk['size'])}) to {path}... (press Ctrl+C to stop)")
+    try:
+        with StatsReporter(instance.stats, stats_interval):
+            result = image_volume(instance, path, disk['size'], free_only, progress=print_recovery_progress)
+    except KeyboardInterrupt:
+        os.remove(path)
+        print("\nImaging stopped, the incomplete image was removed.")
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Imaging failed: {e}")
+        return None
+
+    print(f"Copied {byte_converter(result['copied'])} in {result['seconds']:.1f} s, {byte_converter(result['holes'])} of zeros left as holes"
+          + (f", {byte_converter(result['skipped'])} of live files skipped" if free_only else "") + ".")
+    if not result['sparse']:
+        print("Note: the file system of the image would not make it sparse, its zeros take disk space.")
+    if result['unreadable']:
+        print(f"Warning: {byte_converter(result['unreadable'])} could not be read (bad sectors) and are zeros in the image.")
+    print(f"Scans and recoveries now read {path} instead of the device.")
+    return dict(disk, disk = path, first_offset = 0, letter = f"{path}#0", partition = 0)
+
+def partition_process(disks = None):
+    print("------------------------------------------------")
+    print("     Nguyen Dinh Nhan's Disk Recovery Tool")
+    disk = partition_selection(disks)
+    #print_hex(read_offset_in_hex(disk['disk'], disk['first_offset'], 512)) # Print master boot sector
+
+    instance = open_partition(disk)
+
+    catalog = ScanCatalog() # Saved scan results and checkpoints
+    stats_interval = 0 # Seconds between two stats lines during scans and recoveries, 0 = off
+    del_items = deleted_files(instance, catalog=catalog) # Scan RDET first by default
+
+    while True:
+        print("------------------------------------------------")
+        print("Choose any files to recover by typing their file indexes (eg. 4 17)")
+        print("Type QUICK to scan quickly.")
+        print("Type FULL to scan deeply (free clusters and folders only).")
+        print("Type FULL ALL to scan every cluster.")
+        print("Type CARVE to find files by their content (after a format or when no entry is left).")
+        print("Type RESCAN QUICK, RESCAN FULL, RESCAN FULL ALL or RESCAN CARVE to ignore saved results and scan again.")
+        print("Type LIST, NEXT or PREV to page through the files found (LIST <page> to jump).")
+        print("Type SORT NAME, SORT SIZE, SORT PATH or SORT INDEX, add DESC for the reverse order.")
+        print("Type FILTER NAME <pattern>, FILTER EXT <extensions>, FILTER SIZE <min>-<max> (eg. 1M-20M), FILTER PATH <pattern> or FILTER CLEAR. Indexes are those of the filtered list.")
+        print("Type IMAGE to copy the partition to a local image file and work on the copy, IMAGE FREE to copy only metadata and free clusters.")
+        print("Type STATS to show I/O and timing numbers, STATS <seconds> to print them during scans (STATS 0 to stop).")
+        print("Type BACK to return to partition choices.")
+        print("Command: ", end="")
+        choice = input().strip().upper()  # Get the user's input and convert it to uppercase
+
+        if choice == "":
+            continue
+
+        if choice == "BACK":
+            catalog.close()
+            return partition_process(disks)
+        
+        if choice == "STATS":
+            print(instance.stats.stats_line())
+            continue
+
+        if choice.startswith("STATS ") and choice[6:].isdigit():
+            stats_interval = int(choice[6:])
+            continue
+
+        if choice in ("IMAGE", "IMAGE FREE"):
+            image = image_partition(disk, instance, choice == "IMAGE FREE", stats_interval)
+            if image is not None:
+                disk = image
+                instance = open_partition(disk)
+                del_items = deleted_files(instance, catalog=catalog, stats_interval=stats_interval)
+            continue
+
+        if choice in SCAN_COMMANDS:
+            del_items = deleted_files(instance, SCAN_COMMANDS[choice], catalog=catalog, stats_interval=stats_interval)
+            continue
+
+        if choice.startswith("RESCAN ") and choice[7:] in SCAN_COMMANDS:
+            del_items = deleted_files(instance, SCAN_COMMANDS[choice[7:]], catalog=catalog, refresh=True, stats_interval=stats_interval)
+            continue
+
+        if view_command(del_items, choice):
+            continue
+
+        file_index_str = choice.split()
+        file_index = []
+
+        # Check conditions
+        try:
+            for index in file_index_str:
+                value = int(index)
+                file_index.append(value)
+                if 0 <= value < len(del_items):
+                    continue
+                else:
+                    1 / 0 # Raise any errors to exit  
+                
+        except:
+            print("Invalid selection. Please make sure all selections are valid and within allowed range.")
+            continue
+
+        print("Note: We recommend not to choose the recovery partition to prevent data loss.")
+        print("Destination (where you want to save, eg. C:\\Program Files): ", end="")
+        dest = input().strip().strip('"')  # Kept as typed, paths are case-sensitive on Linux
+
+        current_datetime = datetime.datetime.now()
+        formatted_datetime = current_datetime.strftime("%d-%m-%Y_%H-%M-%S")
+        jobs = []
+        for index in dict.fromkeys(file_index): # Each index once, in the typed order
+            item = del_items[index]
+            jobs.append((item, os.path.join(dest, f"{formatted_datetime}_{index}_{item['name']}")))
+
+        for item, _ in jobs:
+            if item.get("reallocated"):
+                print(f"Warning: {item['reallocated']} cluster(s) of {item['name']} are used by other files now, that part will not be the original content.")
+                if item.get("reallocated_runs"):
+                    print(f"  Reused clusters of the file: {format_runs(item['reallocated_runs'])}")
+        print(f"Recovering {len(jobs)} files...")
+        with StatsReporter(instance.stats, stats_interval):
+            results = recover_batch(instance, jobs, progress=print_recovery_progress)
+        failed = 0
+        for result in results:
+            if result["error"] is None:
+                print(f"Created {result['path']} ({byte_converter(result['bytes'])}) | recover from {result['name']}")
+                if result["unreadable"]:
+                    print(f"Warning: {byte_converter(result['unreadable'])} of it could not be read (bad sectors) and were written as zeros.")
+            else:
+                failed += 1
+                print(f"Failed {result['name']}: {result['error']}")
+        print(f"Recovered {len(results) - failed} of {len(results)} files.")
+        print("\nDone\nComing back...")
+
@@ -0,0 +1,514 @@
+import bisect
+import hashlib
+import json
+import os
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:  # Optional, only needed for .zst images
+    zstandard = None
+
+from block_device import threaded_read_ahead, PREFETCH_DEPTH
+
+GZIP_MAGIC = b"\x1f\x8b\x08"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+SKIPPABLE_FRAMES = range(0x184D2A50, 0x184D2A60)  # Magic numbers of zstd skippable frames
+SEEKABLE_MAGIC = 0x8F92EAB1                       # Last 4 bytes of a zstd file in the seekable format
+INDEX_MAGIC = b"DRIDX1"
+INDEX_FOLDER = os.path.join(os.path.expanduser("~"), ".disk_recovery", "indexes")  # When the image's folder is read-only
+MIB = 1024 * 1024
+SEEK_SPACING = 16 * MIB       # Uncompressed bytes between two seek points inside one gzip member
+WINDOW_SIZE = MIB             # Decompressed bytes cached together
+CACHE_SIZE = 64 * MIB         # Memory cap of the cached windows of one image
+INPUT_SIZE = 64 * 1024        # Compressed bytes read at a time
+OUTPUT_SIZE = 4 * MIB         # Most bytes returned by one inflate call
+DEFLATE_HISTORY = 32 * 1024   # How far back a deflate stream can copy from
+BOUNDARY_SEARCH = 256 * 1024  # Compressed bytes searched for a deflate block start after a spacing point
+SEARCH_OUTPUT = 64 * MIB      # Decompressed bytes kept during that search (zeros compress 1000:1)
+VERIFY_SIZE = 4096            # Compressed bytes a candidate block start must inflate like the member
+
+def compression_format(path):
+    """"gzip" or "zstd" when the file starts with their magic number, else None."""
+    try:
+        with open(path, "rb") as image:
+            head = image.read(4)
+    except OSError:
+        return None
+    if head[:3] == GZIP_MAGIC:
+        return "gzip"
+    if head == ZSTD_MAGIC:
+        return "zstd"
+    return None
+
+def read_at(handle, offset, size):
+    handle.seek(offset)
+    return handle.read(size)
+
+def read_chunks(handle, offset):
+    """Compressed data from offset to the end of the file, INPUT_SIZE bytes at a time."""
+    while True:
+        chunk = read_at(handle, offset, INPUT_SIZE)
+        if not chunk:
+            return
+        yield chunk
+        offset += len(chunk)
+
+def deflate_bits(value, count):
+    return [value >> index & 1 for index in range(count)]
+
+def primer(bits):
+    """Empty deflate blocks that end bits past a byte edge: (whole bytes, value of the low bits of one
+    more byte). Python's zlib has no inflatePrime, so a decoder started inside a byte inflates these
+    first: it is then at the right bit, has written nothing, and meets byte edges where the stream has
+    them (stored blocks start on one). Fixed blocks take 10 bits, for an odd count a dynamic block
+    with only an end-of-block code takes 95."""
+    fixed = [0, 1, 0] + [0] * 7  # BFINAL 0, BTYPE 01, end-of-block
+    if bits % 2:
+        lengths = {18: 1, 0: 2, 1: 2}  # Code length code: 18 (a run of zeros) is "0", 0 is "10", 1 is "11"
+        dynamic = [0, 0, 1] + deflate_bits(0, 5) + deflate_bits(0, 5) + deflate_bits(15, 4)
+        for symbol in (16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2, 14, 1, 15):
+            dynamic += deflate_bits(lengths.get(symbol, 0), 3)
+        # 256 literal lengths of 0 (runs of 138 and 118), end-of-block of length 1, one distance code of length 0
+        dynamic += [0] + deflate_bits(127, 7) + [0] + deflate_bits(107, 7) + [1, 1] + [1, 0] + [0]
+        sequence = dynamic + fixed * ((bits - 7) % 8 // 2)
+    else:
+        sequence = fixed * (bits // 2)
+    value = sum(bit << index for index, bit in enumerate(sequence))
+    whole = len(sequence) // 8
+    return value.to_bytes(whole + 1, "little")[:whole], value >> 8 * whole
+
+PRIMERS = [primer(bits) for bits in range(8)]
+
+def primed(data, bits):
+    """Compressed data whose first byte is read from a bit offset, ready for a fresh raw inflater."""
+    if not bits:
+        return bytes(data)
+    prefix, low = PRIMERS[bits]
+    return prefix + bytes([data[0] & (0xFF << bits) & 0xFF | low]) + bytes(data[1:])
+
+def gzip_header_end(handle, offset):
+    """Offset of the deflate data of the gzip member at offset, None when no member starts there."""
+    head = read_at(handle, offset, 10)
+    if len(head) < 10 or head[:3] != GZIP_MAGIC:
+        return None
+    flags = head[3]
+    position = offset + 10
+    if flags & 4:  # FEXTRA
+        position += 2 + int.from_bytes(read_at(handle, position, 2), "little")
+    for flag in (8, 16):  # FNAME and FCOMMENT, zero-terminated
+        if not flags & flag:
+            continue
+        while True:
+            chunk = read_at(handle, position, 4096)
+            if not chunk:
+                return None
+            end = chunk.find(b"\0")
+            if end >= 0:
+                position += end + 1
+                break
+            position += len(chunk)
+    if flags & 2:  # FHCRC
+        position += 2
+    return position
+
+def dynamic_header_possible(value):
+    """Cheap test of the bits of a non-final dynamic block header (value holds at least 71 of them):
+    the code length code must be complete, as zlib requires."""
+    if value >> 3 & 31 > 29 or value >> 8 & 31 > 29:
+        return False  # More length or distance codes than deflate has
+    kraft = 0
+    for index in range((value >> 13 & 15) + 4):
+        length = value >> (17 + 3 * index) & 7
+        if length:
+            kraft += 128 >> length
+    return kraft == 128
+
+def stored_length_possible(region, byte):
+    """LEN and its one's complement NLEN at a byte, as a stored block has after its header."""
+    header = region[byte:byte + 4]
+    return len(header) == 4 and header[0] ^ header[2] == 0xFF and header[1] ^ header[3] == 0xFF
+
+def inflate_candidate(region, byte, bits, history, size, end):
+    """Up to size bytes inflated from a bit offset of region up to byte end, with history before it.
+    None when zlib refuses the data."""
+    try:
+        inflater = zlib.decompressobj(-15, zdict=history) if history else zlib.decompressobj(-15)
+        return inflater.decompress(primed(region[byte:end], bits), size)
+    except zlib.error:
+        return None
+
+def find_block_start(handle, inflater, position, total, history):
+    """A deflate block that starts in the BOUNDARY_SEARCH bytes after position, as a seek point
+    (uncompressed offset, byte offset, bit offset, compressed history), None when none is found.
+    inflater is a copy of the member's decompressor about to read position, total the bytes it has
+    written so far and history the last DEFLATE_HISTORY of them.
+    Python's zlib does not report block edges (no Z_BLOCK), so the region is inflated one byte at a
+    time to learn how much output each byte completes. A bit offset where a block header can start is
+    taken when inflating VERIFY_SIZE compressed bytes from there, with the history before it, gives
+    the same bytes as the member and stops at the same place."""
+    region = read_at(handle, position, BOUNDARY_SEARCH + VERIFY_SIZE)
+    output = bytearray(history)
+    base = total - len(history)  # Uncompressed offset of output[0]
+    ends = [total]               # ends[i]: bytes written once the first i bytes of region are read
+    for index in range(len(region)):
+        try:
+            output += inflater.decompress(region[index:index + 1])
+        except zlib.error:
+            return None
+        ends.append(base + len(output))
+        if inflater.eof or len(output) > SEARCH_OUTPUT:
+            return None  # Too close to the end of the member, or a run of zeros too long to keep
+        candidate = index + 1 - VERIFY_SIZE  # The byte whose bit offsets can be checked now
+        if candidate < 0 or candidate >= BOUNDARY_SEARCH:
+            continue
+
+        value = int.from_bytes(region[candidate:candidate + 11], "little")
+        stored = (stored_length_possible(region, candidate + 1), stored_length_possible(region, candidate + 2))
+        for bits in range(8):
+            header = value >> bits
+            kind = header & 7  # BFINAL and BTYPE: 4 is a dynamic block, 0 a stored one, final blocks are no use
+            if kind == 4:
+                if not dynamic_header_possible(header):
+                    continue
+            elif kind != 0 or not stored[bits > 5]:  # The stored header ends in the next byte from bit 6 on
+                continue
+            start = ends[candidate + (bits > 0)]
+            window = bytes(output[max(0, start - base - DEFLATE_HISTORY):start - base])
+            # The inflated bytes must match, and stop where the member's decoder stopped
+            expected = ends[index + 1] - start
+            data = inflate_candidate(region, candidate, bits, window, expected + 1, index + 1)
+            if data is not None and len(data) == expected and data == output[start - base:start - base + expected]:
+                return start, position + candidate, bits, zlib.compress(window)
+    return None
+
+def gzip_points(handle, spacing=SEEK_SPACING):
+    """Seek points of a gzip file, found in one pass: the start of every member, and inside a member
+    a deflate block start about every spacing bytes (see find_block_start).
+    Returns ([(uncompressed offset, byte offset, bit offset, compressed history or None)], size)."""
+    points = []
+    total = 0
+    member = 0
+    while True:
+        start = gzip_header_end(handle, member)
+        if start is None:
+            break  # End of the file, or padding after the last member
+        points.append((total, start, 0, None))
+        inflater = zlib.decompressobj(-15)
+        position = start
+        history = b""
+        next_point = total + spacing
+        while True:
+            chunk = read_at(handle, position, INPUT_SIZE)
+            if not chunk:
+                raise OSError("The gzip image is truncated.")
+            snapshot = (inflater.copy(), position, total, history)
+            data = inflater.decompress(chunk, OUTPUT_SIZE)
+            while True:
+                total += len(data)
+                history = (history + data[-DEFLATE_HISTORY:])[-DEFLATE_HISTORY:]
+                if inflater.eof or not inflater.unconsumed_tail:
+                    break
+                data = inflater.decompress(inflater.unconsumed_tail, OUTPUT_SIZE)
+            if total >= next_point:
+                point = find_block_start(handle, *snapshot)
+                if point is not None:
+                    points.append(point)
+                next_point = (point[0] if point is not None else total) + spacing
+            if inflater.eof:
+                member = position + len(chunk) - len(inflater.unused_data) + 8  # After the CRC32 and size trailer
+                break
+            position += len(chunk)
+    return points, total
+
+def inflate_from(handle, offset, bits, history):
+    """Data of a deflate stream from a seek point to the end of its gzip member."""
+    inflater = zlib.decompressobj(-15, zdict=zlib.decompress(history)) if history else zlib.decompressobj(-15)
+    chunks = read_chunks(handle, offset)
+    for chunk in chunks:
+        if bits:
+            chunk = primed(chunk, bits)
+            bits = 0
+        data = inflater.decompress(chunk, OUTPUT_SIZE)
+        while True:
+            if data:
+                yield data
+            if inflater.eof or not inflater.unconsumed_tail:
+                break
+            data = inflater.decompress(inflater.unconsumed_tail, OUTPUT_SIZE)
+        if inflater.eof:
+            return
+    raise OSError("The gzip image is truncated.")
+
+def zstd_frame_end(handle, position, header_size, checksum):
+    """Offset after a zstd frame, found from its block headers without decompressing it."""
+    position += header_size
+    while True:
+        header = read_at(handle, position, 3)
+        if len(header) < 3:
+            raise OSError("The zstd image is truncated.")
+        value = int.from_bytes(header, "little")
+        position += 3 + (1 if value >> 1 & 3 == 1 else value >> 3)  # An RLE block stores one byte
+        if value & 1:
+            return position + (4 if checksum else 0)
+
+class FrameInput:
+    """File-like view of the compressed bytes of one zstd frame, so the decompressor stops at its end."""
+
+    def __init__(self, handle, offset, end):
+        self.handle = handle
+        self.offset = offset
+        self.end = end
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.end - self.offset
+        data = read_at(self.handle, self.offset, min(size, self.end - self.offset))
+        self.offset += len(data)
+        return data
+
+def zstd_from(handle, offset):
+    """Data of the zstd frame at offset, at most OUTPUT_SIZE bytes at a time (a frame of zeros can
+    decompress to hundreds of MiB from one input chunk)."""
+    head = read_at(handle, offset, 18)
+    end = zstd_frame_end(handle, offset, zstandard.frame_header_size(head), head[4] & 4)
+    reader = zstandard.ZstdDecompressor().stream_reader(FrameInput(handle, offset, end), read_size=INPUT_SIZE)
+    try:
+        while True:
+            data = reader.read(OUTPUT_SIZE)
+            if not data:
+                return
+            yield data
+    except zstandard.ZstdError as e:
+        raise OSError(f"The zstd image is damaged: {e}")
+
+def seek_table(handle, file_size):
+    """Seek points from the seek table of the zstd seekable format, None when the file has none."""
+    if file_size < 17:
+        return None
+    footer = read_at(handle, file_size - 9, 9)
+    if int.from_bytes(footer[5:9], "little") != SEEKABLE_MAGIC:
+        return None
+    frames = int.from_bytes(footer[0:4], "little")
+    entry_size = 12 if footer[4] & 0x80 else 8  # Entries carry a checksum when the flag is set
+    table = read_at(handle, file_size - 9 - frames * entry_size, frames * entry_size)
+    points = []
+    total = 0
+    position = 0
+    for number in range(frames):
+        entry = table[number * entry_size:number * entry_size + 8]
+        points.append((total, position, 0, None))
+        position += int.from_bytes(entry[0:4], "little")
+        total += int.from_bytes(entry[4:8], "little")
+    return points, total
+
+def zstd_points(handle, file_size):
+    """Seek points of a zstd file: the start of every frame, from the seek table of the seekable format
+    when there is one, else by walking the frame headers (frames that do not store their size are
+    decompressed to count it). A single-frame file has one point, reads then decompress from its start."""
+    table = seek_table(handle, file_size)
+    if table is not None:
+        return table
+    points = []
+    total = 0
+    position = 0
+    while position < file_size:
+        head = read_at(handle, position, 18)
+        if int.from_bytes(head[0:4], "little") in SKIPPABLE_FRAMES:
+            position += 8 + int.from_bytes(head[4:8], "little")
+            continue
+        if head[:4] != ZSTD_MAGIC:
+            break
+        size = zstandard.get_frame_parameters(head).content_size
+        if size == zstandard.CONTENTSIZE_UNKNOWN:
+            size = sum(len(data) for data in zstd_from(handle, position))
+        points.append((total, position, 0, None))
+        total += size
+        position = zstd_frame_end(handle, position, zstandard.frame_header_size(head), head[4] & 4)
+    return points, total
+
+def index_paths(path):
+    """Where the index of an image is kept: beside it, else in INDEX_FOLDER."""
+    key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+    return [path + ".idx", os.path.join(INDEX_FOLDER, f"{key}.idx")]
+
+def load_index(path, stamp):
+    """(points, size) saved for the image, None when there is no index or the image changed since."""
+    for index_path in index_paths(path):
+        try:
+            with open(index_path, "rb") as index:
+                if index.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    continue
+                header = json.loads(index.read(int.from_bytes(index.read(4), "little")))
+                if header.get("image") != stamp:
+                    continue
+                histories = index.read()
+        except (OSError, ValueError):
+            continue
+        points = [(start, offset, bits, histories[low:high] if high > low else None)
+                  for start, offset, bits, low, high in header["points"]]
+        return points, header["size"]
+    return None
+
+def save_index(path, stamp, points, size):
+    """Write the index beside the image, or in INDEX_FOLDER when that fails. Returns its path, None if neither works."""
+    histories = bytearray()
+    entries = []
+    for start, offset, bits, history in points:
+        low = len(histories)
+        histories += history or b""
+        entries.append([start, offset, bits, low, len(histories)])
+    header = json.dumps({"image": stamp, "size": size, "points": entries}).encode("utf-8")
+    for index_path in index_paths(path):
+        temporary = index_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+            with open(temporary, "wb") as index:
+                index.write(INDEX_MAGIC + len(header).to_bytes(4, "little") + header + histories)
+            os.replace(temporary, index_path)  # Atomic, a crash leaves the old index
+            return index_path
+        except OSError:
+            continue
+    return None
+
+class CompressedImage:
+    """A gzip or zstd disk image read in place. A seek-point index, built in one pass on first use and
+    saved beside the image, lets a read decompress from the nearest point before it instead of the
+    start. Decompressed windows are kept in an LRU cache, and a read past the last one goes on with
+    the same decompression, so sequential scans stream through the file once."""
+
+    def __init__(self, path, cache_size=CACHE_SIZE):
+        self.path = path
+        self.format = compression_format(path)
+        if self.format == "zstd" and zstandard is None:
+            raise OSError("Reading zstd images needs the zstandard package (pip install zstandard).")
+        self.handle = open(path, "rb")
+        stamp = [os.path.getsize(path), os.stat(path).st_mtime_ns]
+        index = load_index(path, stamp)
+        if index is None:
+            print(f"Indexing {path} for random access, this is done once...", file=sys.stderr)  # stdout may be JSON lines
+            if self.format == "gzip":
+                index = gzip_points(self.handle)
+            else:
+                index = zstd_points(self.handle, stamp[0])
+            save_index(path, stamp, *index)
+        self.points, self.size = index
+        self.starts = [point[0] for point in self.points]
+        self.max_windows = max(1, cache_size // WINDOW_SIZE)
+        self.windows = OrderedDict()  # window number -> bytes, oldest first
+        self.stream = None            # Decompression in progress, continued by the next read past it
+        self.window_start = 0         # Uncompressed offset of pending
+        self.pending = bytearray()    # Decompressed bytes of the window being filled
+        self.skip = 0                 # Bytes of the stream before the first whole window
+        self.hits = 0
+        self.misses = 0
+        self.reads = 0
+        self.bytes_read = 0
+        self.seeks = 0                # Decompressions started again from a seek point
+        self.seek_distance = 0
+        self.bytes_unreadable = 0
+        self.lock = threading.Lock()
+
+    def close(self):
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+            self.windows.clear()
+            self.handle.close()
+
+    def decompress_from(self, number):
+        """Decompressed data from seek point number to the end of the image, across members or frames."""
+        while number is not None:
+            start, offset, bits, history = self.points[number]
+            produced = start
+            if self.format == "gzip":
+                chunks = inflate_from(self.handle, offset, bits, history)
+            else:
+                chunks = zstd_from(self.handle, offset)
+            for data in chunks:
+                produced += len(data)
+                yield data
+            # The next member or frame starts where this one ends
+            following = bisect.bisect_left(self.starts, produced, number + 1)
+            while following < len(self.points) and self.starts[following] == produced and self.points[following][3] is not None:
+                following += 1
+            found = following < len(self.points) and self.starts[following] == produced
+            number = following if found else None
+
+    def restart(self, target):
+        """Start decompressing again from the last seek point at or before target."""
+        number = bisect.bisect_right(self.starts, target) - 1
+        if self.stream is not None:
+            self.stream.close()
+        self.seeks += 1
+        self.seek_distance += abs(target - self.window_start)
+        start = self.starts[number]
+        self.stream = self.decompress_from(number)
+        self.window_start = -(-start // WINDOW_SIZE) * WINDOW_SIZE
+        self.skip = self.window_start - start
+        self.pending = bytearray()
+
+    def window(self, number):
+        """Decompressed window number (WINDOW_SIZE bytes, shorter at the end). Called with the lock held."""
+        data = self.windows.get(number)
+        if data is not None:
+            self.hits += 1
+            self.windows.move_to_end(number)
+            return data
+
+        self.misses += 1
+        target = number * WINDOW_SIZE
+        nearest = self.starts[bisect.bisect_right(self.starts, target) - 1]
+        if self.stream is None or not nearest <= self.window_start <= target:
+            self.restart(target)
+        while number not in self.windows:
+            data = next(self.stream, None)
+            if data is None:
+                if self.pending:
+                    self.store(self.window_start // WINDOW_SIZE, bytes(self.pending))
+                self.stream = None
+                break
+            if self.skip:
+                dropped = min(self.skip, len(data))
+                data = data[dropped:]
+                self.skip -= dropped
+            self.pending += data
+            while len(self.pending) >= WINDOW_SIZE:
+                self.store(self.window_start // WINDOW_SIZE, bytes(self.pending[:WINDOW_SIZE]))
+                del self.pending[:WINDOW_SIZE]
+                self.window_start += WINDOW_SIZE
+        return self.windows.get(number, b"")
+
+    def store(self, number, data):
+        self.windows[number] = data
+        self.windows.move_to_end(number)
+        while len(self.windows) > self.max_windows:
+            self.windows.popitem(last=False)
+
+    def read(self, offset, size):
+        """Read size bytes from offset. The result is shorter only at the end of the image."""
+        if size <= 0 or offset >= self.size:
+            return memoryview(b"")
+        end = min(self.size, offset + size)
+        first = offset // WINDOW_SIZE
+        with self.lock:
+            parts = [self.window(number) for number in range(first, (end - 1) // WINDOW_SIZE + 1)]
+            self.reads += 1
+            self.bytes_read += end - offset
+        data = parts[0] if len(parts) == 1 else b"".join(parts)
+        start = offset - first * WINDOW_SIZE
+        return memoryview(data)[start:start + end - offset]
+
+    def read_bulk(self, offset, size):
+        return self.read(offset, size)
+
+    def align(self, sector_size):
+        pass  # Windows are already a multiple of any sector size
+
+    def read_ahead(self, blocks, depth=PREFETCH_DEPTH):
+        """Same as BlockDevice.read_ahead: the next blocks are decompressed in a background thread."""
+        return threaded_read_ahead(self, blocks, depth)
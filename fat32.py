@@ -1,228 +1,687 @@
-from offset_reader import read_offset_in_hex, read_offset_in_dec
-from converter import byte_converter
-from dos83_regulation import is_dos_8_3
-import re
-
-class FAT32:
-    def __init__(self, disk, first_offset):
-        self.begin = first_offset
-        self.disk = disk
-        self.mbs()
-
-    def read_offset(self, offset, size):
-        return read_offset_in_dec(self.disk, self.begin + offset, size)
-    
-    def mbs(self):
-        self.sector_size = self.read_offset(0x0B, 2)                     # Sector size in bytes
-        self.cluster_size = self.read_offset(0x0D, 1) * self.sector_size # Cluster size in bytes
-        self.mbs_size = self.read_offset(0x0E, 2) * self.sector_size     # MBS size in bytes
-        self.fat_num = self.read_offset(0x10, 1)                         # Number of fat tables
-        self.volume_size = self.read_offset(0x20, 4) * self.sector_size  # Volume size in bytes
-        self.fat_size = self.read_offset(0x24, 4) * self.sector_size     # Each Fat table size in bytes
-        self.RDET_cluster_begin = self.read_offset(0x2C, 4)              # First RDET cluster to start counting (2 in general)
-
-    def read_cluster(self, cluster_number):
-        """Read data in a given cluster"""
-        offset = self.begin + self.mbs_size + (self.fat_num * self.fat_size) + ((cluster_number - self.RDET_cluster_begin) * self.cluster_size)
-        return read_offset_in_hex(self.disk, offset, self.cluster_size)
-    
-    def read_fat_chain(self, start_cluster):
-        """Duyệt qua bảng FAT để lấy chuỗi cluster từ cluster bắt đầu."""
-        chain = []
-        current_cluster = start_cluster
-
-        # Offset của bảng FAT
-        fat_offset = self.begin + self.mbs_size
-
-        while True:
-            chain.append(current_cluster)
-            fat_entry_offset = fat_offset + (current_cluster * 4)  # Mỗi entry dài 4 byte trong FAT32
-            next_cluster = read_offset_in_dec(self.disk, fat_entry_offset, 4)
-
-            # Kiểm tra cluster tiếp theo
-            if next_cluster >= 0x0FFFFFF7:  # End of file (EOF)
-                break
-            elif next_cluster == 0x00000000:  # This cluster link is deleted
-                break
-
-            current_cluster = next_cluster  # Move to the next cluster
-        return chain
-
-    def clean_lfn_name(self, raw_name):
-        raw_name = re.sub(b'(\x00\x00|\xFF\xFF)+$', b'', raw_name)
-        return raw_name
-    
-    def scan_quick(self):
-        """Find all deleted files from either RDET or SDET"""
-        deleted_files = []
-        visited = {}
-    
-        def read_directory(cluster_number, depth):
-            """Đọc và duyệt qua một thư mục từ cluster chỉ định."""
-            
-            if depth > 1000 or cluster_number in visited: # Call too deep or this cluster is visited
-                return
-            
-            visited[cluster_number] = True
-            cluster_data = self.read_cluster(cluster_number)
-
-            if cluster_data is None: # If no data returned then skip
-                return
-            
-            entries = [cluster_data[i: i + 32] for i in range(0, len(cluster_data), 32)]  # Each entry has 32 bytes
-            
-            lfn_stack = []  # To temporarily save long name
-            last_found_lfn = -1
-
-            for index, entry in enumerate(entries):
-                # If the entry is null, then skip
-                if entry[0] == 0x00:  
-                    continue
-                
-                if last_found_lfn + 1 != index: 
-                    lfn_stack = []
-
-                # Check Long file name (LFN)
-                if entry[11] == 0x0F:
-                    lfn_part = (
-                        self.clean_lfn_name(entry[1:11] + entry[14:26] + entry[28:32])
-                    ).decode("utf-16le", errors="ignore")
-                    lfn_stack.insert(0, lfn_part)  # Ghép theo thứ tự ngược
-                    last_found_lfn = index
-                    continue
-                
-                # If it's volume label/system then skip
-                mask = 0b00001100
-                if mask & entry[0x0B]:
-                    continue
-                
-                # Assign name from LFN or from main entry if the name is too short
-                if lfn_stack:
-                    full_name = "".join(lfn_stack).strip()
-                else:
-                    full_name = (entry[0:8]).decode("utf-8", errors="ignore").strip()
-                    if not is_dos_8_3(full_name): continue
-                    extension = (entry[8:11]).decode("utf-8", errors="ignore").strip()
-
-                    if extension:
-                        if not is_dos_8_3(extension): continue
-                        full_name += "." + extension
-
-                first_cluster = int.from_bytes(entry[26:28] + entry[20:22], "little")
-                file_size = int.from_bytes(entry[28:32], "little")
-                if entry[0] == 0xE5 and ((entry[11] & 0x20) or (entry[11] & 0x21)):  # Deleted file only
-                    deleted_files.append({
-                        "name": full_name,
-                        "first_cluster": first_cluster,
-                        "file_size": file_size,
-                    })
-                
-                if (entry[11] & 0x10) or (entry[11] & 0x11):  # If entry is/was a directory
-                    if full_name == "." or full_name == "..": # Don't try to visit current and parent directory
-                        continue
-                    subdir_cluster = int.from_bytes(entry[26:28] + entry[20:22], "little")
-                    if subdir_cluster >= self.RDET_cluster_begin:  # Valid cluster
-                        read_directory(subdir_cluster, depth + 1)
-
-            cluster_chain = self.read_fat_chain(cluster_number) # Scan for all clusters belong to this RDET or SDET
-            for cluster in cluster_chain:
-                read_directory(cluster, depth + 1)
-            
-
-        # Start scanning from cluster "zero"
-        read_directory(self.RDET_cluster_begin, 0)
-        return deleted_files
-
-    def recover_data(self, path_to_filename, file_info: dict):
-        """Khôi phục dữ liệu từ một file bị xóa mà không dựa vào bảng FAT."""
-        bytes_read = 0
-
-        current_cluster = file_info["first_cluster"]
-        try:
-            with open(path_to_filename, "wb") as file:
-                while bytes_read < file_info["file_size"]:
-                    cluster_data = self.read_cluster(current_cluster)
-
-                    if cluster_data is None: # If reading this cluster failed (maybe due to bad bits status)
-                        raise Exception("No data returns")
-                    
-                    bytes_to_read = min(self.cluster_size, file_info["file_size"] - bytes_read)
-                    file.write(cluster_data[:bytes_to_read])
-                    bytes_read += bytes_to_read
-
-                    # Nếu đọc hết cluster hiện tại mà chưa đạt kích thước file, thử đọc tiếp cluster kế tiếp
-                    current_cluster += 1  # Chỉ đơn giản là đọc tiếp cluster tiếp theo liên tiếp
-        except Exception as e:
-            print(f"Error while recovering file: {e}")
-            return
-
-    def scan_all(self):
-        """Scan all potential clusters to find valid or deleted SDET entries."""
-        sdet_files = []
-        total_clusters = self.volume_size // self.cluster_size  # Tổng số cluster trong volume
-
-        for cluster_number in range(self.RDET_cluster_begin, total_clusters):
-            try:
-                lfn_stack = []  # To temporarily save long name
-                last_found_lfn = -1
-                cluster_data = self.read_cluster(cluster_number)
-
-                if cluster_data is None: # If reading this cluster failed (maybe due to bad bits status)
-                        raise Exception("No data returns")
-                
-                entries = [cluster_data[i:i + 32] for i in range(0, len(cluster_data), 32)]  # Mỗi entry dài 32 byte
-                
-                for index, entry in enumerate(entries):
-                    # Kiểm tra entry bị xóa
-                    if entry[0] != 0xE5:
-                        continue
-                    
-                    # If LFN chain does not continuous, then reset this list
-                    if last_found_lfn + 1 != index: 
-                        lfn_stack = []
-
-                    # Check Long file name (LFN)
-                    if entry[11] == 0x0F:
-                        lfn_part = (
-                            self.clean_lfn_name(entry[1:11] + entry[14:26] + entry[28:32])
-                        ).decode("utf-16le", errors="ignore")
-                        lfn_stack.insert(0, lfn_part)  # Ghép theo thứ tự ngược
-                        last_found_lfn = index
-                        continue
-
-                    # Kiểm tra byte thuộc tính (entry[11])
-                    attributes = entry[11]
-                    valid_attributes = {0x10, 0x20, 0x11, 0x21}  # Các giá trị hợp lệ
-                    if attributes not in valid_attributes:
-                        continue
-
-                    # Khôi phục hoặc đọc tên file
-                    name_bytes = entry[1:8]  # Khôi phục ký tự đầu tiên
-                    
-                    full_name = (name_bytes).decode("utf-8", errors="ignore").strip()
-                    extension = (entry[8:11]).decode("utf-8", errors="ignore").strip()          
-                    if extension:
-                        full_name += "." + extension        
-
-                    # If we have 
-                    if lfn_stack:
-                        full_name = "".join(lfn_stack).strip()
-
-                    first_cluster = int.from_bytes(entry[26:28] + entry[20:22], "little")
-                    file_size = int.from_bytes(entry[28:32], "little")
-
-                    if  first_cluster < self.RDET_cluster_begin or first_cluster > total_clusters or\
-                        file_size < 0 or file_size > self.volume_size:
-                        continue
-                    
-                    print(f"Scanning: Filename: {full_name}, size: {byte_converter(file_size)}")
-                    sdet_files.append({
-                        "name": full_name,
-                        "first_cluster": first_cluster,
-                        "file_size": file_size,
-                    })
-
-            except Exception:
-                continue
-
-        return sdet_files
+from block_device import open_device, MappedImage, write_segments, unreadable_bytes, COPY_BUFFER_SIZE
+from parallel import iter_shards, SHARDS_PER_WORKER
+from progress import ScanProgress, stream_results, cancelled
+from converter import byte_converter
+from dos83_regulation import is_dos_8_3
+from carver import carve
+from instrumentation import VolumeStats, profiled
+from array import array
+import re
+import sys
+
+try:
+    import numpy as np
+except ImportError:  # Optional, scan_all falls back to decoding entries one by one
+    np = None
+
+FAT_ENTRY_MASK = 0x0FFFFFFF  # Upper 4 bits of a FAT32 entry are reserved
+FAT_EOC = 0x0FFFFFF7         # Entries from here on mark a bad cluster or end of chain
+FAT_COMPARE_BLOCK = 4096     # Entries compared at once when looking for FAT #1/#2 differences
+SCAN_BATCH_SIZE = 1024 * 1024  # Bytes of clusters read and decoded together by scan_all
+VALID_ATTRIBUTES = (0x10, 0x20, 0x11, 0x21)  # Directory/archive entries, optionally read-only
+MAX_LFN_ENTRIES = 20           # A 255-character long name needs at most 20 LFN entries
+
+if np is not None:
+    # Standard 32-byte 8.3 directory entry
+    DIR_ENTRY_DTYPE = np.dtype([
+        ("name", "u1", (8,)), ("ext", "u1", (3,)), ("attr", "u1"), ("nt_reserved", "u1"),
+        ("create_time_tenth", "u1"), ("create_time", "<u2"), ("create_date", "<u2"),
+        ("access_date", "<u2"), ("cluster_hi", "<u2"), ("write_time", "<u2"),
+        ("write_date", "<u2"), ("cluster_lo", "<u2"), ("size", "<u4"),
+    ])
+
+class FAT32:
+    def __init__(self, disk, first_offset):
+        self.begin = first_offset
+        self.disk = disk
+        self.device = open_device(disk)  # One shared handle and page cache per disk
+        self.fats = {}                   # Loaded FAT copies, by index (0 = FAT #1)
+        self.plans = {}                  # Deep-scan plans, by exhaustive flag
+        self.stats = VolumeStats(self.device)  # I/O counters and phase timers of this volume
+        with self.stats.phase("boot sector"):
+            self.mbs()
+        self.device.align(self.sector_size)  # Reads on 4Kn disks cover whole sectors
+
+    def read_offset(self, offset, size):
+        return int.from_bytes(self.device.read(self.begin + offset, size), "little")
+    
+    def mbs(self):
+        self.sector_size = self.read_offset(0x0B, 2)                     # Sector size in bytes
+        self.cluster_size = self.read_offset(0x0D, 1) * self.sector_size # Cluster size in bytes
+        self.mbs_size = self.read_offset(0x0E, 2) * self.sector_size     # MBS size in bytes
+        self.fat_num = self.read_offset(0x10, 1)                         # Number of fat tables
+        self.volume_size = self.read_offset(0x20, 4) * self.sector_size  # Volume size in bytes
+        self.fat_size = self.read_offset(0x24, 4) * self.sector_size     # Each Fat table size in bytes
+        self.RDET_cluster_begin = self.read_offset(0x2C, 4)              # First RDET cluster to start counting (2 in general)
+        data_size = self.volume_size - self.mbs_size - self.fat_num * self.fat_size
+        self.cluster_count = max(0, data_size // self.cluster_size)      # Number of data clusters
+
+    def load_fat(self, fat_index=0, mapped=None):
+        """Load a whole FAT copy in one bulk read, once. Entries are 32-bit cluster links.
+        Memory-mapped images keep the table as a view of the mapping unless mapped is False."""
+        if fat_index in self.fats:
+            return self.fats[fat_index]
+        if not 0 <= fat_index < self.fat_num:
+            raise ValueError(f"FAT #{fat_index + 1} does not exist, this volume has {self.fat_num}.")
+
+        if mapped is None:
+            mapped = isinstance(self.device, MappedImage)
+
+        with self.stats.phase("fat load"):
+            data = self.device.read(self.begin + self.mbs_size + fat_index * self.fat_size, self.fat_size)
+            data = data[: len(data) // 4 * 4]
+            if mapped and sys.byteorder == "little":
+                table = memoryview(data).cast("I")  # No copy, pages are faulted in on access
+            else:
+                table = array("I")
+                table.frombytes(data)
+                if sys.byteorder == "big":
+                    table.byteswap()  # FAT entries are stored little-endian
+
+        self.fats[fat_index] = table
+        return table
+
+    def fat_entry(self, cluster, fat_index=0):
+        """Link stored in the FAT for a cluster, 0 if it is outside the table."""
+        table = self.load_fat(fat_index)
+        if 0 <= cluster < len(table):
+            return table[cluster] & FAT_ENTRY_MASK
+        return 0
+
+    def is_free(self, cluster):
+        return self.fat_entry(cluster) == 0
+
+    def count_free_clusters(self):
+        """Number of data clusters marked free in FAT #1."""
+        table = self.load_fat()
+        end = min(len(table), self.cluster_count + 2)
+        return sum(1 for index in range(2, end) if not table[index] & FAT_ENTRY_MASK)
+
+    def compare_fats(self, first=0, second=1):
+        """Clusters whose links differ between two FAT copies (FAT #1 and #2 by default)."""
+        if self.fat_num < 2:
+            return []
+
+        table_a = self.load_fat(first)
+        table_b = self.load_fat(second)
+        end = min(len(table_a), len(table_b))
+        different = []
+
+        # Compare whole blocks in C and only walk the blocks that differ
+        for block in range(0, end, FAT_COMPARE_BLOCK):
+            block_end = min(block + FAT_COMPARE_BLOCK, end)
+            if table_a[block:block_end] == table_b[block:block_end]:
+                continue
+            different.extend(index for index in range(block, block_end)
+                             if (table_a[index] ^ table_b[index]) & FAT_ENTRY_MASK)
+        return different
+
+    def cluster_offset(self, cluster_number):
+        """Disk offset of a data cluster"""
+        return self.begin + self.mbs_size + (self.fat_num * self.fat_size) + ((cluster_number - self.RDET_cluster_begin) * self.cluster_size)
+
+    def data_area(self):
+        """(disk offset, number of the first cluster, cluster count) of the data region."""
+        return self.cluster_offset(self.RDET_cluster_begin), self.RDET_cluster_begin, self.cluster_count
+
+    def read_cluster(self, cluster_number):
+        """Read data in a given cluster"""
+        offset = self.cluster_offset(cluster_number)
+        try:
+            return self.device.read(offset, self.cluster_size)
+        except OSError:
+            return None
+    
+    def read_fat_chain(self, start_cluster):
+        """Duyệt qua bảng FAT để lấy chuỗi cluster từ cluster bắt đầu."""
+        table = self.load_fat()  # Whole FAT #1 in memory, no disk read per link
+        chain = []
+        seen = set()
+        current_cluster = start_cluster
+
+        while True:
+            chain.append(current_cluster)
+            seen.add(current_cluster)
+            if not 0 <= current_cluster < len(table):  # Link points outside the FAT
+                break
+            next_cluster = table[current_cluster] & FAT_ENTRY_MASK
+
+            # Kiểm tra cluster tiếp theo
+            if next_cluster >= FAT_EOC:  # End of file (EOF)
+                break
+            elif next_cluster == 0x00000000:  # This cluster link is deleted
+                break
+            elif next_cluster in seen:  # Damaged FAT, the chain loops back on itself
+                break
+
+            current_cluster = next_cluster  # Move to the next cluster
+        return chain
+
+    def clean_lfn_name(self, raw_name):
+        raw_name = re.sub(b'(\x00\x00|\xFF\xFF)+$', b'', raw_name)
+        return raw_name
+
+    def lfn_part(self, entry):
+        """Decode the 13 UTF-16 characters of one LFN entry (bytes or memoryview)."""
+        raw_name = b"".join((entry[1:11], entry[14:26], entry[28:32]))  # The only copy of the entry
+        return self.clean_lfn_name(raw_name).decode("utf-16le", errors="ignore")
+
+    def entry_cluster(self, entry):
+        """First cluster of a directory entry: high word at 0x14, low word at 0x1A."""
+        return int.from_bytes(entry[26:28], "little") | (int.from_bytes(entry[20:22], "little") << 16)
+    
+    def iter_deleted(self, mode="quick", progress=None, cancel=None, limit=None, workers=None,
+                     start=None, checkpoint=None):
+        """Yield deleted entries as soon as they are found.
+        mode "quick" walks the directory tree, "full" scans free and directory clusters and
+        "exhaustive" scans every cluster (see deep_scan_plan) and "carve" finds files by signature (see carver).
+        progress(done, total, bytes_per_second) reports clusters read; total is None for a quick scan.
+        The scan stops when cancel (a threading.Event) is set or after limit results.
+        A deep scan can resume at cluster start; checkpoint(cluster) is called whenever every
+        entry before that cluster has been yielded. The quick scan has no checkpoints."""
+        if mode == "carve":
+            return self.stats.timed("carve", carve(self, progress, cancel, limit, start, checkpoint))
+        if mode == "quick":
+            meter = ScanProgress(progress, None, self.cluster_size)
+            found = self.stats.timed("directory walk", self.iter_quick(meter, cancel))
+        else:
+            with self.stats.phase("scan plan"):
+                extents = trim_extents(self.deep_scan_plan(mode == "exhaustive")["extents"], start)
+            meter = ScanProgress(progress, sum(stop - first for first, stop, _ in extents), self.cluster_size)
+            found = self.stats.timed("deep scan", self.iter_full(meter, cancel, workers, start, checkpoint, mode == "exhaustive"))
+        return stream_results(found, meter, limit)
+
+    def volume_signature(self):
+        """Bytes that identify this volume and change when it is written: boot sector and FSInfo."""
+        fsinfo_sector = self.read_offset(0x30, 2)
+        return b"".join((self.device.read(self.begin, self.sector_size),
+                         self.device.read(self.begin + fsinfo_sector * self.sector_size, self.sector_size)))
+
+    @profiled
+    def scan_quick(self):
+        """Find all deleted files from either RDET or SDET"""
+        return list(self.iter_deleted("quick"))
+
+    def iter_quick(self, meter, cancel=None):
+        """Generator behind the quick scan: deleted files of the RDET and every SDET reachable from it.
+        Directories are walked from a work stack, not by recursion, and each item gets its full
+        "path" from the root, e.g. "Photos/2023/a.jpg"."""
+        visited = set()  # Every directory cluster already read, a cluster is never read twice
+        pending = [(self.RDET_cluster_begin, "")]  # (first cluster, path) of directories still to read
+
+        while pending:
+            if cancelled(cancel):
+                return
+            first_cluster, folder = pending.pop()
+            if first_cluster in visited:
+                continue
+
+            # Whole cluster chain of the directory, read as runs of consecutive clusters
+            chain = [cluster for cluster in self.read_fat_chain(first_cluster) if cluster not in visited]
+            visited.update(chain)
+            meter.advance(len(chain))
+            subdirectories = []
+
+            lfn_stack = []  # To temporarily save long name
+            last_found_lfn = -1
+            index = -1  # Entry number in the whole directory, LFN entries may cross a cluster edge
+            for first, count in self.cluster_runs(chain):
+                data = self.read_clusters(first, count)
+                if data is None: # If no data returned then skip
+                    index += count * self.cluster_size // 32
+                    continue
+
+                for position in range(0, len(data) - 31, 32):
+                    index += 1
+                    entry = data[position : position + 32]  # Each entry has 32 bytes, sliced without copying
+                    # If the entry is null, then skip
+                    if entry[0] == 0x00:
+                        continue
+
+                    if last_found_lfn + 1 != index:
+                        lfn_stack = []
+
+                    # Check Long file name (LFN)
+                    if entry[11] == 0x0F:
+                        lfn_stack.insert(0, self.lfn_part(entry))  # Ghép theo thứ tự ngược
+                        last_found_lfn = index
+                        continue
+
+                    # If it's volume label/system then skip
+                    mask = 0b00001100
+                    if mask & entry[0x0B]:
+                        continue
+
+                    # Assign name from LFN or from main entry if the name is too short
+                    if lfn_stack:
+                        full_name = "".join(lfn_stack).strip()
+                    else:
+                        full_name = str(entry[0:8], "utf-8", errors="ignore").strip()
+                        if not is_dos_8_3(full_name): continue
+                        extension = str(entry[8:11], "utf-8", errors="ignore").strip()
+
+                        if extension:
+                            if not is_dos_8_3(extension): continue
+                            full_name += "." + extension
+
+                    path = f"{folder}/{full_name}" if folder else full_name
+                    first_cluster = self.entry_cluster(entry)
+                    file_size = int.from_bytes(entry[28:32], "little")
+                    if entry[0] == 0xE5 and ((entry[11] & 0x20) or (entry[11] & 0x21)):  # Deleted file only
+                        yield {
+                            "name": full_name,
+                            "path": path,
+                            "first_cluster": first_cluster,
+                            "file_size": file_size,
+                        }
+
+                    if (entry[11] & 0x10) or (entry[11] & 0x11):  # If entry is/was a directory
+                        if full_name == "." or full_name == "..": # Don't try to visit current and parent directory
+                            continue
+                        if self.RDET_cluster_begin <= first_cluster < self.cluster_count + 2:  # Valid cluster
+                            subdirectories.append((first_cluster, path))
+
+            # Sub-directories are read in the order of their entries
+            pending.extend(reversed(subdirectories))
+
+    def cluster_runs(self, clusters):
+        """Clusters grouped into runs of consecutive clusters: [(first cluster, count)]."""
+        runs = []
+        for cluster in clusters:
+            if runs and runs[-1][0] + runs[-1][1] == cluster:
+                runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+            else:
+                runs.append((cluster, 1))
+        return runs
+
+    @profiled
+    def recover_data(self, path_to_filename, file_info: dict, buffer_size=COPY_BUFFER_SIZE):
+        """Khôi phục dữ liệu từ một file bị xóa, theo chuỗi FAT nếu còn, nếu không thì các cluster liên tiếp."""
+        try:
+            with self.stats.phase("recovery"):
+                segments = self.file_segments(file_info)
+                written = write_segments(self.device, path_to_filename, segments, buffer_size)
+            self.stats.count("bytes recovered", written)
+            unreadable = unreadable_bytes(self.device, segments)
+            if unreadable:
+                self.stats.count("unreadable bytes", unreadable)
+                print(f"Warning: {byte_converter(unreadable)} of {file_info['name']} could not be read and were written as zeros.")
+            return written
+        except Exception as e:
+            print(f"Error while recovering file: {e}")
+            return
+
+    def file_segments(self, file_info):
+        """Disk ranges of a file for write_segments, cut to its size."""
+        if "data_offset" in file_info:  # Carved file, no directory entry behind it
+            return [("disk", file_info["data_offset"], file_info["file_size"])]
+
+        segments = []
+        remaining = file_info["file_size"]
+        for first, count in self.file_extents(file_info):
+            length = min(count * self.cluster_size, remaining)
+            segments.append(("disk", self.cluster_offset(first), length))
+            remaining -= length
+        return segments
+
+    def file_clusters(self, file_info):
+        """Clusters of a file: its FAT chain when the chain survived deletion and matches the size,
+        else consecutive clusters from the first one (deleting a file clears its chain)."""
+        first_cluster = file_info["first_cluster"]
+        needed = -(-file_info["file_size"] // self.cluster_size)
+        if needed == 0:
+            return []
+
+        if 2 <= first_cluster < self.cluster_count + 2 and not self.is_free(first_cluster):
+            chain = self.read_fat_chain(first_cluster)
+            last_link = self.fat_entry(chain[-1])
+            if len(chain) == needed and last_link >= FAT_EOC:
+                return chain
+        return list(range(first_cluster, first_cluster + needed))
+
+    def file_extents(self, file_info):
+        """Clusters of a file grouped into runs of consecutive clusters: [(first cluster, count)]."""
+        return self.cluster_runs(self.file_clusters(file_info))
+
+    def read_clusters(self, first_cluster, count):
+        """Read a run of consecutive clusters in one request"""
+        offset = self.cluster_offset(first_cluster)
+        try:
+            return self.device.read(offset, count * self.cluster_size)
+        except OSError:
+            return None
+
+    def decode_entries_loop(self, data, lfn_carry, total_clusters):
+        """Deleted directory entries in a run of clusters, one entry at a time.
+        lfn_carry holds the LFN parts (disk order) that ended the previous run; returns (items, carry)."""
+        items = []
+        lfn_parts = list(lfn_carry)  # LFN entries directly before the current entry, in disk order
+
+        for index in range(len(data) // 32):
+            entry = data[index * 32 : index * 32 + 32]  # Mỗi entry dài 32 byte
+
+            # Kiểm tra entry bị xóa
+            if entry[0] != 0xE5:
+                lfn_parts = []
+                continue
+
+            # Check Long file name (LFN)
+            if entry[11] == 0x0F:
+                lfn_parts.append(self.lfn_part(entry))
+                if len(lfn_parts) > MAX_LFN_ENTRIES:
+                    del lfn_parts[0]  # Older parts cannot belong to the same name
+                continue
+
+            lfn_stack, lfn_parts = lfn_parts, []
+            item = self.deleted_entry(entry, lfn_stack, total_clusters)
+            if item is not None:
+                items.append(item)
+
+        return items, lfn_parts
+
+    def decode_entries_vectorized(self, data, lfn_carry, total_clusters):
+        """Same result as decode_entries_loop, but candidates are picked with NumPy masks
+        over the whole run and only the hits (and their LFN entries) are decoded in Python."""
+        count = len(data) // 32
+        entries = np.frombuffer(data, dtype=DIR_ENTRY_DTYPE, count=count)
+        deleted = entries["name"][:, 0] == 0xE5
+        attributes = entries["attr"]
+        first_cluster = entries["cluster_lo"].astype(np.uint32) | (entries["cluster_hi"].astype(np.uint32) << 16)
+
+        candidates = (deleted & np.isin(attributes, VALID_ATTRIBUTES)
+                      & (first_cluster >= self.RDET_cluster_begin) & (first_cluster <= total_clusters)
+                      & (entries["size"] <= self.volume_size))
+        is_lfn = (deleted & (attributes == 0x0F)).tolist()
+
+        items = []
+        for index in np.flatnonzero(candidates).tolist():
+            # Walk back over the LFN entries right before this one
+            lfn_start = index
+            while lfn_start > 0 and index - lfn_start < MAX_LFN_ENTRIES and is_lfn[lfn_start - 1]:
+                lfn_start -= 1
+            lfn_stack = [self.lfn_part(data[i * 32 : i * 32 + 32]) for i in range(lfn_start, index)]
+            if lfn_start == 0:
+                lfn_stack = (list(lfn_carry) + lfn_stack)[-MAX_LFN_ENTRIES:]  # LFN chain started in the previous run
+
+            item = self.deleted_entry(data[index * 32 : index * 32 + 32], lfn_stack, total_clusters)
+            if item is not None:
+                items.append(item)
+
+        # LFN entries at the end of the run belong to an entry in the next run
+        tail = count
+        while tail > 0 and count - tail < MAX_LFN_ENTRIES and is_lfn[tail - 1]:
+            tail -= 1
+        carry = [self.lfn_part(data[i * 32 : i * 32 + 32]) for i in range(tail, count)]
+        if tail == 0:
+            carry = (list(lfn_carry) + carry)[-MAX_LFN_ENTRIES:]
+        return items, carry
+
+    def deleted_entry(self, entry, lfn_stack, total_clusters):
+        """Build the result of a deleted 8.3 entry, None if it does not look valid.
+        lfn_stack holds its LFN parts in disk order (last part of the name first)."""
+        # Kiểm tra byte thuộc tính (entry[11])
+        if entry[11] not in VALID_ATTRIBUTES:
+            return None
+
+        # Khôi phục hoặc đọc tên file
+        name_bytes = entry[1:8]  # Khôi phục ký tự đầu tiên
+
+        full_name = str(name_bytes, "utf-8", errors="ignore").strip()
+        extension = str(entry[8:11], "utf-8", errors="ignore").strip()
+        if extension:
+            full_name += "." + extension
+
+        # If we have a long name, it replaces the 8.3 name
+        if lfn_stack:
+            full_name = "".join(reversed(lfn_stack)).strip()
+
+        first_cluster = self.entry_cluster(entry)
+        file_size = int.from_bytes(entry[28:32], "little")
+
+        if  first_cluster < self.RDET_cluster_begin or first_cluster > total_clusters or\
+            file_size < 0 or file_size > self.volume_size:
+            return None
+
+        return {
+            "name": full_name,
+            "first_cluster": first_cluster,
+            "file_size": file_size,
+        }
+
+    def decode_entries(self, data, lfn_carry, total_clusters):
+        if np is not None:
+            return self.decode_entries_vectorized(data, lfn_carry, total_clusters)
+        return self.decode_entries_loop(data, lfn_carry, total_clusters)
+
+    def live_directory_clusters(self):
+        """Clusters of every directory still reachable from the RDET through live (not deleted) entries."""
+        clusters = set()
+        pending = [self.RDET_cluster_begin]
+
+        while pending:
+            first_cluster = pending.pop()
+            if first_cluster in clusters:
+                continue
+            chain = self.read_fat_chain(first_cluster)
+            clusters.update(chain)
+
+            for cluster in chain:
+                cluster_data = self.read_cluster(cluster)
+                if cluster_data is None:
+                    continue
+                for index in range(len(cluster_data) // 32):
+                    entry = cluster_data[index * 32 : index * 32 + 32]
+                    if entry[0] in (0x00, 0xE5, 0x2E) or entry[11] == 0x0F:  # Empty, deleted, "."/".." or LFN
+                        continue
+                    if entry[11] & 0x10 and not entry[11] & 0x08:  # Live sub-directory
+                        subdir_cluster = self.entry_cluster(entry)
+                        if self.RDET_cluster_begin <= subdir_cluster < self.cluster_count + 2:
+                            pending.append(subdir_cluster)
+        return clusters
+
+    def deep_scan_plan(self, exhaustive=False):
+        """Clusters a deep scan reads, as {"extents": [(start, stop)], "clusters": n, "total": n, "skip_ratio": r}.
+        The guided plan keeps only clusters that are free in the FAT or belong to live directories,
+        since data of live files cannot hold orphaned directory entries. exhaustive keeps every cluster."""
+        if exhaustive in self.plans:
+            return self.plans[exhaustive]
+
+        total_clusters = self.volume_size // self.cluster_size  # Tổng số cluster trong volume
+        total = max(0, total_clusters - self.RDET_cluster_begin)
+
+        if exhaustive:
+            extents = [(self.RDET_cluster_begin, total_clusters)] if total else []
+        else:
+            table = self.load_fat()
+            end = min(len(table), self.cluster_count + 2)
+            directories = self.live_directory_clusters()
+            extents = wanted_extents(table, self.RDET_cluster_begin, end, directories)
+
+        clusters = sum(stop - start for start, stop in extents)
+        plan = {
+            "extents": extents,
+            "clusters": clusters,
+            "total": total,
+            "skip_ratio": 1 - clusters / total if total else 0.0,
+        }
+        self.plans[exhaustive] = plan
+        return plan
+
+    def image_extents(self):
+        """Byte ranges [(offset, length)] of the volume a metadata image keeps: boot sector, reserved
+        sectors and FATs, then the clusters of the guided deep-scan plan (free clusters and live directories)."""
+        data_start = self.mbs_size + self.fat_num * self.fat_size
+        extents = [(0, data_start)]
+        for start, stop in self.deep_scan_plan()["extents"]:
+            extents.append((data_start + (start - self.RDET_cluster_begin) * self.cluster_size, (stop - start) * self.cluster_size))
+        return extents
+
+    def lfn_lookback(self, start_cluster, total_clusters, floor=None):
+        """LFN parts that end just before start_cluster, as a serial scan would carry them in.
+        Clusters before floor (the start of the extent being scanned) are not looked at."""
+        floor = self.RDET_cluster_begin if floor is None else floor
+        if start_cluster <= floor:
+            return []
+
+        count = -(-(MAX_LFN_ENTRIES * 32) // self.cluster_size)  # Enough clusters to hold a whole LFN chain
+        first_cluster = max(floor, start_cluster - count)
+        data = self.read_clusters(first_cluster, start_cluster - first_cluster)
+        if data is None:
+            return []
+        return self.decode_entries(data, [], total_clusters)[1]
+
+    def scan_range(self, start_cluster, stop_cluster):
+        """Deep-scan clusters [start_cluster, stop_cluster) for deleted entries, in cluster order."""
+        return [item for _, items in self.iter_range(start_cluster, stop_cluster) for item in items]
+
+    def scan_extents(self, extents):
+        """Deep-scan (start, stop, floor) extents in order, floor being where the LFN carry may start."""
+        blocks = self.device.read_ahead(self.run_blocks(extents))  # One read-ahead across every extent
+        try:
+            return [item for start, stop, floor in extents for _, items in self.iter_range(start, stop, floor=floor, blocks=blocks) for item in items]
+        finally:
+            blocks.close()
+
+    def run_blocks(self, extents):
+        """Disk range of every run a deep scan of (start, stop, floor) extents decodes, one block per run."""
+        batch = max(1, SCAN_BATCH_SIZE // self.cluster_size)
+        for start, stop, _ in extents:
+            for first_cluster in range(start, stop, batch):
+                yield [(self.cluster_offset(first_cluster), min(batch, stop - first_cluster) * self.cluster_size)]
+
+    def iter_range(self, start_cluster, stop_cluster, cancel=None, floor=None, blocks=None):
+        """Deep-scan clusters [start_cluster, stop_cluster), yielding (clusters read, entries found) per run.
+        blocks is a read_ahead of run_blocks shared by consecutive ranges, else the range reads ahead on its own."""
+        total_clusters = self.volume_size // self.cluster_size  # Tổng số cluster trong volume
+        batch = max(1, SCAN_BATCH_SIZE // self.cluster_size)   # Clusters decoded together
+        lfn_carry = self.lfn_lookback(start_cluster, total_clusters, floor)  # LFN entries may continue into the next cluster
+        own_blocks = blocks is None
+        if own_blocks:
+            # The next runs are read in the background while this one is decoded
+            blocks = self.device.read_ahead(self.run_blocks([(start_cluster, stop_cluster, floor)]))
+        try:
+            for first_cluster, data in zip(range(start_cluster, stop_cluster, batch), blocks):
+                if cancelled(cancel):
+                    return
+                count = min(batch, stop_cluster - first_cluster)
+                found = []
+                pieces = [data]
+
+                if pieces[0] is None: # If reading this run failed (maybe due to bad bits status), retry cluster by cluster
+                    pieces = [self.read_cluster(cluster) for cluster in range(first_cluster, first_cluster + count)]
+
+                for data in pieces:
+                    try:
+                        if data is None:
+                            raise Exception("No data returns")
+
+                        items, lfn_carry = self.decode_entries(data, lfn_carry, total_clusters)
+                    except Exception:
+                        lfn_carry = []
+                        continue
+
+                    found.extend(items)
+
+                yield count, found
+        finally:
+            if own_blocks:
+                blocks.close()  # Stops the read-ahead when the scan ends early
+
+    def iter_full(self, meter, cancel=None, workers=None, start_cluster=None, checkpoint=None, exhaustive=False):
+        """Generator behind the deep scan, serial or sharded over worker processes."""
+        extents = trim_extents(self.deep_scan_plan(exhaustive)["extents"], start_cluster)
+
+        if workers and workers > 1:
+            batch = max(1, SCAN_BATCH_SIZE // self.cluster_size)
+            shards = [(tuple(shard),) for shard in split_extents(extents, workers * SHARDS_PER_WORKER, batch)]
+            results = iter_shards(scan_shard, (self.disk, self.begin), shards, workers, cancel)
+            for (shard,), items in results:
+                meter.advance(sum(stop - start for start, stop, _ in shard))
+                yield from items
+                if checkpoint is not None:
+                    checkpoint(shard[-1][1])
+        else:
+            blocks = self.device.read_ahead(self.run_blocks(extents))  # One read-ahead across every extent
+            try:
+                for start, stop, floor in extents:
+                    if cancelled(cancel):
+                        return
+                    position = start
+                    for count, items in self.iter_range(start, stop, cancel, floor, blocks):
+                        meter.advance(count)
+                        yield from items
+                        position += count
+                        if checkpoint is not None:
+                            checkpoint(position)
+            finally:
+                blocks.close()
+
+    @profiled
+    def scan_all(self, workers=None, exhaustive=False):
+        """Scan all potential clusters to find valid or deleted SDET entries.
+        Clusters of live files are skipped unless exhaustive is set (see deep_scan_plan).
+        With workers > 1 the cluster range is split into shards scanned by worker processes."""
+        sdet_files = list(self.iter_deleted("exhaustive" if exhaustive else "full", workers=workers))
+
+        for item in sdet_files:
+            print(f"Scanning: Filename: {item['name']}, size: {byte_converter(item['file_size'])}")
+        return sdet_files
+
+def scan_shard(disk, first_offset, extents):
+    """Process-pool worker: deep-scan one shard of (start, stop, floor) extents through its own handle."""
+    return FAT32(disk, first_offset).scan_extents(extents)
+
+def wanted_extents(table, start, end, directories):
+    """Runs [start, stop) of clusters that are free in the FAT table or listed in directories."""
+    if np is not None:
+        links = np.asarray(table[:end], dtype=np.uint32)
+        wanted = (links & FAT_ENTRY_MASK) == 0
+        listed = np.fromiter((cluster for cluster in directories if cluster < end), dtype=np.int64)
+        wanted[listed] = True
+        wanted[:start] = False
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], wanted.view(np.int8), [0]))))
+        return [(int(edges[i]), int(edges[i + 1])) for i in range(0, len(edges), 2)]
+
+    extents = []
+    run_start = None
+    for cluster in range(start, end):
+        if not table[cluster] & FAT_ENTRY_MASK or cluster in directories:
+            if run_start is None:
+                run_start = cluster
+        elif run_start is not None:
+            extents.append((run_start, cluster))
+            run_start = None
+    if run_start is not None:
+        extents.append((run_start, end))
+    return extents
+
+def trim_extents(extents, start=None):
+    """(start, stop, floor) pieces of the extents from cluster start on. floor is the extent start,
+    so a piece cut in the middle of an extent still picks up an LFN chain from before the cut."""
+    pieces = []
+    for extent_start, extent_stop in extents:
+        if start is not None and extent_stop <= start:
+            continue
+        pieces.append((max(extent_start, start or extent_start), extent_stop, extent_start))
+    return pieces
+
+def split_extents(pieces, parts, align=1):
+    """Split (start, stop, floor) pieces into at most parts shards of about the same cluster count."""
+    total = sum(stop - start for start, stop, _ in pieces)
+    if total == 0:
+        return []
+    size = -(-total // max(1, parts))
+    size = -(-size // align) * align
+
+    shards = [[]]
+    room = size
+    for start, stop, floor in pieces:
+        while start < stop:
+            if room == 0:
+                shards.append([])
+                room = size
+            take = min(room, stop - start)
+            shards[-1].append((start, start + take, floor))
+            start += take
+            room -= take
+    return shards
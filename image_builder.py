@@ -0,0 +1,548 @@
+import errno
+import random
+import struct
+import time
+
+import block_device
+
+MIB = 1024 * 1024
+
+class ImageNode:
+    """A file or directory to be laid out in a synthetic image."""
+
+    def __init__(self, name, is_dir, data=b"", deleted=False, fragmented=False, parent=None):
+        self.name = name
+        self.is_dir = is_dir
+        self.data = data
+        self.deleted = deleted
+        self.fragmented = fragmented  # Allocate every other cluster instead of a contiguous run
+        self.parent = parent
+        self.children = []
+        self.clusters = []            # FAT32: cluster chain
+        self.runs = []                # NTFS: (lcn or None when sparse, cluster count)
+        self.record = None            # NTFS: MFT record number
+        self.resident = False         # NTFS: data kept inside the MFT record
+        self.sparse = False           # NTFS: middle of the data is a sparse run
+        self.short_name = None        # FAT32: 8.3 entry name, NTFS: extra DOS-namespace $FILE_NAME
+        self.needs_lfn = False        # FAT32: name needs LFN entries
+
+    def path(self):
+        if self.parent is None or not self.parent.name:
+            return self.name
+        return f"{self.parent.path()}/{self.name}"
+
+    def walk(self):
+        for child in self.children:
+            yield child
+            if child.is_dir:
+                yield from child.walk()
+
+def write_mbr(image, partition_offset, size, partition_type):
+    """Write a DOS partition table with a single primary partition."""
+    mbr = bytearray(512)
+    struct.pack_into("<B3sB3sII", mbr, 0x1BE, 0x00, b"\x00\x02\x00", partition_type, b"\xff\xff\xff",
+                     partition_offset // 512, size // 512)
+    mbr[510:512] = b"\x55\xaa"
+    image.seek(0)
+    image.write(mbr)
+
+def lfn_checksum(short_name):
+    total = 0
+    for byte in short_name:
+        total = (((total & 1) << 7) + (total >> 1) + byte) & 0xFF
+    return total
+
+class FAT32ImageBuilder:
+    """Builds a FAT32 partition (behind an MBR) with live, deleted and fragmented files."""
+
+    def __init__(self, size=64 * MIB, cluster_size=4096, sector_size=512, partition_offset=MIB):
+        self.size = size
+        self.cluster_size = cluster_size
+        self.sector_size = sector_size
+        self.partition_offset = partition_offset
+        self.root = ImageNode("", True)
+        self.dirs = {"": self.root}
+        self.aliases = 0
+
+    def mkdir(self, path, deleted=False):
+        path = path.strip("/")
+        if path in self.dirs:
+            return self.dirs[path]
+        parent_path, _, name = path.rpartition("/")
+        parent = self.mkdir(parent_path)
+        node = ImageNode(name, True, deleted=deleted, parent=parent)
+        node.short_name, node.needs_lfn = self.short_name(name)
+        parent.children.append(node)
+        self.dirs[path] = node
+        return node
+
+    def add_file(self, path, data, deleted=False, fragmented=False):
+        parent_path, _, name = path.strip("/").rpartition("/")
+        parent = self.mkdir(parent_path)
+        node = ImageNode(name, False, data, deleted, fragmented, parent)
+        node.short_name, node.needs_lfn = self.short_name(name)
+        parent.children.append(node)
+        return node
+
+    def short_name(self, name):
+        """11-byte 8.3 name, and whether the name also needs LFN entries."""
+        base, dot, extension = name.rpartition(".")
+        if not dot:
+            base, extension = name, ""
+        if name.upper() == name and 0 < len(base) <= 8 and len(extension) <= 3 and " " not in name and base.isascii():
+            return (base.ljust(8) + extension.ljust(3)).encode("ascii"), False
+        self.aliases += 1
+        alias = f"F{self.aliases:05d}~1"
+        extension = "".join(c for c in extension.upper() if c.isascii() and c.isalnum())[:3]
+        return (alias.ljust(8) + extension.ljust(3)).encode("ascii"), True
+
+    def directory_entries(self, node):
+        """LFN entries (if any) followed by the 8.3 entry of a node."""
+        entries = []
+        if node.needs_lfn:
+            units = node.name.encode("utf-16le")
+            chars = [units[i:i + 2] for i in range(0, len(units), 2)]
+            parts = [chars[i:i + 13] for i in range(0, len(chars), 13)]
+            checksum = lfn_checksum(node.short_name)
+            for sequence in range(len(parts), 0, -1):  # Stored last part first
+                part = parts[sequence - 1]
+                if len(part) < 13:
+                    part = part + [b"\x00\x00"] + [b"\xff\xff"] * (12 - len(part))
+                raw = b"".join(part)
+                entry = bytearray(32)
+                entry[0] = sequence | (0x40 if sequence == len(parts) else 0)
+                entry[1:11] = raw[0:10]
+                entry[11] = 0x0F
+                entry[13] = checksum
+                entry[14:26] = raw[10:22]
+                entry[28:32] = raw[22:26]
+                entries.append(entry)
+
+        first_cluster = node.clusters[0] if node.clusters else 0
+        entry = bytearray(32)
+        entry[0:11] = node.short_name
+        entry[11] = 0x10 if node.is_dir else 0x20
+        struct.pack_into("<H", entry, 20, first_cluster >> 16)
+        struct.pack_into("<HI", entry, 26, first_cluster & 0xFFFF, 0 if node.is_dir else len(node.data))
+        entries.append(entry)
+
+        if node.deleted:
+            for entry in entries:
+                entry[0] = 0xE5
+        return entries
+
+    def dot_entry(self, name, cluster):
+        entry = bytearray(32)
+        entry[0:11] = name.ljust(11).encode("ascii")
+        entry[11] = 0x10
+        struct.pack_into("<H", entry, 20, cluster >> 16)
+        struct.pack_into("<H", entry, 26, cluster & 0xFFFF)
+        return entry
+
+    def build(self, out_path):
+        sector = self.sector_size
+        reserved = 32
+        total_sectors = self.size // sector
+        sectors_per_cluster = self.cluster_size // sector
+        fat_sectors = (total_sectors // sectors_per_cluster * 4 + sector - 1) // sector
+        data_start = reserved + 2 * fat_sectors
+        cluster_count = (total_sectors - data_start) // sectors_per_cluster
+        fat = [0] * (cluster_count + 2)
+        fat[0] = 0x0FFFFFF8
+        fat[1] = 0x0FFFFFFF
+        next_free = 2
+
+        def allocate(count, fragmented):
+            nonlocal next_free
+            clusters = []
+            while len(clusters) < count:
+                if next_free >= cluster_count + 2:
+                    raise ValueError("The image is too small for its files.")
+                clusters.append(next_free)
+                next_free += 2 if fragmented else 1
+            return clusters
+
+        def layout(node, deleted_parent):
+            gone = node.deleted or deleted_parent
+            if node.is_dir:
+                entries = (0 if node is self.root else 2) + sum(
+                    1 + ((len(child.name) + 12) // 13 if child.needs_lfn else 0) for child in node.children)
+                node.clusters = allocate(max(1, -(-entries * 32 // self.cluster_size)), False)
+            else:
+                node.clusters = allocate(-(-len(node.data) // self.cluster_size), node.fragmented)
+            for index, cluster in enumerate(node.clusters):
+                if gone:
+                    fat[cluster] = 0  # Deleting a file frees its chain
+                else:
+                    fat[cluster] = node.clusters[index + 1] if index + 1 < len(node.clusters) else 0x0FFFFFFF
+            for child in node.children:
+                layout(child, gone)
+
+        layout(self.root, False)
+        free_clusters = sum(1 for link in fat[2:] if link == 0)
+
+        with open(out_path, "wb") as image:
+            image.truncate(self.partition_offset + self.size)
+            write_mbr(image, self.partition_offset, self.size, 0x0C)
+
+            def write_at(offset, data):
+                image.seek(self.partition_offset + offset)
+                image.write(data)
+
+            def cluster_offset(cluster):
+                return (data_start + (cluster - 2) * sectors_per_cluster) * sector
+
+            boot = bytearray(sector)
+            boot[0:3] = b"\xeb\x58\x90"
+            boot[3:11] = b"MSWIN4.1"
+            struct.pack_into("<HBHBHHBH", boot, 0x0B, sector, sectors_per_cluster, reserved, 2, 0, 0, 0xF8, 0)
+            struct.pack_into("<III", boot, 0x1C, self.partition_offset // sector, total_sectors, fat_sectors)
+            struct.pack_into("<IHH", boot, 0x2C, 2, 1, 6)  # Root cluster, FSInfo sector, backup boot sector
+            boot[0x42] = 0x29
+            boot[0x47:0x52] = b"NO NAME    "
+            boot[0x52:0x5A] = b"FAT32   "
+            boot[510:512] = b"\x55\xaa"
+            write_at(0, boot)
+            write_at(6 * sector, boot)
+
+            fsinfo = bytearray(sector)
+            struct.pack_into("<I", fsinfo, 0, 0x41615252)
+            struct.pack_into("<III", fsinfo, 484, 0x61417272, free_clusters, next_free)
+            fsinfo[510:512] = b"\x55\xaa"
+            write_at(sector, fsinfo)
+
+            fat_bytes = struct.pack(f"<{len(fat)}I", *fat)
+            write_at(reserved * sector, fat_bytes)
+            write_at((reserved + fat_sectors) * sector, fat_bytes)
+
+            for node in [self.root, *self.root.walk()]:
+                if node.is_dir:
+                    raw = bytearray()
+                    if node is not self.root:
+                        parent_cluster = 0 if node.parent is self.root else node.parent.clusters[0]
+                        raw += self.dot_entry(".", node.clusters[0]) + self.dot_entry("..", parent_cluster)
+                    for child in node.children:
+                        raw += b"".join(self.directory_entries(child))
+                    for index, cluster in enumerate(node.clusters):
+                        chunk = raw[index * self.cluster_size:(index + 1) * self.cluster_size]
+                        write_at(cluster_offset(cluster), bytes(chunk).ljust(self.cluster_size, b"\x00"))
+                else:
+                    for index, cluster in enumerate(node.clusters):
+                        write_at(cluster_offset(cluster), node.data[index * self.cluster_size:(index + 1) * self.cluster_size])
+        return out_path
+
+def encode_runlist(runs):
+    """NTFS runlist of (lcn or None for a sparse run, cluster count) pairs."""
+    out = bytearray()
+    previous = 0
+    for lcn, count in runs:
+        length = int_bytes(count, False)
+        if lcn is None:
+            offset = b""  # Sparse: no offset field
+        else:
+            offset = int_bytes(lcn - previous, True)
+            previous = lcn
+        out.append(len(offset) << 4 | len(length))
+        out += length + offset
+    out.append(0)
+    return bytes(out)
+
+def int_bytes(value, signed):
+    """Shortest little-endian encoding of value."""
+    length = 1
+    while True:
+        try:
+            return value.to_bytes(length, "little", signed=signed)
+        except OverflowError:
+            length += 1
+
+class NTFSImageBuilder:
+    """Builds a minimal NTFS partition (behind an MBR): boot sector, an MFT with update-sequence
+    fixups (optionally fragmented), $Bitmap, and file records with resident, non-resident,
+    fragmented or sparse $DATA. Only what the scanners read is written, no directory indexes."""
+
+    USER_RECORDS = 16  # First record number used for files and directories
+
+    def __init__(self, size=64 * MIB, cluster_size=4096, sector_size=512, record_size=1024,
+                 partition_offset=MIB, mft_fragments=1):
+        self.size = size
+        self.cluster_size = cluster_size
+        self.sector_size = sector_size
+        self.record_size = record_size
+        self.partition_offset = partition_offset
+        self.mft_fragments = mft_fragments
+        self.root = ImageNode("", True)
+        self.dirs = {"": self.root}
+
+    def mkdir(self, path, deleted=False):
+        path = path.strip("/")
+        if path in self.dirs:
+            return self.dirs[path]
+        parent_path, _, name = path.rpartition("/")
+        parent = self.mkdir(parent_path)
+        node = ImageNode(name, True, deleted=deleted, parent=parent)
+        parent.children.append(node)
+        self.dirs[path] = node
+        return node
+
+    def add_file(self, path, data, deleted=False, fragmented=False, resident=None, sparse=False, short_name=None):
+        parent_path, _, name = path.strip("/").rpartition("/")
+        parent = self.mkdir(parent_path)
+        node = ImageNode(name, False, data, deleted, fragmented, parent)
+        node.resident = len(data) <= 400 if resident is None else resident
+        node.sparse = sparse
+        node.short_name = short_name
+        parent.children.append(node)
+        return node
+
+    def resident_attribute(self, attr_type, content, attr_id):
+        total = (0x18 + len(content) + 7) // 8 * 8
+        attr = bytearray(total)
+        struct.pack_into("<IIBBHHH", attr, 0, attr_type, total, 0, 0, 0x18, 0, attr_id)
+        struct.pack_into("<IH", attr, 0x10, len(content), 0x18)
+        attr[0x18:0x18 + len(content)] = content
+        return bytes(attr)
+
+    def nonresident_attribute(self, attr_type, runs, real_size, attr_id):
+        runlist = encode_runlist(runs)
+        clusters = sum(count for _, count in runs)
+        total = (0x40 + len(runlist) + 7) // 8 * 8
+        attr = bytearray(total)
+        struct.pack_into("<IIBBHHH", attr, 0, attr_type, total, 1, 0, 0x40, 0, attr_id)
+        struct.pack_into("<QQH", attr, 0x10, 0, max(clusters - 1, 0), 0x40)
+        struct.pack_into("<QQQ", attr, 0x28, clusters * self.cluster_size, real_size, real_size)
+        attr[0x40:0x40 + len(runlist)] = runlist
+        return bytes(attr)
+
+    def file_name(self, parent_record, name, size, is_dir, namespace):
+        """$FILE_NAME content. namespace: 0 POSIX, 1 Win32, 2 DOS, 3 Win32 and DOS."""
+        raw = name.encode("utf-16le")
+        content = bytearray(0x42 + len(raw))
+        struct.pack_into("<Q", content, 0, parent_record | (1 << 48))  # Reference with sequence number 1
+        struct.pack_into("<QQI", content, 0x28, size, size, 0x10000000 if is_dir else 0x20)
+        content[0x40] = len(name)
+        content[0x41] = namespace
+        content[0x42:] = raw
+        return bytes(content)
+
+    def record(self, number, attributes, flags):
+        """One MFT record with its update-sequence fixups applied, as stored on disk."""
+        record = bytearray(self.record_size)
+        usa_count = self.record_size // self.sector_size + 1
+        first_attribute = (0x30 + usa_count * 2 + 7) // 8 * 8
+        body = b"".join(attributes) + b"\xff\xff\xff\xff" + bytes(4)
+        if first_attribute + len(body) > self.record_size:
+            raise ValueError(f"MFT record {number} overflows, use non-resident data or shorter names.")
+
+        record[0:4] = b"FILE"
+        struct.pack_into("<HHQHHHHII", record, 4, 0x30, usa_count, 0, 1, 1, first_attribute, flags,
+                         first_attribute + len(body), self.record_size)
+        struct.pack_into("<QHHI", record, 0x20, 0, len(attributes), 0, number)
+        record[first_attribute:first_attribute + len(body)] = body
+
+        # The last 2 bytes of every sector move to the update sequence array
+        usn = number % 0xFFFE + 1
+        struct.pack_into("<H", record, 0x30, usn)
+        for index in range(1, usa_count):
+            end = index * self.sector_size
+            record[0x30 + index * 2:0x32 + index * 2] = record[end - 2:end]
+            struct.pack_into("<H", record, end - 2, usn)
+        return bytes(record)
+
+    def build(self, out_path):
+        cluster_size = self.cluster_size
+        total_clusters = self.size // cluster_size
+        used = bytearray(total_clusters)  # 1 = allocated in $Bitmap
+        used[0] = 1                       # Boot sector
+        next_free = 1
+
+        def allocate(count, fragmented=False):
+            nonlocal next_free
+            runs = []
+            while count > 0:
+                if next_free >= total_clusters:
+                    raise ValueError("The image is too small for its files.")
+                take = 1 if fragmented else count
+                for cluster in range(next_free, next_free + take):
+                    used[cluster] = 1
+                if runs and runs[-1][0] + runs[-1][1] == next_free:
+                    runs[-1] = (runs[-1][0], runs[-1][1] + take)
+                else:
+                    runs.append((next_free, take))
+                next_free += take + (1 if fragmented else 0)
+                count -= take
+            return runs
+
+        nodes = list(self.root.walk())
+        for index, node in enumerate(nodes):
+            node.record = self.USER_RECORDS + index
+        record_count = self.USER_RECORDS + len(nodes)
+        mft_size = record_count * self.record_size
+
+        # $MFT itself, split into mft_fragments runs with free gaps in between
+        mft_clusters = -(-mft_size // cluster_size)
+        per_fragment = max(1, -(-mft_clusters // self.mft_fragments))
+        mft_runs = []
+        while mft_clusters > 0:
+            take = min(per_fragment, mft_clusters)
+            mft_runs += allocate(take)
+            mft_clusters -= take
+            if mft_clusters:
+                next_free += 3
+
+        bitmap_size = (total_clusters + 7) // 8
+        bitmap_runs = allocate(-(-bitmap_size // cluster_size))
+
+        in_use = bytearray(-(-record_count // 64) * 8)  # $MFT's $BITMAP, records in use
+        for number in list(range(self.USER_RECORDS)) + [node.record for node in nodes if not node.deleted]:
+            in_use[number // 8] |= 1 << (number % 8)
+        in_use_runs = allocate(-(-len(in_use) // cluster_size))
+
+        for node in nodes:
+            if node.is_dir or node.resident or not node.data:
+                continue
+            count = -(-len(node.data) // cluster_size)
+            if node.sparse and count > 2:
+                hole = count - count // 2 - 1
+                node.runs = allocate(count // 2) + [(None, hole)] + allocate(1)
+                start = count // 2 * cluster_size
+                node.data = node.data[:start] + bytes(min(hole * cluster_size, len(node.data) - start)) + node.data[start + hole * cluster_size:]
+            else:
+                node.runs = allocate(count, node.fragmented)
+            if node.deleted:
+                for lcn, length in node.runs:
+                    if lcn is not None:
+                        used[lcn:lcn + length] = bytes(length)
+
+        bitmap = bytearray(bitmap_size)
+        for cluster in range(total_clusters):
+            if used[cluster]:
+                bitmap[cluster // 8] |= 1 << (cluster % 8)
+
+        standard = self.resident_attribute(0x10, bytes(48), 0)
+        records = {
+            0: self.record(0, [standard, self.resident_attribute(0x30, self.file_name(5, "$MFT", mft_size, False, 3), 1),
+                               self.nonresident_attribute(0x80, mft_runs, mft_size, 2),
+                               self.nonresident_attribute(0xB0, in_use_runs, len(in_use), 3)], 1),
+            5: self.record(5, [standard, self.resident_attribute(0x30, self.file_name(5, ".", 0, True, 3), 1)], 3),
+            6: self.record(6, [standard, self.resident_attribute(0x30, self.file_name(5, "$Bitmap", bitmap_size, False, 3), 1),
+                               self.nonresident_attribute(0x80, bitmap_runs, bitmap_size, 2)], 1),
+        }
+        for number in range(1, self.USER_RECORDS):
+            records.setdefault(number, self.record(number, [standard], 1))
+
+        for node in nodes:
+            parent = node.parent.record if node.parent.record is not None else 5
+            attributes = [standard]
+            if node.short_name:
+                attributes.append(self.resident_attribute(0x30, self.file_name(parent, node.short_name, len(node.data), node.is_dir, 2), 1))
+                attributes.append(self.resident_attribute(0x30, self.file_name(parent, node.name, len(node.data), node.is_dir, 1), 2))
+            else:
+                attributes.append(self.resident_attribute(0x30, self.file_name(parent, node.name, len(node.data), node.is_dir, 3), 1))
+            if not node.is_dir:
+                if node.resident:
+                    attributes.append(self.resident_attribute(0x80, node.data, 3))
+                else:
+                    attributes.append(self.nonresident_attribute(0x80, node.runs, len(node.data), 3))
+            flags = (0 if node.deleted else 1) | (2 if node.is_dir else 0)
+            records[node.record] = self.record(node.record, attributes, flags)
+
+        with open(out_path, "wb") as image:
+            image.truncate(self.partition_offset + self.size)
+            write_mbr(image, self.partition_offset, self.size, 0x07)
+
+            def write_at(offset, data):
+                image.seek(self.partition_offset + offset)
+                image.write(data)
+
+            def write_runs(runs, data):
+                position = 0
+                for lcn, count in runs:
+                    if lcn is not None:
+                        write_at(lcn * cluster_size, data[position:position + count * cluster_size])
+                    position += count * cluster_size
+
+            boot = bytearray(self.sector_size)
+            boot[0:3] = b"\xeb\x52\x90"
+            boot[3:11] = b"NTFS    "
+            struct.pack_into("<HB", boot, 0x0B, self.sector_size, cluster_size // self.sector_size)
+            boot[0x15] = 0xF8
+            struct.pack_into("<QQQ", boot, 0x28, self.size // self.sector_size - 1, mft_runs[0][0], mft_runs[0][0])
+            if self.record_size >= cluster_size:
+                boot[0x40] = self.record_size // cluster_size
+            else:
+                boot[0x40] = 256 - (self.record_size.bit_length() - 1)  # Negative: 2^-n bytes
+            boot[0x44] = 1
+            boot[510:512] = b"\x55\xaa"
+            write_at(0, boot)
+
+            write_runs(mft_runs, b"".join(records[number] for number in range(record_count)))
+            write_runs(bitmap_runs, bytes(bitmap))
+            write_runs(in_use_runs, bytes(in_use))
+            for node in nodes:
+                write_runs(node.runs, node.data)
+        return out_path
+
+def random_tree(builder, files, depth=3, fragmented=0.1, lfn=0.5, deleted=0.2, max_file_size=256 * 1024, seed=0):
+    """Fill a builder with a random tree of files. Returns the list of added file nodes."""
+    rng = random.Random(seed)
+    folders = [""]
+    for index in range(max(1, files // 20)):
+        parent = rng.choice([folder for folder in folders if folder.count("/") < depth - 1] or [""])
+        name = f"Folder {index}" if rng.random() < lfn else f"DIR{index:05d}"
+        folders.append(f"{parent}/{name}".strip("/"))
+
+    nodes = []
+    for index in range(files):
+        folder = rng.choice(folders)
+        if rng.random() < lfn:
+            name = f"Recovered document {index} " + "x" * rng.randint(0, 40) + ".dat"
+        else:
+            name = f"F{index:07d}.DAT"
+        size = int(rng.random() ** 3 * max_file_size) + 1  # Mostly small files, a few large ones
+        data = rng.randbytes(size)
+        nodes.append(builder.add_file(f"{folder}/{name}".strip("/"), data,
+                                      deleted=rng.random() < deleted, fragmented=rng.random() < fragmented))
+    return nodes
+
+def build_fat32_image(path, size=64 * MIB, cluster_size=4096, files=200, **options):
+    builder = FAT32ImageBuilder(size=size, cluster_size=cluster_size)
+    nodes = random_tree(builder, files, **options)
+    builder.build(path)
+    return builder, nodes
+
+def build_ntfs_image(path, size=64 * MIB, cluster_size=4096, files=200, mft_fragments=1, **options):
+    builder = NTFSImageBuilder(size=size, cluster_size=cluster_size, mft_fragments=mft_fragments)
+    nodes = random_tree(builder, files, **options)
+    builder.build(path)
+    return builder, nodes
+
+class FaultyImage(block_device.BlockDevice):
+    """An image file read like a failing disk: any read that touches one of the faulty
+    [start, end) byte ranges fails with EIO, after delay seconds (a slow kernel timeout).
+    Its bad-range map is kept in memory unless bad_ranges_file is given."""
+
+    def __init__(self, path, faults, delay=0.0, bad_ranges_file=None, **options):
+        self.faults = sorted(faults)
+        self.delay = delay
+        self.failed_reads = 0
+        super().__init__(path, bad_ranges_file=bad_ranges_file, **options)
+
+    def read_handle(self, offset, size):
+        for start, end in self.faults:
+            if start < offset + size and offset < end:
+                self.failed_reads += 1
+                if self.delay:
+                    time.sleep(self.delay)
+                raise OSError(errno.EIO, "Input/output error (injected)", self.path)
+        return super().read_handle(offset, size)
+
+def inject_faults(path, faults, delay=0.0, **options):
+    """Make every open_device(path) of this process return a FaultyImage of the image."""
+    device = FaultyImage(path, faults, delay, **options)
+    with block_device.devices_lock:
+        old = block_device.devices.pop(path, None)
+        if old is not None:
+            old.close()
+        block_device.devices[path] = device
+    return device
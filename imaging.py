@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+
+from block_device import write_all
+from progress import ScanProgress, cancelled
+
+IMAGE_BLOCK_SIZE = 8 * 1024 * 1024  # Bytes read from the device at a time, in one sequential request
+HOLE_SIZE = 64 * 1024               # All-zero pieces of this size are left as holes in the image
+FSCTL_SET_SPARSE = 0x900C4          # Windows: mark a file sparse, else seeking past its end writes zeros
+
+def merge_extents(extents):
+    """Sorted (offset, length) ranges with overlapping and touching ones joined."""
+    merged = []
+    for offset, length in sorted(extent for extent in extents if extent[1] > 0):
+        if merged and offset <= merged[-1][0] + merged[-1][1]:
+            last_offset, last_length = merged[-1]
+            merged[-1] = (last_offset, max(last_length, offset + length - last_offset))
+        else:
+            merged.append((offset, length))
+    return merged
+
+def image_pieces(extents, block_size):
+    """(offset, size) pieces of at most block_size bytes covering the extents, in order."""
+    for offset, length in extents:
+        for position in range(offset, offset + length, block_size):
+            yield position, min(block_size, offset + length - position)
+
+def set_sparse(output):
+    """Make an open file sparse. Linux and macOS file systems leave holes on their own; on Windows
+    (NTFS) a file is only sparse with FSCTL_SET_SPARSE. Returns False when the flag could not be set."""
+    if sys.platform != "win32":
+        return True
+    import ctypes
+    import msvcrt
+    from ctypes import wintypes
+    returned = wintypes.DWORD()
+    handle = wintypes.HANDLE(msvcrt.get_osfhandle(output.fileno()))
+    return bool(ctypes.windll.kernel32.DeviceIoControl(handle, FSCTL_SET_SPARSE, None, 0, None, 0,
+                                                        ctypes.byref(returned), None))
+
+def write_sparse(output, data, zeros):
+    """Write data at the current position, seeking over all-zero pieces instead of writing them.
+    Returns the bytes left as holes."""
+    view = memoryview(data)
+    holes = 0
+    for start in range(0, len(view), HOLE_SIZE):
+        piece = view[start:start + HOLE_SIZE]
+        if piece == zeros[:len(piece)]:
+            output.seek(len(piece), os.SEEK_CUR)
+            holes += len(piece)
+        else:
+            write_all(output, piece)
+    return holes
+
+def image_volume(instance, path, size, free_only=False, progress=None, cancel=None, block_size=IMAGE_BLOCK_SIZE):
+    """Copy the volume of a FAT32 or NTFS instance (size bytes from instance.begin) to a sparse image
+    file at path, in large sequential reads. All-zero blocks are not written, they stay holes.
+    free_only copies only the file system metadata, live directories and free clusters (see the
+    instance's image_extents), which is all that scans and the recovery of deleted files read;
+    the clusters of live files are left as zeros. progress(done, total, bytes_per_second) counts
+    bytes read. The image opens as a volume at offset 0; a cancelled copy leaves it incomplete.
+    Returns {"path", "size", "copied", "holes", "skipped", "unreadable", "seconds", "complete", "sparse"};
+    sparse is False when the file system would not make the file sparse, the holes then take disk space."""
+    if free_only:
+        extents = merge_extents((offset, min(length, size - offset))
+                                for offset, length in instance.image_extents() if offset < size)
+    else:
+        extents = [(0, size)]
+    total = sum(length for _, length in extents)
+    meter = ScanProgress(progress, total, 1)
+    device = instance.device
+    unreadable = getattr(device, "bytes_unreadable", 0)
+    zeros = bytes(HOLE_SIZE)
+    started = time.perf_counter()
+    copied = 0
+    holes = 0
+    complete = True
+
+    with instance.stats.phase("imaging"), open(path, "wb", buffering=0) as output:
+        sparse = set_sparse(output)
+        pieces = list(image_pieces(extents, block_size))
+        reads = device.read_ahead([(instance.begin + offset, length)] for offset, length in pieces)
+        try:
+            for (offset, length), data in zip(pieces, reads):
+                if cancelled(cancel):
+                    complete = False
+                    break
+                if data is None or len(data) < length:
+                    raise OSError(f"Cannot read the volume at offset {instance.begin + offset}.")
+                output.seek(offset)
+                holes += write_sparse(output, data, zeros)
+                copied += len(data)
+                meter.advance(len(data))
+        finally:
+            reads.close()
+        output.truncate(size)  # Skipped clusters and holes at the end still count in the image size
+    meter.finish()
+
+    seconds = time.perf_counter() - started
+    instance.stats.count("bytes imaged", copied)
+    return {
+        "path": path,
+        "size": size,
+        "copied": copied,
+        "holes": holes,
+        "skipped": size - total,
+        "unreadable": getattr(device, "bytes_unreadable", 0) - unreadable,
+        "seconds": round(seconds, 3),
+        "complete": complete,
+        "sparse": sparse,
+    }
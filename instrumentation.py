@@ -0,0 +1,176 @@
+import cProfile
+import functools
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+from converter import byte_converter
+
+DEVICE_COUNTERS = ("reads", "bytes_read", "hits", "misses", "seeks", "seek_distance", "bytes_unreadable")
+
+# Opt-in profiling of scan_quick / scan_all / recover_data, e.g. DISK_RECOVERY_PROFILE=cpu,memory
+profiling = {"cpu": False, "memory": False, "folder": os.environ.get("DISK_RECOVERY_PROFILE_DIR", ".")}
+for option in os.environ.get("DISK_RECOVERY_PROFILE", "").lower().split(","):
+    if option in ("cpu", "memory"):
+        profiling[option] = True
+
+def io_counters():
+    """Read syscalls and bytes of this process (Linux /proc/self/io), empty elsewhere."""
+    try:
+        with open("/proc/self/io") as stats:
+            return {key: int(value) for key, value in (line.split(": ") for line in stats)}
+    except OSError:
+        return {}
+
+class VolumeStats:
+    """I/O counters and phase timers of one volume. Device counters are taken as the difference
+    from when the volume was opened; reads done by worker processes are not included."""
+
+    def __init__(self, device):
+        self.device = device
+        self.started = time.monotonic()
+        self.device_base = self.device_counters()
+        self.io_base = io_counters()
+        self.phases = {}    # name -> {"calls", "seconds"}
+        self.counters = {}  # name -> count
+        self.lock = threading.Lock()
+
+    def device_counters(self):
+        return {name: getattr(self.device, name, 0) for name in DEVICE_COUNTERS}
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            phase = self.phases.setdefault(name, {"calls": 0, "seconds": 0.0})
+            phase["calls"] += 1
+            phase["seconds"] += seconds
+
+    def phase(self, name):
+        """Context manager timing a phase, e.g. with stats.phase("fat load"): ..."""
+        return PhaseTimer(self, name)
+
+    def timed(self, name, iterator):
+        """Pass on a generator, timing only the work done inside it (not the consumer's)."""
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.add_time(name, time.perf_counter() - start)
+                yield value
+        finally:
+            iterator.close()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        """All numbers as a dict: device counters, process syscalls, phases and counters."""
+        current = self.device_counters()
+        io_now = io_counters()
+        with self.lock:
+            return {
+                "elapsed": round(time.monotonic() - self.started, 3),
+                "device": {name: current[name] - self.device_base[name] for name in DEVICE_COUNTERS},
+                "syscalls": {name: io_now[name] - self.io_base.get(name, 0) for name in ("syscr", "syscw") if name in io_now},
+                "phases": {name: {"calls": phase["calls"], "seconds": round(phase["seconds"], 4)} for name, phase in self.phases.items()},
+                "counters": dict(self.counters),
+            }
+
+    def stats_line(self):
+        """One line summary for the terminal."""
+        numbers = self.snapshot()
+        device = numbers["device"]
+        lookups = device["hits"] + device["misses"]
+        parts = [
+            f"reads {device['reads']}",
+            f"{byte_converter(device['bytes_read'])}",
+            f"seeks {device['seeks']} ({byte_converter(device['seek_distance'])})",
+        ]
+        if lookups:
+            parts.append(f"cache hits {device['hits'] / lookups * 100:.0f}%")
+        if device["bytes_unreadable"]:
+            parts.append(f"unreadable {byte_converter(device['bytes_unreadable'])}")
+        if numbers["syscalls"]:
+            parts.append(f"syscalls r/w {numbers['syscalls'].get('syscr', 0)}/{numbers['syscalls'].get('syscw', 0)}")
+        parts.extend(f"{name} {phase['seconds']:.2f} s" for name, phase in numbers["phases"].items())
+        return "[stats] " + ", ".join(parts)
+
+class PhaseTimer:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+class StatsReporter:
+    """Prints stats.stats_line() every interval seconds from a background thread while active.
+    with StatsReporter(stats, 5): ... ; an interval of 0 or None reports nothing."""
+
+    def __init__(self, stats, interval, output=print):
+        self.stats = stats
+        self.interval = interval
+        self.output = output
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        if self.interval:
+            self.thread = threading.Thread(target=self.run, name="stats-reporter", daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.output(self.stats.stats_line())
+        return False
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.output(self.stats.stats_line())
+
+def profiled(method):
+    """Wrap a scan or recovery method with cProfile and/or tracemalloc when profiling is switched on.
+    Results go to <folder>/<Class>.<method>.prof and a printed top-allocations list."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not (profiling["cpu"] or profiling["memory"]):
+            return method(self, *args, **kwargs)
+
+        name = f"{type(self).__name__}.{method.__name__}"
+        profiler = cProfile.Profile() if profiling["cpu"] else None
+        tracing = profiling["memory"] and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                path = os.path.join(profiling["folder"], f"{name}.prof")
+                profiler.dump_stats(path)
+                print(f"[profile] {name}: CPU profile written to {path}")
+                pstats.Stats(profiler).sort_stats("cumulative").print_stats(10)
+            if tracing:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"[profile] {name}: peak allocated {byte_converter(peak)}")
+                for line in snapshot.statistics("lineno")[:10]:
+                    print(f"[profile]   {line}")
+    return wrapper
@@ -1,4 +1,5 @@
-import command
-
-if __name__ == "__main__":
-    command.partition_process()
\ No newline at end of file
+import sys
+import command
+
+if __name__ == "__main__":
+    command.partition_process(sys.argv[1:] or None) # Disk or image paths, every disk of the system by default
\ No newline at end of file
@@ -1,70 +1,270 @@
-from offset_reader import read_offset_in_hex, read_offset_in_dec, read_offset_in_string, print_hex
-import wmi
-
-def list_disks():
-    """Lists all physical drives available on the system."""
-    disks = []
-    for i in range(256):  # Assuming up to 256 disks could be connected
-        try:
-            disk_path = f"\\\\.\\PhysicalDrive{i}"
-            if is_open(disk_path):
-                disks.append(f"\\\\.\\PhysicalDrive{i}")
-        except Exception:
-            break  # Stop when no more drives are found
-    return disks
-
-# Return True if disk is available
-def is_open(disk):
-    """Check open disk."""
-    try:
-        if open(disk, "rb"):
-            return True
-    except Exception:
-        return False
-    
-def listMBRDisk():
-    disks = list_disks()
-    offset = 0  # Example offset (1 sector after MBR)
-    size = 512  # Number of bytes to read
-
-    for disk in disks:
-        print(disk)
-        data = read_offset_in_hex(disk, offset, size)
-        print_hex(data)
-    
-def partition_format(path, first_offset):  
-    # Determine FAT32, NTFS or others
-
-    if first_offset == 0: # Null partition
-        return None
-    
-    if read_offset_in_string(path, first_offset + 0x52, 8).strip() == "FAT32":
-        return "FAT32"
-    elif read_offset_in_string(path, first_offset + 0x03, 4).strip() == "NTFS":
-        return "NTFS"
-    else:
-        return None
-
-# Function to get logical drive letter and its corresponding volume name from WMI based on physical drive number
-def get_drive_info():
-    c = wmi.WMI()
-    partition_dict = {}
-
-    # Query all disk drives and check for matching physical drive
-    for disk in c.query("SELECT * FROM Win32_DiskDrive"):
-        for partition in disk.associators("Win32_DiskDriveToDiskPartition"):
-            for logical_disk in partition.associators("Win32_LogicalDiskToPartition"):
-                try:
-                    partition_dict[str(logical_disk.Caption)] = {
-                        "letter": logical_disk.Caption, # C, D...
-                        "volume_name": logical_disk.VolumeName,  # Volume name (Windows, Data, etc.)
-                        "disk": disk.DeviceID,           # \\.\PhysicalDriveX
-                        "partition": int(partition.Index), # Partition number
-                        "first_offset": int(partition.StartingOffset),
-                        "size": int(logical_disk.Size),
-                    }
-                except:
-                    continue
-                break
-    return partition_dict
-
+from offset_reader import read_offset_in_hex, print_hex
+from block_device import open_device
+import os
+import sys
+import uuid
+
+EXTENDED_TYPES = (0x05, 0x0F, 0x85)  # MBR entries that point to a chain of extended boot records
+GPT_PROTECTIVE_TYPE = 0xEE
+MAX_LOGICAL_PARTITIONS = 128         # Stop following a damaged (looping) EBR chain
+
+partition_cache = {}   # Parsed partition tables, by disk path, for the whole session
+drive_info_cache = {}  # get_drive_info results, by disk list
+
+def list_disks():
+    """Lists all physical drives available on the system."""
+    if sys.platform != "win32":
+        # Whole disks only, partitions are read from each disk's own table
+        try:
+            names = sorted(os.listdir("/sys/block"))
+        except OSError:
+            return []
+        return [f"/dev/{name}" for name in names if not name.startswith(("loop", "ram", "zram", "sr", "dm-", "md"))]
+
+    disks = []
+    for i in range(256):  # Assuming up to 256 disks could be connected
+        try:
+            disk_path = f"\\\\.\\PhysicalDrive{i}"
+            if is_open(disk_path):
+                disks.append(f"\\\\.\\PhysicalDrive{i}")
+        except Exception:
+            break  # Stop when no more drives are found
+    return disks
+
+# Return True if disk is available
+def is_open(disk):
+    """Check open disk."""
+    try:
+        with open(disk, "rb"):
+            return True
+    except Exception:
+        return False
+    
+def listMBRDisk():
+    disks = list_disks()
+    offset = 0  # Example offset (1 sector after MBR)
+    size = 512  # Number of bytes to read
+
+    for disk in disks:
+        print(disk)
+        data = read_offset_in_hex(disk, offset, size)
+        print_hex(data)
+    
+def partition_format(path, first_offset):
+    """"FAT32", "NTFS" or None for the volume starting at first_offset of a disk or image."""
+    try:
+        boot_sector = open_device(path).read(first_offset, 512)  # One read for both signatures
+    except OSError:
+        return None
+    return boot_sector_format(boot_sector)
+
+def boot_sector_format(boot_sector):
+    """"FAT32", "NTFS" or None, from the signatures in a volume boot sector."""
+    if bytes(boot_sector[0x52:0x5A]).strip() == b"FAT32":
+        return "FAT32"
+    elif bytes(boot_sector[0x03:0x07]).strip() == b"NTFS":
+        return "NTFS"
+    else:
+        return None
+
+def list_partitions(path, refresh=False):
+    """Partitions of a disk or image from its MBR (primary, extended and logical) or GPT:
+    [{"partition", "first_offset", "size", "type", "scheme", "name"}]. Parsed once per session
+    unless refresh is set. Empty when there is no partition table, e.g. an image of a single volume."""
+    if not refresh and path in partition_cache:
+        return partition_cache[path]
+
+    try:
+        device = open_device(path)
+        sector = bytes(device.read(0, 512))
+    except OSError:
+        return []
+
+    partitions = []
+    if len(sector) == 512 and sector[510:512] == b"\x55\xaa" and not boot_sector_format(sector):
+        # A volume boot sector also ends in 55 AA, only a real table is parsed
+        if any(sector[0x1BE + index * 16 + 4] == GPT_PROTECTIVE_TYPE for index in range(4)):
+            partitions = gpt_partitions(device)
+        else:
+            partitions = mbr_partitions(device, sector)
+
+    partition_cache[path] = partitions
+    return partitions
+
+def mbr_entries(sector):
+    """(type, first sector, sector count) of the 4 entries of an MBR or EBR."""
+    entries = []
+    for index in range(4):
+        entry = sector[0x1BE + index * 16:0x1CE + index * 16]
+        entries.append((entry[4], int.from_bytes(entry[8:12], "little"), int.from_bytes(entry[12:16], "little")))
+    return entries
+
+def mbr_partitions(device, sector):
+    """Primary partitions (numbered 0-3) then the logical ones of the extended partition (4 on)."""
+    partitions = []
+    extended_start = None
+    for index, (partition_type, first_sector, sectors) in enumerate(mbr_entries(sector)):
+        if partition_type == 0 or first_sector == 0:
+            continue
+        if partition_type in EXTENDED_TYPES:
+            extended_start = first_sector
+            continue
+        partitions.append(partition_entry(index, first_sector, sectors, partition_type, "MBR"))
+
+    # Each EBR holds one logical partition (relative to the EBR) and a link to the next EBR
+    # (relative to the start of the extended partition)
+    ebr = extended_start
+    seen = set()
+    number = 4
+    while ebr is not None and ebr not in seen and len(seen) < MAX_LOGICAL_PARTITIONS:
+        seen.add(ebr)
+        try:
+            sector = bytes(device.read(ebr * 512, 512))
+        except OSError:
+            break
+        if len(sector) < 512 or sector[510:512] != b"\x55\xaa":
+            break
+
+        entries = mbr_entries(sector)
+        partition_type, first_sector, sectors = entries[0]
+        if partition_type != 0 and first_sector != 0:
+            partitions.append(partition_entry(number, ebr + first_sector, sectors, partition_type, "MBR"))
+            number += 1
+
+        link_type, link_sector, _ = entries[1]
+        ebr = extended_start + link_sector if link_type in EXTENDED_TYPES and link_sector else None
+    return partitions
+
+def gpt_partitions(device):
+    """Partitions of the GPT. The header is at LBA 1, which is byte 512 or 4096 depending on the sector size."""
+    for sector_size in (512, 4096):
+        try:
+            header = bytes(device.read(sector_size, 92))
+        except OSError:
+            return []
+        if header[:8] == b"EFI PART":
+            break
+    else:
+        return []
+
+    entries_lba = int.from_bytes(header[72:80], "little")
+    entry_count = int.from_bytes(header[80:84], "little")
+    entry_size = int.from_bytes(header[84:88], "little")
+    if entry_size < 128 or entry_count > 4096:
+        return []
+
+    table = bytes(device.read(entries_lba * sector_size, entry_count * entry_size))  # The whole array in one read
+    partitions = []
+    for index in range(len(table) // entry_size):
+        entry = table[index * entry_size:(index + 1) * entry_size]
+        if entry[0:16] == bytes(16):  # Unused entry
+            continue
+        first_lba = int.from_bytes(entry[32:40], "little")
+        last_lba = int.from_bytes(entry[40:48], "little")
+        partition = partition_entry(index, first_lba, last_lba - first_lba + 1, str(uuid.UUID(bytes_le=entry[0:16])), "GPT", sector_size)
+        partition["name"] = entry[56:128].decode("utf-16le", errors="ignore").rstrip("\x00")
+        partitions.append(partition)
+    return partitions
+
+def partition_entry(number, first_sector, sectors, partition_type, scheme, sector_size=512):
+    return {
+        "partition": number,
+        "first_offset": first_sector * sector_size,
+        "size": sectors * sector_size,
+        "type": partition_type,  # MBR type byte, or GPT type GUID
+        "scheme": scheme,
+        "name": "",
+    }
+
+def disk_size(path):
+    """Size in bytes of a disk or image (decompressed for a compressed image), 0 when the system
+    does not tell, e.g. for some Windows devices. Raises OSError when it cannot be opened."""
+    device = open_device(path)
+    size = getattr(device, "size", None)
+    if size is None:
+        try:
+            size = os.lseek(device.handle.fileno(), 0, os.SEEK_END)
+        except OSError:
+            size = 0
+    return size
+
+def boot_sector_size(path, first_offset, format_type):
+    """Size in bytes of a volume from the sector counts in its boot sector."""
+    boot_sector = bytes(open_device(path).read(first_offset, 512))
+    sector_size = int.from_bytes(boot_sector[0x0B:0x0D], "little")
+    if format_type == "FAT32":
+        return int.from_bytes(boot_sector[0x20:0x24], "little") * sector_size
+    return (int.from_bytes(boot_sector[0x28:0x30], "little") + 1) * sector_size  # The backup boot sector follows the volume
+
+def volume_label(path, first_offset, format_type):
+    """FAT32 volume label from the boot sector, empty if there is none (NTFS keeps it in $Volume)."""
+    if format_type != "FAT32":
+        return ""
+    label = bytes(open_device(path).read(first_offset + 0x47, 11)).decode("ascii", errors="ignore").strip()
+    return "" if label == "NO NAME" else label
+
+# Drive letters and volume names known to Windows, by (disk, partition offset)
+def wmi_drive_letters():
+    try:
+        import wmi  # Windows only and optional, only used to show drive letters
+    except ImportError:
+        return {}
+    c = wmi.WMI()
+    letters = {}
+
+    # Query all disk drives and check for matching physical drive
+    for disk in c.query("SELECT * FROM Win32_DiskDrive"):
+        for partition in disk.associators("Win32_DiskDriveToDiskPartition"):
+            for logical_disk in partition.associators("Win32_LogicalDiskToPartition"):
+                try:
+                    letters[(str(disk.DeviceID).upper(), int(partition.StartingOffset))] = (
+                        logical_disk.Caption,      # C, D...
+                        logical_disk.VolumeName,   # Volume name (Windows, Data, etc.)
+                    )
+                except Exception:
+                    continue
+                break
+    return letters
+
+def get_drive_info(disks=None, refresh=False):
+    """FAT32 and NTFS partitions of the given disks or images (every disk of the system by default),
+    keyed by drive letter when Windows has one, else by "<disk>#<partition>".
+    The partition tables are read directly, once per session unless refresh is set."""
+    key = tuple(disks) if disks else None
+    if not refresh and key in drive_info_cache:
+        return drive_info_cache[key]
+
+    letters = wmi_drive_letters() if sys.platform == "win32" else {}
+    partition_dict = {}
+    for disk in disks or list_disks():
+        partitions = list_partitions(disk, refresh)
+        if not partitions:
+            # No partition table: an image of a single volume, or a device formatted as one (superfloppy)
+            try:
+                size = disk_size(disk)
+            except OSError as e:
+                print(f"Cannot open {disk}: {e}")
+                continue
+            partitions = [partition_entry(0, 0, size // 512, 0, "NONE")]
+
+        for partition in partitions:
+            format_type = partition_format(disk, partition["first_offset"])
+            if format_type is None:
+                continue
+            if not partition["size"]:
+                partition["size"] = boot_sector_size(disk, partition["first_offset"], format_type)
+
+            letter, volume_name = letters.get((disk.upper(), partition["first_offset"]), (None, None))
+            name = letter or f"{disk}#{partition['partition']}"
+            partition_dict[name] = {
+                "letter": name,
+                "volume_name": volume_name or partition["name"] or volume_label(disk, partition["first_offset"], format_type),
+                "disk": disk,
+                "partition": partition["partition"],
+                "first_offset": partition["first_offset"],
+                "size": partition["size"],
+                "format": format_type,
+            }
+
+    drive_info_cache[key] = partition_dict
+    return partition_dict
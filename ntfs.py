@@ -1,202 +1,606 @@
-from offset_reader import read_offset_in_hex, read_offset_in_dec, read_offset_in_string, print_hex
-from converter import byte_converter
-
-class NTFS:
-    def __init__(self, disk, first_offset):
-        self.begin = first_offset
-        self.disk = disk
-        self.sector_size = self.read_offset(0x0B, 2) # Sector size in bytes
-        self.cluster_size = self.get_cluster_size()  # Cluster size in bytes
-        self.mft_start = self.get_mft_start()        # MFT starting offset
-
-    def read_offset(self, offset, size):
-        return read_offset_in_dec(self.disk, self.begin + offset, size)
-
-    def get_cluster_size(self):
-        # Read cluster size from boot sector
-        sectors_per_cluster = self.read_offset(0x0D, 1)
-        return sectors_per_cluster * self.sector_size
-
-    def get_mft_start(self):
-        # Read MFT start position 
-        mft_start_cluster = self.read_offset(0x30, 8)
-        return self.begin + mft_start_cluster * self.cluster_size
-
-    def read_mft_entry(self, entry_number):
-        """Read a MFT entry"""
-        offset = self.mft_start + (entry_number * 1024)  # Commonly an entry size = 1024
-        return read_offset_in_hex(self.disk, offset, 1024)
-
-    def scan_quick(self):
-        """Liệt kê tất cả các file đã bị xóa kèm kích thước và địa chỉ offset"""
-        deleted_files = []
-        entry_number = 0  # Bắt đầu từ entry đầu tiên trong MFT
-
-        while True:
-            try:
-                # Đọc một entry trong MFT
-                mft_entry = self.read_mft_entry(entry_number)
-
-                # Kiểm tra xem entry có hợp lệ không (chữ ký 'FILE')
-                if mft_entry[:4] != b"FILE":
-                    entry_number += 1
-                    continue
-
-                # Kiểm tra cờ trạng thái (đã xóa hay không)
-                flags = int.from_bytes(mft_entry[0x16:0x18], "little")
-                if flags != 0x00:  # Không phải entry đã xóa
-                    entry_number += 1
-                    continue
-
-                # Địa chỉ offset đầu tiên của entry này
-                offset_entry = self.mft_start + entry_number * 1024
-
-                # Lấy danh sách các attribute trong entry
-                offset = int.from_bytes(mft_entry[0x14:0x16], "little")
-                filename = None
-                file_size = None
-
-                while offset < len(mft_entry):
-                    # Đọc loại attribute và kích thước
-                    attr_type = int.from_bytes(mft_entry[offset:offset + 4], "little")
-                    attr_len = int.from_bytes(mft_entry[offset + 4:offset + 8], "little")
-
-                    if attr_type == 0xFFFFFFFF:  # Hết danh sách attribute
-                        break
-
-                    # Attribute $FILE_NAME
-                    if attr_type == 48:
-                        content_offset = offset + int.from_bytes(mft_entry[offset + 20:offset + 22], "little")
-                        name_len = mft_entry[content_offset + 64]  # Độ dài tên file (UTF-16)
-                        name_offset = content_offset + 66
-
-                        # Lấy tên file theo UTF-16
-                        filename = mft_entry[name_offset:name_offset + (name_len * 2)].decode("utf-16le", errors="ignore")
-
-                    # Attribute $DATA
-                    if attr_type == 128:  # Attribute $DATA
-                        content_offset = offset + int.from_bytes(mft_entry[offset + 20:offset + 22], "little")
-                        real_size = int.from_bytes(mft_entry[content_offset + 48:content_offset + 56], "little")
-                        file_size = real_size
-
-                    offset += attr_len  # Chuyển sang attribute tiếp theo
-
-                if file_size == None:
-                    continue
-
-                print(f"Scanning: Filename: {filename}, size: {byte_converter(file_size)}")
-                deleted_files.append({
-                    "name": filename,
-                    "file_size": file_size,
-                    "first_offset": offset_entry
-                })
-
-                entry_number += 1  # Chuyển sang entry tiếp theo
-
-            except:
-                # Kết thúc nếu không đọc được entry tiếp theo
-                break
-
-        return deleted_files
-
-    def scan_full(self):
-        return self.scan_quick()
-    
-    def recover_data(self, path, item):
-        """
-        Phục hồi file đã xóa từ thông tin item.
-        item bao gồm:
-        - name: Tên file
-        - file_size: Kích thước file
-        - first_offset: Offset của MFT entry chứa file
-        """
-        filename = item.get("name")
-        file_size = item.get("file_size")
-        file_offset = item.get("first_offset")
-
-        if not filename or file_size is None or file_offset is None:
-            raise ValueError("Thiếu thông tin trong item để phục hồi.")
-
-        # Đọc MFT entry từ first_offset
-        mft_entry = read_offset_in_hex(self.disk, file_offset, 1024)
-
-        # Kiểm tra chữ ký 'FILE' trong entry
-        if mft_entry[:4] != b"FILE":
-            raise ValueError(f"Entry tại offset {file_offset} không hợp lệ.")
-
-        # Kiểm tra Runlist trong $DATA
-        offset = int.from_bytes(mft_entry[0x14:0x16], "little")
-        runlist = None
-
-        while offset < 1024:
-            attr_type = int.from_bytes(mft_entry[offset:offset + 4], "little")
-            attr_len = int.from_bytes(mft_entry[offset + 4:offset + 8], "little")
-
-            if attr_type == 0xFFFFFFFF:  # Hết danh sách attribute
-                break
-
-            if attr_type == 128:  # Attribute $DATA
-                content_offset = offset + int.from_bytes(mft_entry[offset + 20:offset + 22], "little")
-                runlist_offset = content_offset + 0x10  # Runlist bắt đầu sau 0x10 bytes
-                runlist = mft_entry[runlist_offset:runlist_offset + (attr_len - 0x10)]
-                break
-
-            offset += attr_len
-
-        if not runlist:
-            raise ValueError(f"Không tìm thấy Runlist trong $DATA của file {filename}.")
-
-        # Giải mã Runlist
-        runs = self.decode_runlist(runlist)
-        recovered_size = 0
-
-        # Mở file để ghi dữ liệu phục hồi
-        with open(path, "wb") as output_file:
-            for run in runs:
-                start_cluster, cluster_count = run
-                start_offset = self.begin + start_cluster * self.cluster_size
-                run_size = cluster_count * self.cluster_size
-
-                if recovered_size + run_size > file_size:
-                    run_size = file_size - recovered_size  # Giới hạn nếu run vượt quá file_size
-
-                # Đọc dữ liệu từ ổ đĩa và ghi vào file
-                data = read_offset_in_hex(self.disk, start_offset, run_size)
-                output_file.write(data)
-                recovered_size += run_size
-
-                # Kiểm tra nếu đã phục hồi đủ dữ liệu
-                if recovered_size >= file_size:
-                    break
-
-    def decode_runlist(self, runlist):
-        """
-        Giải mã Runlist từ $DATA để lấy danh sách các đoạn dữ liệu (cluster).
-        """
-        runs = []
-        index = 0
-        last_cluster = 0
-
-        while index < len(runlist):
-            header = runlist[index]
-            if header == 0x00:  # Kết thúc Runlist
-                break
-
-            # Đọc size, offset size từ header
-            cluster_size_len = header & 0x0F
-            cluster_offset_len = (header >> 4) & 0x0F
-            index += 1
-
-            # Đọc cluster size và cluster offset
-            cluster_size = int.from_bytes(runlist[index:index + cluster_size_len], "little", signed=False)
-            cluster_offset = int.from_bytes(runlist[index + cluster_size_len:index + cluster_size_len + cluster_offset_len], "little", signed=True)
-            index += cluster_size_len + cluster_offset_len
-
-            # Tính toán vị trí cluster thực
-            start_cluster = last_cluster + cluster_offset
-            runs.append((start_cluster, cluster_size))
-
-            # Lưu cluster cuối để tính toán giá trị tiếp theo
-            last_cluster = start_cluster
-
-        return runs
\ No newline at end of file
+from block_device import open_device, write_segments, unreadable_bytes, COPY_BUFFER_SIZE
+from parallel import split_range, iter_shards, SHARDS_PER_WORKER
+from progress import ScanProgress, stream_results, cancelled
+from carver import carve
+from converter import byte_converter
+from instrumentation import VolumeStats, profiled
+import itertools
+import re
+
+MFT_CHUNK_SIZE = 4 * 1024 * 1024  # Bytes of MFT read and parsed together, between two progress reports / cancel checks
+FIXUP_STRIDE = 512                # Every 512 bytes of a record end with the update sequence number
+ROOT_RECORD = 5                   # MFT record of the root directory
+BITMAP_RECORD = 6                 # MFT record of $Bitmap, one bit per cluster of the volume
+BOOT_SIZE = 8192                  # $Boot: boot sector and bootstrap code at the start of the volume
+NAME_PREFERENCE = {1: 0, 3: 0, 0: 1, 2: 2}  # $FILE_NAME namespaces, best first: Win32, POSIX, then DOS 8.3 short names
+ORPHAN_FOLDER = "$OrphanFiles"    # Path of files whose parent directory is gone or was reused
+
+class NTFS:
+    def __init__(self, disk, first_offset):
+        self.begin = first_offset
+        self.disk = disk
+        self.device = open_device(disk)              # One shared handle and page cache per disk
+        self.stats = VolumeStats(self.device)        # I/O counters and phase timers of this volume
+        with self.stats.phase("boot sector"):
+            self.sector_size = self.read_offset(0x0B, 2) # Sector size in bytes
+            self.cluster_size = self.get_cluster_size()  # Cluster size in bytes
+            self.mft_start = self.get_mft_start()        # MFT starting offset
+            self.record_size = self.get_record_size()    # MFT record size in bytes
+        self.device.align(self.sector_size)              # Reads on 4Kn disks cover whole sectors
+        with self.stats.phase("mft layout"):
+            self.mft_extents, self.record_count = self.get_mft_layout()
+        self.directories = {}     # record number -> (parent, parent sequence, name, sequence, in use, is directory)
+        self.paths = {}           # record number -> path of a directory from the root, resolved once
+        self.bitmap = None        # $Bitmap, read on first use
+        self.mft_bitmap = None    # $MFT's $BITMAP (records in use), read on first use
+
+    def read_offset(self, offset, size):
+        return int.from_bytes(self.device.read(self.begin + offset, size), "little")
+
+    def get_cluster_size(self):
+        # Read cluster size from boot sector
+        sectors_per_cluster = self.read_offset(0x0D, 1)
+        return sectors_per_cluster * self.sector_size
+
+    def get_mft_start(self):
+        # Read MFT start position 
+        mft_start_cluster = self.read_offset(0x30, 8)
+        return self.begin + mft_start_cluster * self.cluster_size
+
+    def get_record_size(self):
+        # Clusters per MFT record, or 2^-n bytes when the byte is negative
+        value = self.read_offset(0x40, 1)
+        if value >= 0x80:
+            return 1 << (256 - value)
+        return value * self.cluster_size or 1024
+
+    def get_mft_layout(self):
+        """Extents of the MFT from $MFT's own $DATA runlist: ([(first byte, length, disk offset)], record count).
+        (None, None) when record 0 cannot be parsed, the MFT is then assumed contiguous at mft_start."""
+        mft_entry = self.apply_fixups(self.device.read(self.mft_start, self.record_size))
+        if mft_entry is None or mft_entry[:4] != b"FILE":
+            return None, None
+
+        offset = int.from_bytes(mft_entry[0x14:0x16], "little")
+        while offset + 8 <= len(mft_entry):
+            attr_type = int.from_bytes(mft_entry[offset:offset + 4], "little")
+            attr_len = int.from_bytes(mft_entry[offset + 4:offset + 8], "little")
+            if attr_type == 0xFFFFFFFF or attr_len == 0:
+                break
+            if attr_type == 128 and mft_entry[offset + 8] and mft_entry[offset + 9] == 0:  # Unnamed non-resident $DATA
+                runlist_offset = offset + int.from_bytes(mft_entry[offset + 0x20:offset + 0x22], "little")
+                real_size = int.from_bytes(mft_entry[offset + 0x30:offset + 0x38], "little")
+                extents = []
+                position = 0
+                for start_cluster, cluster_count in self.decode_runlist(mft_entry[runlist_offset:offset + attr_len]):
+                    length = cluster_count * self.cluster_size
+                    if start_cluster is not None:
+                        extents.append((position, length, self.begin + start_cluster * self.cluster_size))
+                    position += length
+                return extents, min(real_size, position) // self.record_size
+            offset += attr_len
+        return None, None
+
+    def read_mft_bytes(self, position, size):
+        """Read size bytes of the MFT from byte position, following its extents. Shorter past the end."""
+        parts = [self.device.read(offset, length) for offset, length in self.mft_ranges(position, size)]
+        if len(parts) == 1:
+            return parts[0]
+        return b"".join(parts)
+
+    def mft_ranges(self, position, size):
+        """Disk ranges [(offset, size)] holding size bytes of the MFT from byte position."""
+        if self.mft_extents is None:
+            return [(self.mft_start + position, size)]
+
+        ranges = []
+        for start, length, disk_offset in self.mft_extents:
+            low = max(position, start)
+            high = min(position + size, start + length)
+            if low < high:
+                ranges.append((disk_offset + low - start, high - low))
+        return ranges
+
+    def record_offset(self, entry_number):
+        """Disk offset of an MFT record."""
+        position = entry_number * self.record_size
+        if self.mft_extents is None:
+            return self.mft_start + position
+        for start, length, disk_offset in self.mft_extents:
+            if start <= position < start + length:
+                return disk_offset + position - start
+        return None
+
+    def data_area(self):
+        """(disk offset, number of the first cluster, cluster count) of the volume's clusters."""
+        total_sectors = self.read_offset(0x28, 8)
+        return self.begin, 0, total_sectors * self.sector_size // self.cluster_size
+
+    def read_mft_entry(self, entry_number):
+        """Read a MFT entry, as stored on disk (without fixups)"""
+        return self.read_mft_bytes(entry_number * self.record_size, self.record_size)
+
+    def apply_fixups(self, mft_entry):
+        """Put back the last 2 bytes of every sector from the update sequence array.
+        None when a sector does not end with the update sequence number (torn or damaged record)."""
+        record = bytearray(mft_entry)
+        usa_offset = int.from_bytes(record[0x04:0x06], "little")
+        usa_count = int.from_bytes(record[0x06:0x08], "little")
+        if usa_offset + usa_count * 2 > len(record) or (usa_count - 1) * FIXUP_STRIDE > len(record):
+            return None
+
+        usn = record[usa_offset:usa_offset + 2]
+        for index in range(1, usa_count):
+            end = index * FIXUP_STRIDE
+            if record[end - 2:end] != usn:
+                return None
+            record[end - 2:end] = record[usa_offset + index * 2:usa_offset + index * 2 + 2]
+        return record
+
+    def mft_record_count(self):
+        """Number of MFT records, from the real size of $MFT's own $DATA (record 0). None if unknown."""
+        return self.record_count
+
+    def parse_deleted_record(self, mft_entry, entry_number):
+        """Build the result of a deleted MFT entry, None if the entry is in use or not a file record.
+        Deleted directories are not results, they are remembered for the paths of their files."""
+        # Kiểm tra xem entry có hợp lệ không (chữ ký 'FILE')
+        if mft_entry[:4] != b"FILE":
+            return None
+
+        # Kiểm tra cờ trạng thái (đã xóa hay không)
+        flags = int.from_bytes(mft_entry[0x16:0x18], "little")
+        if flags != 0x00:  # Không phải entry đã xóa
+            return None
+        if self.record_in_use(entry_number):  # $MFT's bitmap disagrees, the record is being reused
+            return None
+
+        # Only deleted records are worth the copy
+        mft_entry = self.apply_fixups(mft_entry)
+        if mft_entry is None:
+            return None
+
+        # Địa chỉ offset đầu tiên của entry này
+        offset_entry = self.record_offset(entry_number)
+
+        file_name = self.file_name(mft_entry)
+        if file_name is not None and file_name[3]:
+            self.remember_directory(mft_entry, entry_number, file_name)
+            return None
+
+        data = self.find_attribute(mft_entry, 128)  # Unnamed $DATA, named streams are alternate data streams
+        if data is None:
+            return None
+
+        offset, attr_len = data
+        reallocated = []
+        if mft_entry[offset + 8]:  # Non-resident: real size in the header
+            file_size = int.from_bytes(mft_entry[offset + 0x30:offset + 0x38], "little")
+            runlist_offset = offset + int.from_bytes(mft_entry[offset + 0x20:offset + 0x22], "little")
+            first_vcn = int.from_bytes(mft_entry[offset + 0x10:offset + 0x18], "little")
+            reallocated = self.allocated_runs(self.decode_runlist(mft_entry[runlist_offset:offset + attr_len]), first_vcn)
+        else:                      # Resident: content length
+            file_size = int.from_bytes(mft_entry[offset + 0x10:offset + 0x14], "little")
+
+        filename = None if file_name is None else file_name[2]
+        path = filename
+        if file_name is not None:
+            folder = self.directory_path(file_name[0], file_name[1])
+            path = f"{folder}/{filename}" if folder else filename
+
+        item = {
+            "name": filename,
+            "path": path,
+            "file_size": file_size,
+            "first_offset": offset_entry,
+            "reallocated": sum(count for _, count in reallocated),  # Clusters of the file now used by other files, 0 when none
+        }
+        if reallocated:
+            item["reallocated_runs"] = reallocated  # [(vcn, cluster count)] of those clusters
+        return item
+
+    def iter_attributes(self, mft_entry):
+        """(offset, type, length) of every attribute of a record, in order."""
+        offset = int.from_bytes(mft_entry[0x14:0x16], "little")
+        while offset + 8 <= len(mft_entry):
+            attr_type = int.from_bytes(mft_entry[offset:offset + 4], "little")
+            attr_len = int.from_bytes(mft_entry[offset + 4:offset + 8], "little")
+            if attr_type == 0xFFFFFFFF or attr_len == 0:  # Hết danh sách attribute
+                return
+            yield offset, attr_type, attr_len
+            offset += attr_len
+
+    def find_attribute(self, mft_entry, attr_type):
+        """(offset, length) of the first unnamed attribute of a type, None if the record has none."""
+        for offset, kind, attr_len in self.iter_attributes(mft_entry):
+            if kind == attr_type and mft_entry[offset + 9] == 0:
+                return offset, attr_len
+        return None
+
+    def file_name(self, mft_entry):
+        """(parent record, parent sequence, name, is directory) of the record's best $FILE_NAME:
+        a Win32 name rather than a POSIX one, a DOS 8.3 short name only when there is nothing else."""
+        best = None
+        best_rank = None
+        for offset, attr_type, _ in self.iter_attributes(mft_entry):
+            if attr_type != 48:
+                continue
+            content_offset = offset + int.from_bytes(mft_entry[offset + 20:offset + 22], "little")
+            rank = NAME_PREFERENCE.get(mft_entry[content_offset + 0x41], len(NAME_PREFERENCE))
+            if best is not None and rank >= best_rank:
+                continue
+
+            reference = int.from_bytes(mft_entry[content_offset:content_offset + 8], "little")
+            attributes = int.from_bytes(mft_entry[content_offset + 0x38:content_offset + 0x3C], "little")
+            name_len = mft_entry[content_offset + 64]  # Độ dài tên file (UTF-16)
+            name_offset = content_offset + 66
+            best = (reference & 0xFFFFFFFFFFFF, reference >> 48,
+                    str(mft_entry[name_offset:name_offset + (name_len * 2)], "utf-16le", errors="ignore"),
+                    bool(attributes & 0x10000000))
+            best_rank = rank
+        return best
+
+    def remember_directory(self, mft_entry, entry_number, file_name=None):
+        """Keep the parent and name of a directory record (fixups applied) for the paths below it."""
+        file_name = file_name or self.file_name(mft_entry)
+        if file_name is None:
+            return
+        flags = int.from_bytes(mft_entry[0x16:0x18], "little")
+        sequence = int.from_bytes(mft_entry[0x10:0x12], "little")
+        parent, parent_sequence, name, _ = file_name
+        self.directories[entry_number] = (parent, parent_sequence, name, sequence, bool(flags & 0x01), True)
+
+    def directory_entry(self, entry_number):
+        """Remembered parent and name of a record, read from the MFT (once) when the sweep has not seen it yet."""
+        if entry_number not in self.directories:
+            offset = self.record_offset(entry_number)
+            mft_entry = None if offset is None else self.apply_fixups(self.device.read(offset, self.record_size))
+            file_name = None if mft_entry is None or mft_entry[:4] != b"FILE" else self.file_name(mft_entry)
+            if file_name is None:
+                self.directories[entry_number] = None
+            else:
+                flags = int.from_bytes(mft_entry[0x16:0x18], "little")
+                sequence = int.from_bytes(mft_entry[0x10:0x12], "little")
+                is_directory = file_name[3] or bool(flags & 0x02)
+                self.directories[entry_number] = (file_name[0], file_name[1], file_name[2], sequence, bool(flags & 0x01), is_directory)
+        return self.directories[entry_number]
+
+    def directory_path(self, entry_number, sequence):
+        """Path from the root of the directory a child references as (record, sequence), "" for the root.
+        A reference to a record that is no longer that directory leads to ORPHAN_FOLDER.
+        Paths are memoized, so every directory is resolved once however many files it holds."""
+        chain = []  # (record, name) from the child's directory up
+        seen = set()
+        folder = ""
+        while entry_number != ROOT_RECORD:
+            entry = self.directory_entry(entry_number)
+            if entry is None or entry_number in seen or not reference_matches(entry, sequence):
+                folder = ORPHAN_FOLDER
+                break
+            if entry_number in self.paths:
+                folder = self.paths[entry_number]
+                break
+            seen.add(entry_number)
+            chain.append((entry_number, entry[2]))
+            entry_number, sequence = entry[0], entry[1]
+
+        for number, name in reversed(chain):
+            folder = f"{folder}/{name}" if folder else name
+            self.paths[number] = folder
+        return folder
+
+    def load_bitmap(self):
+        """$Bitmap of the volume, read once. Empty when it cannot be read."""
+        if self.bitmap is None:
+            self.bitmap = self.read_attribute(BITMAP_RECORD, 128)
+        return self.bitmap
+
+    def allocated_runs(self, runs, vcn=0):
+        """Parts of runs that $Bitmap marks in use, i.e. taken by another file after the deletion:
+        [(vcn, cluster count)] with vcn the position in the file, in clusters, runs starting at vcn."""
+        bitmap = self.load_bitmap()
+        allocated = []
+        for start_cluster, cluster_count in runs:
+            if start_cluster is not None and cluster_count > 0:
+                bits = int.from_bytes(bitmap[start_cluster // 8:(start_cluster + cluster_count + 7) // 8], "little")
+                bits = bits >> (start_cluster % 8) & ((1 << cluster_count) - 1)
+                while bits:
+                    first = (bits & -bits).bit_length() - 1   # Lowest cluster in use
+                    count = ((~bits >> first) & ((bits >> first) + 1)).bit_length() - 1  # Clusters in use from there
+                    if allocated and sum(allocated[-1]) == vcn + first:  # Goes on from the previous run
+                        allocated[-1] = (allocated[-1][0], allocated[-1][1] + count)
+                    else:
+                        allocated.append((vcn + first, count))
+                    bits &= ~(((1 << count) - 1) << first)
+            vcn += cluster_count
+        return allocated
+
+    def record_in_use(self, entry_number):
+        """True when $MFT's $BITMAP marks a record in use. Unknown records count as free."""
+        if self.mft_bitmap is None:
+            self.mft_bitmap = self.read_attribute(0, 0xB0)
+        index = entry_number // 8
+        return index < len(self.mft_bitmap) and bool(self.mft_bitmap[index] >> (entry_number % 8) & 1)
+
+    def attribute_layout(self, entry_number, attr_type):
+        """Segments of an unnamed attribute of a record (see attribute_segments), None if unreadable."""
+        offset = self.record_offset(entry_number)
+        mft_entry = None if offset is None else self.apply_fixups(self.device.read(offset, self.record_size))
+        if mft_entry is None or mft_entry[:4] != b"FILE":
+            return None
+        attribute = self.find_attribute(mft_entry, attr_type)
+        if attribute is None:
+            return None
+        return self.attribute_segments(mft_entry, attribute[0], attribute[1], None)
+
+    def read_attribute(self, entry_number, attr_type):
+        """Whole content of an unnamed attribute of a record (system files like $Bitmap), b"" if unreadable."""
+        try:
+            segments = self.attribute_layout(entry_number, attr_type)
+            if segments is None:
+                return b""
+            parts = []
+            for kind, value, length in segments:
+                if kind == "disk":
+                    parts.append(self.device.read_bulk(value, length))
+                elif kind == "zero":
+                    parts.append(bytes(length))
+                else:
+                    parts.append(value)
+            return b"".join(parts)
+        except (OSError, ValueError):
+            return b""
+
+    def image_extents(self):
+        """Byte ranges [(offset, length)] of the volume a metadata image keeps: $Boot, the MFT,
+        $Bitmap and the MFT's $BITMAP, then every cluster $Bitmap marks free (by 8-cluster bytes).
+        Raises ValueError when the MFT layout or $Bitmap cannot be read."""
+        bitmap = self.load_bitmap()
+        if self.mft_extents is None or not bitmap:
+            raise ValueError("The MFT or $Bitmap of this volume cannot be read, only a full image is possible.")
+
+        extents = [(0, max(BOOT_SIZE, self.cluster_size))]
+        extents.extend((disk_offset - self.begin, length) for _, length, disk_offset in self.mft_extents)
+        for entry_number, attr_type in ((BITMAP_RECORD, 128), (0, 0xB0)):
+            extents.extend((value - self.begin, length) for kind, value, length in self.attribute_layout(entry_number, attr_type) or ()
+                           if kind == "disk")
+
+        # Bytes of $Bitmap with a free bit, a run of them is one extent
+        span = 8 * self.cluster_size
+        extents.extend((match.start() * span, (match.end() - match.start()) * span)
+                       for match in re.finditer(rb"[^\xFF]+", bitmap))
+        return extents
+
+    def scan_records(self, start, stop=None):
+        """Deleted files in MFT records [start, stop). Without stop, scan to the end of the MFT."""
+        return [item for _, items in self.iter_records(start, stop) for item in items]
+
+    def iter_records(self, start, stop=None, cancel=None):
+        """Sweep MFT records [start, stop) chunk by chunk, yielding (records read, deleted files found) per chunk.
+        Without stop the sweep ends at the record count of $MFT, or where the MFT cannot be read."""
+        if stop is None:
+            stop = self.record_count
+        chunk_records = max(1, MFT_CHUNK_SIZE // self.record_size)
+
+        def chunk_starts():
+            return range(start, stop, chunk_records) if stop is not None else itertools.count(start, chunk_records)
+
+        def chunk_end(entry_number):
+            return entry_number + chunk_records if stop is None else min(entry_number + chunk_records, stop)
+
+        # The next chunks are read in the background while this one is parsed
+        blocks = self.device.read_ahead(self.mft_ranges(entry_number * self.record_size, (chunk_end(entry_number) - entry_number) * self.record_size)
+                                        for entry_number in chunk_starts())
+        try:
+            for entry_number, data in zip(chunk_starts(), blocks):
+                if data is None:
+                    data = b""  # Kết thúc nếu không đọc được entry tiếp theo
+                count = len(data) // self.record_size
+
+                found = []
+                for index in range(count):
+                    mft_entry = data[index * self.record_size:(index + 1) * self.record_size]
+                    try:
+                        if (mft_entry[0x16] & 0x03) == 0x03 and mft_entry[:4] == b"FILE":  # Directory in use
+                            directory = self.apply_fixups(mft_entry)
+                            if directory is not None:
+                                self.remember_directory(directory, entry_number + index)
+                        item = self.parse_deleted_record(mft_entry, entry_number + index)
+                    except Exception:
+                        item = None  # Damaged record, keep sweeping
+                    if item is not None:
+                        found.append(item)
+
+                end_of_mft = entry_number + count < chunk_end(entry_number)
+                yield count, found
+                if end_of_mft or cancelled(cancel):
+                    return
+        finally:
+            blocks.close()  # Stops the read-ahead when the sweep ends early
+
+    def iter_deleted(self, mode="quick", progress=None, cancel=None, limit=None, workers=None,
+                     start=None, checkpoint=None):
+        """Yield deleted files as soon as they are found. The scan modes all sweep the whole MFT,
+        except "carve" which finds files by signature in the clusters (see carver).
+        progress(done, total, bytes_per_second) reports MFT records read. The sweep stops
+        when cancel (a threading.Event) is set or after limit results.
+        The sweep can resume at record start; checkpoint(record) is called whenever every
+        file before that record has been yielded."""
+        if mode == "carve":
+            return self.stats.timed("carve", carve(self, progress, cancel, limit, start, checkpoint))
+        record_count = self.mft_record_count()
+        start = start or 0
+        meter = ScanProgress(progress, None if record_count is None else max(0, record_count - start), self.record_size)
+        found = self.stats.timed("mft sweep", self.iter_mft(meter, record_count, cancel, workers, start, checkpoint))
+        return stream_results(found, meter, limit)
+
+    def volume_signature(self):
+        """Bytes that identify this volume and change when it is written: boot sector, the $MFT record and
+        $MFT's $BITMAP. Deleting a file often changes neither of the first two, it always clears its
+        record's bit. The bitmap is read again here, not taken from the one cached by record_in_use."""
+        return b"".join((self.device.read(self.begin, self.sector_size), self.read_mft_entry(0),
+                         bytes(self.read_attribute(0, 0xB0))))
+
+    def iter_mft(self, meter, record_count, cancel=None, workers=None, start_record=0, checkpoint=None):
+        """Generator behind the MFT sweep, serial or sharded over worker processes."""
+        position = start_record
+
+        if workers and workers > 1 and record_count:
+            shards = split_range(position, record_count, workers * SHARDS_PER_WORKER)
+            results = iter_shards(scan_mft_shard, (self.disk, self.begin), shards, workers, cancel)
+            for (start, stop), items in results:
+                meter.advance(stop - start)
+                yield from items
+                if checkpoint is not None:
+                    checkpoint(stop)
+        else:
+            for count, items in self.iter_records(position, record_count, cancel):
+                meter.advance(count)
+                yield from items
+                position += count
+                if checkpoint is not None:
+                    checkpoint(position)
+
+    @profiled
+    def scan_quick(self, workers=None):
+        """Liệt kê tất cả các file đã bị xóa kèm kích thước và địa chỉ offset.
+        With workers > 1 the MFT is split into record shards swept by worker processes."""
+        deleted_files = list(self.iter_deleted("quick", workers=workers))
+
+        for item in deleted_files:
+            print(f"Scanning: Filename: {item['name']}, size: {byte_converter(item['file_size'])}")
+        return deleted_files
+
+    def scan_full(self, workers=None):
+        return self.scan_quick(workers)
+
+    @profiled
+    def scan_all(self, workers=None):
+        return self.scan_full(workers)
+    
+    @profiled
+    def recover_data(self, path, item, buffer_size=COPY_BUFFER_SIZE):
+        """
+        Phục hồi file đã xóa từ thông tin item.
+        item bao gồm:
+        - name: Tên file
+        - file_size: Kích thước file
+        - first_offset: Offset của MFT entry chứa file
+        The file is streamed buffer_size bytes at a time, memory use does not grow with its size.
+        """
+        with self.stats.phase("recovery"):
+            segments = self.file_segments(item)
+            written = write_segments(self.device, path, segments, buffer_size)
+        self.stats.count("bytes recovered", written)
+        unreadable = unreadable_bytes(self.device, segments)
+        if unreadable:
+            self.stats.count("unreadable bytes", unreadable)
+            print(f"Warning: {byte_converter(unreadable)} of {item['name']} could not be read and were written as zeros.")
+        return written
+
+    def file_segments(self, item):
+        """Segments of a file's unnamed $DATA for write_segments: the resident content,
+        or disk ranges of its runs with zeros for sparse runs and past the initialized size."""
+        if "data_offset" in item:  # Carved file, no MFT record behind it
+            return [("disk", item["data_offset"], item["file_size"])]
+
+        filename = item.get("name")
+        file_size = item.get("file_size")
+        file_offset = item.get("first_offset")
+
+        if not filename or file_size is None or file_offset is None:
+            raise ValueError("Thiếu thông tin trong item để phục hồi.")
+
+        # Đọc MFT entry từ first_offset
+        mft_entry = self.apply_fixups(self.device.read(file_offset, self.record_size))
+
+        # Kiểm tra chữ ký 'FILE' trong entry
+        if mft_entry is None or mft_entry[:4] != b"FILE":
+            raise ValueError(f"Entry tại offset {file_offset} không hợp lệ.")
+
+        # Tìm attribute $DATA
+        data = self.find_attribute(mft_entry, 128)
+        if data is None:
+            raise ValueError(f"Không tìm thấy $DATA của file {filename}.")
+        return self.attribute_segments(mft_entry, data[0], data[1], file_size)
+
+    def attribute_segments(self, mft_entry, offset, attr_len, file_size):
+        """Segments of an attribute: its resident content, or disk ranges of its runs with zeros
+        for sparse runs and past the initialized size. file_size None means the attribute's real size."""
+        if not mft_entry[offset + 8]:  # Resident: the content is inside the record
+            content_offset = offset + int.from_bytes(mft_entry[offset + 0x14:offset + 0x16], "little")
+            content_length = int.from_bytes(mft_entry[offset + 0x10:offset + 0x14], "little")
+            if file_size is not None:
+                content_length = min(content_length, file_size)
+            content = bytes(mft_entry[content_offset:content_offset + content_length])
+            return [("data", content, len(content))]
+
+        if file_size is None:
+            file_size = int.from_bytes(mft_entry[offset + 0x30:offset + 0x38], "little")
+
+        # Giải mã Runlist
+        runlist_offset = offset + int.from_bytes(mft_entry[offset + 0x20:offset + 0x22], "little")
+        runs = self.decode_runlist(mft_entry[runlist_offset:offset + attr_len])
+        initialized_size = min(file_size, int.from_bytes(mft_entry[offset + 0x38:offset + 0x40], "little"))
+
+        segments = []
+        position = 0  # Byte of the file where the current run starts
+        for start_cluster, cluster_count in runs:
+            if position >= file_size:
+                break
+            run_size = min(cluster_count * self.cluster_size, file_size - position)  # Giới hạn theo file_size
+            on_disk = 0 if start_cluster is None else max(0, min(run_size, initialized_size - position))
+            if on_disk:
+                segments.append(("disk", self.begin + start_cluster * self.cluster_size, on_disk))
+            if run_size > on_disk:
+                segments.append(("zero", None, run_size - on_disk))  # Sparse run or never written
+            position += run_size
+        return segments
+
+    def decode_runlist(self, runlist):
+        """
+        Giải mã Runlist từ $DATA để lấy danh sách các đoạn dữ liệu (cluster).
+        A sparse run (no offset field) is returned as (None, cluster count).
+        """
+        runs = []
+        index = 0
+        last_cluster = 0
+
+        while index < len(runlist):
+            header = runlist[index]
+            if header == 0x00:  # Kết thúc Runlist
+                break
+
+            # Đọc size, offset size từ header
+            cluster_size_len = header & 0x0F
+            cluster_offset_len = (header >> 4) & 0x0F
+            index += 1
+
+            # Đọc cluster size và cluster offset
+            cluster_size = int.from_bytes(runlist[index:index + cluster_size_len], "little", signed=False)
+            cluster_offset = int.from_bytes(runlist[index + cluster_size_len:index + cluster_size_len + cluster_offset_len], "little", signed=True)
+            index += cluster_size_len + cluster_offset_len
+
+            if cluster_offset_len == 0:  # Sparse run, nothing stored on disk
+                runs.append((None, cluster_size))
+                continue
+
+            # Tính toán vị trí cluster thực
+            start_cluster = last_cluster + cluster_offset
+            runs.append((start_cluster, cluster_size))
+
+            # Lưu cluster cuối để tính toán giá trị tiếp theo
+            last_cluster = start_cluster
+
+        return runs
+
+def reference_matches(entry, sequence):
+    """True when a parent reference (record, sequence) still points to the directory entry describes:
+    same sequence number, or one more when the directory was deleted since (freeing a record bumps it).
+    Sequence 0 is not checked."""
+    _, _, _, current, in_use, is_directory = entry
+    return is_directory and (sequence == 0 or current == sequence or (not in_use and current == sequence + 1))
+
+def scan_mft_shard(disk, first_offset, start, stop):
+    """Process-pool worker: sweep one shard of MFT records through its own handle."""
+    return NTFS(disk, first_offset).scan_records(start, stop)
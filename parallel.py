@@ -0,0 +1,35 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from block_device import close_devices
+
+SHARDS_PER_WORKER = 4  # More shards than workers so a slow shard does not idle the others
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def split_range(start, stop, parts, align=1):
+    """Split [start, stop) into at most parts consecutive (start, stop) shards.
+    Every shard except the last is a multiple of align long."""
+    length = max(0, stop - start)
+    if length == 0:
+        return []
+
+    size = -(-length // max(1, parts))      # Ceiling division
+    size = -(-size // align) * align        # Round up to the alignment
+    return [(begin, min(begin + size, stop)) for begin in range(start, stop, size)]
+
+def iter_shards(worker, args, shards, workers, cancel=None):
+    """Run worker(*args, *shard) for every shard (a tuple, e.g. (start, stop)) in a process pool.
+    Each worker opens its own disk handles. Yields (shard, results) in shard order,
+    stops early once cancel (a threading.Event) is set."""
+    # Forked workers must not share the parent's handles (and their file position)
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=close_devices)
+    try:
+        futures = [pool.submit(worker, *args, *shard) for shard in shards]
+        for shard, future in zip(shards, futures):
+            if cancel is not None and cancel.is_set():
+                return
+            yield shard, future.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)  # Shards not started yet are dropped
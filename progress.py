@@ -0,0 +1,50 @@
+import time
+
+class ScanProgress:
+    """Counts work units (clusters, MFT records) and reports them through a callback:
+    callback(done, total, bytes_per_second). total is None when it is not known in advance."""
+
+    def __init__(self, callback, total, unit_size, interval=1.0):
+        self.callback = callback
+        self.total = total
+        self.unit_size = unit_size  # Bytes read per unit, for the rate
+        self.interval = interval    # Minimum seconds between two reports
+        self.done = 0
+        self.started = time.monotonic()
+        self.reported = self.started
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.done * self.unit_size / elapsed if elapsed > 0 else 0.0
+
+    def advance(self, units):
+        self.done += units
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if now - self.reported >= self.interval:
+            self.reported = now
+            self.callback(self.done, self.total, self.rate())
+
+    def finish(self):
+        if self.callback is not None:
+            self.callback(self.done, self.total, self.rate())
+
+def cancelled(cancel):
+    """True once a cancel token (e.g. threading.Event) is set. None never cancels."""
+    return cancel is not None and cancel.is_set()
+
+def stream_results(found, meter, limit=None):
+    """Pass on results of a scan generator, stopping after limit of them, then report final progress."""
+    count = 0
+    try:
+        if limit is not None and limit <= 0:
+            return
+        for item in found:
+            yield item
+            count += 1
+            if limit is not None and count >= limit:
+                break
+    finally:
+        found.close()
+        meter.finish()
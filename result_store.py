@@ -0,0 +1,195 @@
+import fnmatch
+import re
+from array import array
+
+PAGE_SIZE = 50  # Results listed at a time
+NUMBER_COLUMNS = ("file_size", "first_cluster", "first_offset", "data_offset", "reallocated")
+ABSENT = -1     # Number of a key the item does not have, the columns only hold values >= 0
+NO_PATH = -1    # Folder of an item without a "path" key
+SORT_KEYS = ("index", "name", "size", "path")
+
+def glob_matcher(pattern):
+    """Case-insensitive match of a shell pattern (*, ?, [abc]) against a whole string."""
+    return re.compile(fnmatch.translate(pattern), re.IGNORECASE | re.DOTALL).match
+
+class ResultStore:
+    """Scan results kept in columns instead of one dict per item, for scans finding millions of files.
+    Names and folders are stored once in a string table and rows hold their numbers, the numeric keys
+    are array("q") columns: a row costs about 56 bytes against 600+ for a dict. Items are rebuilt as
+    dicts on access; keys or values the columns cannot hold are kept as they are in extras."""
+
+    def __init__(self):
+        self.strings = []       # Distinct names and folders
+        self.string_ids = {}    # string -> position in strings
+        self.names = array("l")
+        self.folders = array("l")  # "" when the path is the name alone, NO_PATH without a path
+        self.numbers = {key: array("q") for key in NUMBER_COLUMNS}
+        self.extras = {}        # row -> other keys of the item
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, text):
+        number = self.string_ids.get(text)
+        if number is None:
+            number = self.string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return number
+
+    def append(self, item):
+        row = len(self.names)
+        extras = {key: value for key, value in item.items() if key not in NUMBER_COLUMNS and key not in ("name", "path")}
+        name = item.get("name")
+        self.names.append(self.intern(name))
+
+        path = item.get("path")
+        if "path" not in item:
+            folder = NO_PATH
+        elif path == name:
+            folder = self.intern("")
+        elif isinstance(path, str) and isinstance(name, str) and path.endswith("/" + name):
+            folder = self.intern(path[:-len(name) - 1])
+        else:
+            folder = NO_PATH
+            extras["path"] = path
+        self.folders.append(folder)
+
+        for key, column in self.numbers.items():
+            value = item.get(key)
+            if type(value) is int and 0 <= value < 1 << 63:
+                column.append(value)
+            else:
+                column.append(ABSENT)
+                if key in item:
+                    extras[key] = value
+        if extras:
+            self.extras[row] = extras
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __getitem__(self, row):
+        """The item of a row, as the dict the scan gave."""
+        name = self.strings[self.names[row]]
+        item = {"name": name}
+        folder = self.folders[row]
+        if folder != NO_PATH:
+            item["path"] = self.join(folder, name)
+        for key, column in self.numbers.items():
+            value = column[row]
+            if value != ABSENT:
+                item[key] = value
+        item.update(self.extras.get(row, ()))
+        return item
+
+    def join(self, folder, name):
+        folder = self.strings[folder]
+        return f"{folder}/{name}" if folder else name
+
+    def path(self, row):
+        """Path of a row, its name when the scan gave no path."""
+        extras = self.extras.get(row)
+        if extras is not None and "path" in extras:
+            return extras["path"] or ""
+        name = self.strings[self.names[row]] or ""
+        folder = self.folders[row]
+        return name if folder == NO_PATH else self.join(folder, name)
+
+    def filtered(self, name=None, extensions=None, min_size=None, max_size=None, path=None):
+        """Rows matching every filter given, in scan order: name and path are shell patterns,
+        extensions a list like ["jpg", ".png"], sizes in bytes (inclusive)."""
+        accepted = None
+        if name is not None or extensions:
+            # Each distinct name is tested once, not once per row
+            match = glob_matcher(name) if name is not None else None
+            suffixes = tuple(f".{extension.lower().lstrip('.')}" for extension in extensions) if extensions else None
+            accepted = bytearray(len(self.strings))
+            for number, text in enumerate(self.strings):
+                text = text or ""
+                accepted[number] = ((match is None or match(text) is not None)
+                                    and (suffixes is None or text.lower().endswith(suffixes)))
+        path_match = glob_matcher(path) if path is not None else None
+        sizes = self.numbers["file_size"]
+
+        rows = array("l")
+        for row in range(len(self.names)):
+            if accepted is not None and not accepted[self.names[row]]:
+                continue
+            size = max(sizes[row], 0)
+            if min_size is not None and size < min_size:
+                continue
+            if max_size is not None and size > max_size:
+                continue
+            if path_match is not None and path_match(self.path(row)) is None:
+                continue
+            rows.append(row)
+        return rows
+
+    def sorted_rows(self, rows, key="index", reverse=False):
+        """Rows ordered by one of SORT_KEYS, ties in scan order."""
+        if key == "size":
+            sizes = self.numbers["file_size"]
+            order = sorted(rows, key=sizes.__getitem__, reverse=reverse)
+        elif key == "name":
+            strings, names = self.strings, self.names
+            order = sorted(rows, key=lambda row: (strings[names[row]] or "").lower(), reverse=reverse)
+        elif key == "path":
+            order = sorted(rows, key=lambda row: self.path(row).lower(), reverse=reverse)
+        else:
+            order = reversed(rows) if reverse else rows
+        return array("l", order)
+
+class ResultView:
+    """Filtered and sorted rows of a ResultStore, listed a page at a time.
+    Index numbers shown to the user are positions in the view, view[index] is the item to recover."""
+
+    def __init__(self, store, page_size=PAGE_SIZE):
+        self.store = store
+        self.page_size = page_size
+        self.filters = {}         # Keyword arguments of ResultStore.filtered
+        self.order = ("index", False)
+        self.page = 0
+        self.rows = None
+        self.refresh()
+
+    def refresh(self):
+        """Apply the filters and order again, back to the first page."""
+        rows = self.store.filtered(**self.filters) if self.filters else array("l", range(len(self.store)))
+        self.rows = self.store.sorted_rows(rows, *self.order)
+        self.page = 0
+
+    def set_filter(self, key, value):
+        """Set (or with None remove) one filter of ResultStore.filtered."""
+        if value is None:
+            self.filters.pop(key, None)
+        else:
+            self.filters[key] = value
+        self.refresh()
+
+    def clear_filters(self):
+        self.filters = {}
+        self.refresh()
+
+    def sort(self, key, reverse=False):
+        if key not in SORT_KEYS:
+            raise ValueError(f"Sort by one of {', '.join(SORT_KEYS)}.")
+        self.order = (key, reverse)
+        self.refresh()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        return self.store[self.rows[index]]
+
+    def pages(self):
+        return max(1, -(-len(self.rows) // self.page_size))
+
+    def page_items(self, page=None):
+        """(index, item) of a page (the current one by default), which becomes the current page."""
+        if page is not None:
+            self.page = min(max(page, 0), self.pages() - 1)
+        start = self.page * self.page_size
+        for index in range(start, min(start + self.page_size, len(self.rows))):
+            yield index, self[index]
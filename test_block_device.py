@@ -0,0 +1,82 @@
+import json
+import os
+import random
+
+import block_device
+from image_builder import FaultyImage, inject_faults
+
+MIB = 1024 * 1024
+
+def make_image(path, size=8 * MIB):
+    data = random.Random(0).randbytes(size)
+    with open(path, "wb") as image:
+        image.write(data)
+    return data
+
+def saved_ranges(path, key):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as saved:
+        return json.load(saved).get(key, [])
+
+def scattered_faults(count=8, start=2 * MIB, span=4 * MIB, seed=1):
+    """count single bad sectors spread over [start, start + span)."""
+    sectors = random.Random(seed).sample(range(start // 512, (start + span) // 512), count)
+    return sorted((sector * 512, sector * 512 + 512) for sector in sectors)
+
+def test_saved_map_holds_only_the_bad_sectors(tmp_path):
+    image = str(tmp_path / "disk.img")
+    data = make_image(image)
+    saved = str(tmp_path / "bad_ranges.json")
+    faults = scattered_faults()
+    device = FaultyImage(image, faults, bad_ranges_file=saved)
+
+    result = bytes(device.read_bulk(2 * MIB, 4 * MIB))
+
+    assert saved_ranges(saved, device.bad_ranges.key) == [list(fault) for fault in faults]
+    assert device.bytes_unreadable == 8 * 512
+    expected = bytearray(data[2 * MIB:6 * MIB])
+    for start, end in faults:
+        expected[start - 2 * MIB:end - 2 * MIB] = bytes(end - start)
+    assert result == bytes(expected)
+
+    # A second read does not touch the bad sectors again
+    failed = device.failed_reads
+    assert bytes(device.read_bulk(2 * MIB, 4 * MIB)) == bytes(expected)
+    assert device.failed_reads == failed
+
+def test_skipped_ranges_stay_in_memory_and_are_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(block_device, "MAX_FAILED_READS", 4)
+    monkeypatch.setattr(block_device, "RESCUE_PASSES", 1)
+    image = str(tmp_path / "disk.img")
+    data = make_image(image)
+    saved = str(tmp_path / "bad_ranges.json")
+    faults = scattered_faults()
+    device = inject_faults(image, faults, bad_ranges_file=saved)
+    try:
+        device.read_bulk(2 * MIB, 4 * MIB)
+        assert device.untried.ranges()
+        bad = device.bad_ranges.ranges()
+        assert all(end - start == 512 and (start, end) in faults for start, end in bad)
+        assert saved_ranges(saved, device.bad_ranges.key) == bad
+
+        # Every read of the untried ranges trims them further, the data read is kept
+        for _ in range(100):
+            if not device.untried.ranges():
+                break
+            result = bytes(device.read_bulk(2 * MIB, 4 * MIB))
+        assert device.untried.ranges() == []
+        assert saved_ranges(saved, device.bad_ranges.key) == [list(fault) for fault in faults]
+        assert result[:faults[0][0] - 2 * MIB] == data[2 * MIB:faults[0][0]]
+    finally:
+        with block_device.devices_lock:
+            block_device.devices.pop(image, None)
+        device.close()
+
+def test_untried_ranges_are_not_saved(tmp_path):
+    ranges = block_device.BadRangeMap(None, None)
+    ranges.add(0, 4096)
+    ranges.discard(1024, 2048)
+    assert ranges.ranges() == [[0, 1024], [2048, 4096]]
+    ranges.save()
+    assert not os.listdir(tmp_path)